@@ -3,12 +3,12 @@
 """Module containing the AmberToPDB class and the command line interface."""
 
 from typing import Optional
-from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
 from biobb_amber.ambpdb.common import check_input_path, check_output_path
+from biobb_amber.cache import CachedBiobbObject
 
 
-class AmberToPDB(BiobbObject):
+class AmberToPDB(CachedBiobbObject):
     """
     | biobb_amber AmberToPDB
     | Wrapper of the `AmberTools (AMBER MD Package) ambpdb tool <https://ambermd.org/AmberTools.php>`_ module.
@@ -20,9 +20,12 @@ class AmberToPDB(BiobbObject):
         output_pdb_path (str): Structure PDB file. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/ambpdb/structure.ambpdb.pdb>`_. Accepted formats: pdb (edam:format_1476).
         properties (dic - Python dictionary object containing the tool parameters, not input/output files):
             * **binary_path** (*str*) - ("ambpdb") Path to the ambpdb executable binary.
+            * **cache_path** (*str*) - (None) Path to the result cache folder. If set, the outputs of a previous execution with the same input file contents, properties and ambpdb binary are restored from the cache instead of running ambpdb.
+            * **cache_size** (*int*) - (1024) [1~1000000|1] Maximum size of the result cache folder in MB. The least recently used results are evicted.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
             * **container_path** (*str*) - (None) Container path definition.
             * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
             * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
@@ -94,6 +97,8 @@ class AmberToPDB(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+        if self.restore_cache():
+            return 0
         self.stage_files()
 
         # Command line
@@ -112,6 +117,9 @@ class AmberToPDB(BiobbObject):
         # Remove temporary file(s)
         self.remove_tmp_files()
 
+        # Store the outputs in the result cache
+        self.store_cache()
+
         self.check_arguments(output_files_created=True, raise_exception=False)
 
         return self.return_code
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+"""Module containing the content-addressed result cache of the deterministic biobb_amber building blocks."""
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import uuid
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from biobb_common.tools import file_utils as fu
+
+from biobb_amber.staging import StagingBiobbObject, stage_file
+
+# Properties not changing the outputs of a block
+_UNKEYED_PROPERTIES = {
+    "remove_tmp", "restart", "sandbox_path", "staging", "tleap_session", "disable_sandbox", "chdir_sandbox", "cache_path", "cache_size", "prmtop_cache_path",
+    "can_write_console_log", "global_log", "prefix", "step", "path", "working_dir_path", "dev", "check_extensions",
+    "container_working_dir", "container_user_id", "container_shell_path", "container_volume_path", "container_generic_command",
+}
+
+
+def file_digest(path: str, hasher=None):
+    """Adds the content of the *path* file to the *hasher* (a new SHA-256 one if not provided) and returns it."""
+    hasher = hasher or hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+def source_files(module) -> List[str]:
+    """Returns the source files of the *module* and of the biobb_amber modules it uses, directly or through other
+    biobb_amber modules (e.g. the common helpers of a block)."""
+    files, pending, seen = [], [module], set()
+    while pending:
+        module = pending.pop()
+        if module.__name__ in seen:
+            continue
+        seen.add(module.__name__)
+        if getattr(module, "__file__", None):
+            files.append(module.__file__)
+        for value in vars(module).values():
+            name = value.__name__ if inspect.ismodule(value) else getattr(value, "__module__", None)
+            if isinstance(name, str) and name.split(".")[0] == "biobb_amber" and name not in seen and name in sys.modules:
+                pending.append(sys.modules[name])
+    return sorted(files)
+
+
+def binary_signature(binary_path: Optional[str]) -> str:
+    """Returns a string identifying the installed version of the *binary_path* executable (resolved path, size and
+    modification time) without running it."""
+    if not binary_path:
+        return ""
+    resolved = shutil.which(binary_path) or binary_path
+    if not os.path.exists(resolved):
+        return binary_path
+    resolved = os.path.realpath(resolved)
+    stat = os.stat(resolved)
+    return "%s:%d:%d" % (resolved, stat.st_size, stat.st_mtime_ns)
+
+
+def entry_size(path: Path) -> int:
+    """Size in bytes of the files of a cache entry."""
+    return sum(file.stat().st_size for file in path.iterdir() if file.is_file())
+
+
+def evict(cache_path: str, max_size: int, out_log=None, keep: Optional[str] = None) -> None:
+    """Removes the least recently used entries of the *cache_path* folder until its size is below *max_size* bytes.
+    The *keep* entry (e.g. the one just stored) is never removed."""
+    entries = [entry for entry in Path(cache_path).iterdir() if entry.is_dir() and not entry.name.startswith(".") and entry.name != keep]
+    entries = sorted(((entry.stat().st_mtime, entry_size(entry), entry) for entry in entries), key=lambda item: item[0])
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in entries:
+        if total <= max_size:
+            break
+        fu.log("Evicting cached result %s" % entry.name, out_log)
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+class CachedBiobbObject(StagingBiobbObject):
+    """
+    | biobb_amber CachedBiobbObject
+    | Base class of the deterministic biobb_amber building blocks adding the **cache_path** and **cache_size** properties.
+    | Reuses the outputs of a previous execution with the same input file contents, properties, binary and force field files instead of running the tool again.
+    """
+
+    def __init__(self, properties: Optional[dict] = None, **kwargs) -> None:
+        properties = properties or {}
+        super().__init__(properties, **kwargs)
+        self.cache_path = properties.get("cache_path", None)
+        self.cache_size = properties.get("cache_size", 1024)
+        if int(self.cache_size) < 1:
+            fu.log("WARNING: cache_size must be at least 1 MB, using 1 MB instead", self.out_log, self.global_log)
+            self.cache_size = 1
+        self.cache_key = None
+
+    def compute_cache_key(self, files: Iterable[str] = ()) -> str:
+        """SHA-256 hash of the block code (including the biobb_amber modules it uses), binary, properties, input file
+        contents and additional *files* (e.g. force field leaprc files) determining the outputs of the block."""
+        hasher = hashlib.sha256()
+        hasher.update(self.__class__.__name__.encode())
+        for source_file in source_files(sys.modules[self.__class__.__module__]):
+            file_digest(source_file, hasher)
+        hasher.update(binary_signature(getattr(self, "binary_path", None)).encode())
+        hasher.update(os.getenv("AMBERHOME", "").encode())
+        properties = {key: value for key, value in self.properties.items() if key not in _UNKEYED_PROPERTIES}
+        hasher.update(json.dumps(properties, sort_keys=True, default=str).encode())
+        for file_ref, file_path in sorted(self.io_dict["in"].items()):
+            if file_path and os.path.isfile(file_path):
+                hasher.update(file_ref.encode())
+                file_digest(file_path, hasher)
+        for file_ref, file_path in sorted(self.io_dict["out"].items()):
+            if file_path:
+                hasher.update(("%s%s" % (file_ref, Path(file_path).suffix)).encode())
+        for file_path in files:
+            if file_path and os.path.isfile(file_path):
+                file_digest(file_path, hasher)
+            else:
+                hasher.update(str(file_path).encode())
+        return hasher.hexdigest()
+
+    def restore_cache(self, files: Iterable[str] = ()) -> bool:
+        """Copies the cached outputs to the output paths if an identical execution was cached.
+        Returns True on a cache hit, False if the block has to be executed."""
+        if not self.cache_path:
+            return False
+        self.cache_key = self.compute_cache_key(files)
+        entry = Path(self.cache_path).joinpath(self.cache_key)
+        outputs = {file_ref: file_path for file_ref, file_path in self.io_dict["out"].items() if file_path}
+        if not entry.is_dir() or not all(entry.joinpath(file_ref).is_file() for file_ref in outputs):
+            fu.log("Result not found in cache %s" % self.cache_path, self.out_log)
+            return False
+        for file_ref, file_path in outputs.items():
+            stage_file(str(entry.joinpath(file_ref)), file_path, "reflink")
+        # Recently used entries are evicted last
+        os.utime(entry)
+        fu.log("Outputs restored from cached result %s, %s not executed" % (self.cache_key, self.__class__.__name__), self.out_log, self.global_log)
+        return True
+
+    def store_cache(self) -> None:
+        """Adds the outputs of the execution to the cache and evicts the least recently used results above cache_size MB."""
+        if not self.cache_path or not self.cache_key or self.return_code:
+            return
+        outputs = {file_ref: file_path for file_ref, file_path in self.io_dict["out"].items() if file_path}
+        if not all(os.path.isfile(file_path) for file_path in outputs.values()):
+            return
+        cache_path = Path(self.cache_path)
+        cache_path.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed so concurrent executions never see half-written entries
+        tmp_entry = cache_path.joinpath(".%s" % uuid.uuid4())
+        tmp_entry.mkdir()
+        for file_ref, file_path in outputs.items():
+            stage_file(file_path, str(tmp_entry.joinpath(file_ref)), "reflink")
+        try:
+            tmp_entry.rename(cache_path.joinpath(self.cache_key))
+            fu.log("Outputs stored in cache %s" % self.cache_path, self.out_log)
+        except OSError:
+            # Already stored by a concurrent execution
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        evict(self.cache_path, int(self.cache_size) * 1024 * 1024, self.out_log, keep=self.cache_key)
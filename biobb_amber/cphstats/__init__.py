@@ -1,4 +1,6 @@
 from . import cphstats_run
 from . import cestats_run
+from . import cphstats_remd
+from . import cphstats_archive
 name = "cphstats"
-__all__ = ["cphstats_run", "cestats_run"]
+__all__ = ["cphstats_run", "cestats_run", "cphstats_remd", "cphstats_archive"]
@@ -1,5 +1,15 @@
 """ Common functions for package biobb_amber.cphstats """
+import gzip
+import json
+import os
+import re
+import uuid
+import zipfile
+from contextlib import contextmanager
 from pathlib import Path, PurePath
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
 from biobb_common.tools import file_utils as fu
 
 
@@ -36,15 +46,997 @@ def check_output_path(path, argument, optional, out_log, classname):
 def is_valid_file(ext, argument):
     """ Checks if file format is compatible """
     formats = {
-        'input_cpin_path': ['cpin', 'txt', 'in'],
-        'input_cpout_path': ['cpout', 'zip', 'gzip', 'gz'],
+        'input_cpin_path': ['cpin', 'cein', 'txt', 'in'],
+        'input_cpout_path': ['cpout', 'ceout', 'zip', 'gzip', 'gz', 'cpz'],
         'input_cein_path': ['cein', 'txt', 'in'],
-        'input_ceout_path': ['ceout', 'zip', 'gzip', 'gz'],
+        'input_ceout_path': ['ceout', 'zip', 'gzip', 'gz', 'cpz'],
         'output_dat_path': ['dat', 'out', 'txt', 'o'],
         'output_population_path': ['dat', 'out', 'txt', 'o'],
         'output_chunk_path': ['dat', 'out', 'txt', 'o'],
         'output_cumulative_path': ['dat', 'out', 'txt', 'o'],
         'output_conditional_path': ['dat', 'out', 'txt', 'o'],
         'output_chunk_conditional_path': ['dat', 'out', 'txt', 'o'],
+        'output_running_avg_path': ['dat', 'out', 'txt', 'o'],
+        'input_cpouts_path': ['cpout', 'zip', 'gzip', 'gz', 'cpz'],
+        'output_pka_path': ['dat', 'out', 'txt', 'o'],
+        'output_archive_path': ['cpz'],
     }
     return ext in formats[argument]
+
+
+# NATIVE CPOUT/CEOUT ANALYSIS
+# Boltzmann constant in eV/K, kT/e is the Nernst factor in V
+BOLTZMANN_EV = 8.617333262e-5
+
+_NAMELIST_KEY = re.compile(r"([A-Za-z_]\w*(?:\(\d+\)%\w+)?)\s*=")
+_NAMELIST_VALUE = re.compile(r"'[^']*'|\"[^\"]*\"|[^,\s]+")
+_NAMELIST_END = re.compile(r"^\s*(?:/|&end)\s*$", re.MULTILINE | re.IGNORECASE)
+_RESNAME = re.compile(r"Residue:\s*(\S+)\s+(-?\d+)")
+_MC_STEP = re.compile(rb"Monte Carlo step size:\s*(\d+)")
+_TEMPERATURE = re.compile(rb"Temperature:\s*(\S+)")
+_SOLVENT = re.compile(rb"(?:Solvent pH|Redox potential):\s*(\S+)")
+_RESIDUE_STATE = re.compile(rb"Residue\s+(\d+)\s+State:\s+(\d+)")
+
+# Fixed layout of the residue lines written by sander and pmemd: 'Residue ', i4, ' State: ', i2
+_RESIDUE_LINE_LENGTH = 22
+_RESIDUE_COLUMNS = np.arange(_RESIDUE_LINE_LENGTH)
+
+
+def read_namelist(path) -> Dict[str, List[str]]:
+    """Reads the &CNSTPH (cpin) or &CNSTE (cein) namelist, returning the values of each (uppercase) key as strings."""
+    text = Path(path).read_text()
+    start = text.index("&")
+    end = _NAMELIST_END.search(text, start)
+    body = text[start:end.start() if end else len(text)].split(None, 1)[1]
+    parts = _NAMELIST_KEY.split(body)
+    return {key.upper(): [value.strip("'\"") for value in _NAMELIST_VALUE.findall(values)] for key, values in zip(parts[1::2], parts[2::2])}
+
+
+class TitratableResidues(NamedTuple):
+    """Titratable residues of a cpin (constant pH) or cein (constant redox potential) file."""
+    names: List[Tuple[str, int]]
+    first_state: np.ndarray
+    num_states: np.ndarray
+    counts: np.ndarray
+    redox: bool
+
+    @classmethod
+    def read(cls, path) -> "TitratableResidues":
+        """Builds the residue table from the RESNAME, STATEINF and PROTCNT (or ELECCNT) entries of the namelist."""
+        namelist = read_namelist(path)
+        redox = "ELECCNT" in namelist
+        names = [(match.group(1), int(match.group(2))) for match in map(_RESNAME.search, namelist.get("RESNAME", [])) if match]
+        n_residues = int(namelist.get("TRESCNT", [len(names)])[0])
+        first_state = [int(namelist.get("STATEINF(%d)%%FIRST_STATE" % i, ["0"])[0]) for i in range(n_residues)]
+        num_states = [int(namelist.get("STATEINF(%d)%%NUM_STATES" % i, ["0"])[0]) for i in range(n_residues)]
+        counts = [int(value) for value in namelist["ELECCNT" if redox else "PROTCNT"]]
+        return cls(names[:n_residues], np.array(first_state), np.array(num_states), np.array(counts), redox)
+
+    def to_dict(self) -> dict:
+        """JSON serializable residue table."""
+        return {"names": [list(name) for name in self.names], "first_state": self.first_state.tolist(), "num_states": self.num_states.tolist(),
+                "counts": self.counts.tolist(), "redox": self.redox}
+
+    @classmethod
+    def from_dict(cls, table: dict) -> "TitratableResidues":
+        """Builds the residues from the table of to_dict."""
+        return cls([(str(name), int(number)) for name, number in table["names"]], np.array(table["first_state"], dtype=np.int64),
+                   np.array(table["num_states"], dtype=np.int64), np.array(table["counts"], dtype=np.int64), bool(table["redox"]))
+
+    @property
+    def count_table(self) -> np.ndarray:
+        """Protons (or electrons) of each state of each residue, -1 for the padding states."""
+        table = np.full((len(self.names), max(self.num_states, default=0)), -1, dtype=np.int64)
+        for i, (first, num) in enumerate(zip(self.first_state, self.num_states)):
+            table[i, :num] = self.counts[first:first + num]
+        return table
+
+    @property
+    def protonated_table(self) -> np.ndarray:
+        """Whether each state of each residue is protonated (or reduced): it has the maximum number of protons (or electrons)."""
+        table = self.count_table
+        return (table == table.max(axis=1, keepdims=True)) & (table >= 0)
+
+    def index(self, number: int) -> int:
+        """Position of the residue *number* (as numbered in the topology)."""
+        for i, (_, residue_number) in enumerate(self.names):
+            if residue_number == number:
+                return i
+        raise ValueError("Residue %d is not a titratable residue" % number)
+
+
+@contextmanager
+def open_titration_output(path) -> Iterator[BinaryIO]:
+    """Opens a plain, gzip or zip compressed cpout/ceout file for binary reading."""
+    with open(path, "rb") as fp:
+        magic = fp.read(4)
+    if magic[:2] == b"\x1f\x8b":
+        with gzip.open(path, "rb") as stream:
+            yield stream
+    elif magic == b"PK\x03\x04":
+        with zipfile.ZipFile(path) as archive, archive.open(archive.namelist()[0]) as stream:
+            yield stream
+    else:
+        with open(path, "rb") as stream:
+            yield stream
+
+
+def _fixed_int(columns: np.ndarray) -> np.ndarray:
+    """Integers of right aligned fixed width byte columns."""
+    digits = columns.astype(np.int64) - ord("0")
+    digits[(digits < 0) | (digits > 9)] = 0
+    return digits @ (10 ** np.arange(columns.shape[1] - 1, -1, -1))
+
+
+class CpoutReader:
+    """
+    Streaming reader of the AMBER cpout (constant pH) and ceout (constant redox potential) files.
+
+    The file is decompressed and decoded in blocks of whole records. The residue lines of each block are converted
+    with NumPy and the delta records are forward filled, so every block becomes a compact (frames, residues) uint8
+    array of states. The first frame of the file is the initial state of the simulation.
+
+    The byte offset after the last record read is kept in offset: a reader created with the cursor of a previous one
+    continues from it, so only the records appended to a growing file are decoded. When following a growing file,
+    the last record is left for the next reader unless its closing blank line has been written.
+
+    Args:
+        path (str): Path to the cpout/ceout file, plain, gzip or zip compressed.
+        n_residues (int): Number of titratable residues (from the cpin/cein file).
+        block_size (int): Bytes read from the file per block.
+        cursor (dict): Cursor of a previous reader of the same file to continue from.
+        follow (bool): Skip the incomplete last record of a file still being written.
+    """
+
+    def __init__(self, path, n_residues: int, block_size: int = 1 << 24, cursor: Optional[dict] = None, follow: bool = False) -> None:
+        self.path = str(path)
+        self.n_residues = n_residues
+        self.block_size = block_size
+        self.follow = follow
+        self.offset = 0
+        self.mc_step: Optional[int] = None
+        self.temperature: Optional[float] = None
+        self.solvent_values: set = set()
+        self._states = np.full(n_residues, -1, dtype=np.int16)
+        self._solvent = np.nan
+        if cursor:
+            self.offset = int(cursor["offset"])
+            self.mc_step = cursor["mc_step"]
+            self.temperature = cursor["temperature"]
+            self._states = np.array(cursor["states"], dtype=np.int16)
+            self._solvent = np.nan if cursor["solvent"] is None else float(cursor["solvent"])
+
+    @property
+    def cursor(self) -> dict:
+        """Position and decoding state reached, to continue reading the file later."""
+        return {"offset": self.offset, "mc_step": self.mc_step, "temperature": self.temperature, "states": self._states.tolist(),
+                "solvent": None if np.isnan(self._solvent) else float(self._solvent)}
+
+    def blocks(self, stream: BinaryIO) -> Iterator[bytes]:
+        """Splits the stream at record boundaries (blank lines)."""
+        pending = b""
+        while True:
+            data = stream.read(self.block_size)
+            if not data:
+                break
+            data = pending + data
+            cut = data.rfind(b"\n\n")
+            if cut == -1:
+                pending = data
+                continue
+            self.offset += cut + 2
+            yield data[:cut + 2]
+            pending = data[cut + 2:]
+        if self.follow:
+            return
+        self.offset += len(pending)
+        pending = pending.rstrip()
+        if pending:
+            yield pending + b"\n\n"
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yields the states (frames, residues) and the pH or redox potential (frames) of each block."""
+        with open_titration_output(self.path) as stream:
+            if self.offset:
+                stream.seek(self.offset)
+            for block in self.blocks(stream):
+                states, solvent = self.decode(block)
+                if len(states):
+                    yield states, solvent
+
+    def read(self) -> Tuple[np.ndarray, np.ndarray]:
+        """States and pH or redox potential of all the frames of the file."""
+        blocks = list(self)
+        if not blocks:
+            return np.zeros((0, self.n_residues), dtype=np.uint8), np.zeros(0)
+        return np.concatenate([states for states, _ in blocks]), np.concatenate([solvent for _, solvent in blocks])
+
+    def decode(self, block: bytes) -> Tuple[np.ndarray, np.ndarray]:
+        """Converts a block of whole records to the states and the pH or redox potential of each record."""
+        if b"\r" in block:
+            block = block.replace(b"\r", b"")
+        if self.mc_step is None:
+            match = _MC_STEP.search(block)
+            self.mc_step = int(match.group(1)) if match else 1
+            match = _TEMPERATURE.search(block)
+            self.temperature = float(match.group(1)) if match else None
+        data = np.frombuffer(block, dtype=np.uint8)
+        ends = np.flatnonzero(data == ord("\n"))
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        lengths = ends - starts
+        records = starts[lengths == 0]
+
+        # Residue lines, converted from their fixed columns when they all follow the sander/pmemd layout
+        candidates = (lengths >= 3) & (data[starts] == ord("R"))
+        candidates[candidates] = data[starts[candidates] + 2] == ord("s")
+        lines = starts[candidates]
+        columns = data[lines[:, None] + _RESIDUE_COLUMNS[None, :int(lengths[candidates].min(initial=_RESIDUE_LINE_LENGTH))]]
+        if (lengths[candidates] == _RESIDUE_LINE_LENGTH).all() and columns.shape[1] == _RESIDUE_LINE_LENGTH \
+                and (columns[:, :8] == np.frombuffer(b"Residue ", dtype=np.uint8)).all() \
+                and (columns[:, 12:20] == np.frombuffer(b" State: ", dtype=np.uint8)).all():
+            residues, states = _fixed_int(columns[:, 8:12]), _fixed_int(columns[:, 20:22])
+        else:
+            matches = [_RESIDUE_STATE.match(block, line) for line in lines.tolist()]
+            residues = np.array([int(match.group(1)) for match in matches], dtype=np.int64)
+            states = np.array([int(match.group(2)) for match in matches], dtype=np.int64)
+        if len(residues) and residues.max() >= self.n_residues:
+            raise ValueError("%s has residue %d but the cpin/cein file has %d titratable residues" % (self.path, residues.max(), self.n_residues))
+
+        # Forward fill the delta records from the last state of the previous block
+        updates = np.full((len(records) + 1, self.n_residues), -1, dtype=np.int16)
+        updates[0] = self._states
+        updates[np.searchsorted(records, lines) + 1, residues] = states
+        rows = np.where(updates >= 0, np.arange(len(records) + 1)[:, None], 0)
+        np.maximum.accumulate(rows, axis=0, out=rows)
+        filled = updates[rows, np.arange(self.n_residues)[None, :]]
+        self._states = filled[-1]
+        if len(records) and (filled[1] < 0).any():
+            raise ValueError("%s does not start with a full record of all the titratable residues" % self.path)
+
+        # pH or redox potential of the full records
+        solvent = np.full(len(records) + 1, np.nan)
+        solvent[0] = self._solvent
+        headers = starts[(lengths >= 3) & ((data[starts] == ord("S")) | ((data[starts] == ord("R")) & (data[np.minimum(starts + 2, len(data) - 1)] == ord("d"))))]
+        matches = [(header, _SOLVENT.match(block, header)) for header in headers.tolist()]
+        values = {header: float(match.group(1)) for header, match in matches if match}
+        if values:
+            solvent[np.searchsorted(records, list(values)) + 1] = list(values.values())
+            self.solvent_values.update(values.values())
+        valid = np.where(~np.isnan(solvent), np.arange(len(solvent)), 0)
+        np.maximum.accumulate(valid, out=valid)
+        solvent = solvent[valid]
+        self._solvent = solvent[-1]
+        return filled[1:].astype(np.uint8), solvent[1:]
+
+
+# COMPACT ARCHIVES
+ARCHIVE_MAGIC = b"CPZARCH1"
+_ALIGNMENT = 8
+
+
+def is_archive(path) -> bool:
+    """Whether *path* is a cpout/ceout archive written by write_archive."""
+    try:
+        with open(path, "rb") as fp:
+            return fp.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+    except OSError:
+        return False
+
+
+def _aligned(size: int) -> int:
+    return -(-size // _ALIGNMENT) * _ALIGNMENT
+
+
+class _RunEncoder:
+    """Run-length encoding of the columns of the blocks of a (frames, columns) array: start frame and value of each run."""
+
+    def __init__(self, n_columns: int, dtype) -> None:
+        self.dtype = dtype
+        self.frames = 0
+        self.last = [None] * n_columns
+        self.starts: List[List[np.ndarray]] = [[] for _ in range(n_columns)]
+        self.values: List[List[np.ndarray]] = [[] for _ in range(n_columns)]
+
+    def update(self, block: np.ndarray) -> None:
+        if not len(block):
+            return
+        changes = np.vstack((np.ones((1, block.shape[1]), dtype=bool), block[1:] != block[:-1]))
+        for column, last in enumerate(self.last):
+            changes[0, column] = last is None or block[0, column] != last
+            runs = np.flatnonzero(changes[:, column])
+            if len(runs):
+                self.starts[column].append(runs + self.frames)
+                self.values[column].append(block[runs, column].astype(self.dtype))
+            self.last[column] = block[-1, column]
+        self.frames += len(block)
+
+    def column(self, column: int) -> Tuple[np.ndarray, np.ndarray]:
+        starts, values = self.starts[column], self.values[column]
+        return (np.concatenate(starts).astype(np.int64) if starts else np.zeros(0, dtype=np.int64),
+                np.concatenate(values) if values else np.zeros(0, dtype=self.dtype))
+
+
+def write_archive(input_in_path, input_out_path, output_archive_path, out_log=None) -> int:
+    """
+    Converts a cpout/ceout file to a compact, memory-mappable columnar archive. Returns the number of frames.
+
+    The archive has the ARCHIVE_MAGIC bytes, the size of a JSON header (uint64) and the header itself, with the
+    residue table of the *input_in_path* cpin/cein file, the number of frames, the Monte Carlo step size, the
+    temperature and the byte offset and encoding of each column. Each residue column is either raw (uint8 state of
+    each frame) or run-length encoded (int64 first frame and uint8 state of each run), whichever is smaller. The pH
+    (redox potential) of the frames is run-length encoded with float64 values. Columns start at 8 byte boundaries.
+    """
+    residues = TitratableResidues.read(input_in_path)
+    reader = CpoutReader(input_out_path, len(residues.names))
+    states_runs = _RunEncoder(len(residues.names), np.uint8)
+    solvent_runs = _RunEncoder(1, np.float64)
+    for states, solvent in reader:
+        states_runs.update(states)
+        solvent_runs.update(solvent[:, None])
+    frames = states_runs.frames
+
+    columns, payload, offset = [], [], 0
+    for column in range(len(residues.names)):
+        starts, values = states_runs.column(column)
+        if len(starts) * 9 < frames:
+            columns.append({"encoding": "rle", "offset": offset, "runs": len(starts)})
+            payload.append((offset, starts))
+            payload.append((offset + 8 * len(starts), values))
+            offset = _aligned(offset + 9 * len(starts))
+        else:
+            columns.append({"encoding": "raw", "offset": offset, "runs": len(starts)})
+            payload.append((offset, np.repeat(values, np.diff(np.append(starts, frames)))))
+            offset = _aligned(offset + frames)
+    starts, values = solvent_runs.column(0)
+    solvent_column = {"encoding": "rle", "offset": offset, "runs": len(starts)}
+    payload.append((offset, starts))
+    payload.append((offset + 8 * len(starts), values))
+    size = offset + 16 * len(starts)
+
+    header = json.dumps({"frames": frames, "mc_step": reader.mc_step, "temperature": reader.temperature, "residues": residues.to_dict(),
+                         "columns": columns, "solvent": solvent_column}).encode()
+    data_start = _aligned(len(ARCHIVE_MAGIC) + 8 + len(header))
+    tmp_path = "%s.%s.tmp" % (output_archive_path, uuid.uuid4().hex)
+    with open(tmp_path, "wb") as out:
+        out.write(ARCHIVE_MAGIC + np.uint64(len(header)).tobytes() + header)
+        for position, array in payload:
+            out.seek(data_start + position)
+            out.write(np.ascontiguousarray(array).tobytes())
+        out.truncate(data_start + _aligned(size))
+    os.replace(tmp_path, output_archive_path)
+    fu.log("%d frames of %d titratable residues archived in %s (%d bytes)" % (frames, len(residues.names), output_archive_path, os.path.getsize(output_archive_path)), out_log)
+    return frames
+
+
+class CpoutArchive:
+    """
+    Reader of the cpout/ceout archives written by write_archive.
+
+    The archive is memory mapped: any range of frames of any residue is sliced from its raw column or decoded from
+    the runs overlapping it (found with a binary search), so windows of the trajectory are read without parsing the
+    rest. Iterating yields blocks of states and pH (redox potential) like CpoutReader.
+
+    Args:
+        path (str): Path to the archive.
+        block_frames (int): Frames per block when iterating.
+    """
+
+    def __init__(self, path, block_frames: int = 1 << 20) -> None:
+        self.path = str(path)
+        self.block_frames = block_frames
+        self.data = np.memmap(self.path, dtype=np.uint8, mode="r")
+        if bytes(self.data[:len(ARCHIVE_MAGIC)]) != ARCHIVE_MAGIC:
+            raise ValueError("%s is not a cpout archive" % self.path)
+        size = int(self.data[len(ARCHIVE_MAGIC):len(ARCHIVE_MAGIC) + 8].view(np.uint64)[0])
+        header = json.loads(bytes(self.data[len(ARCHIVE_MAGIC) + 8:len(ARCHIVE_MAGIC) + 8 + size]))
+        self.data_start = _aligned(len(ARCHIVE_MAGIC) + 8 + size)
+        self.frames: int = header["frames"]
+        self.mc_step: Optional[int] = header["mc_step"]
+        self.temperature: Optional[float] = header["temperature"]
+        self.residues = TitratableResidues.from_dict(header["residues"])
+        self.columns: List[dict] = header["columns"]
+        self.solvent_column: dict = header["solvent"]
+        self.solvent_values = set(self._runs(self.solvent_column, np.float64)[1].tolist())
+
+    def __len__(self) -> int:
+        return self.frames
+
+    def _runs(self, column: dict, dtype) -> Tuple[np.ndarray, np.ndarray]:
+        start = self.data_start + column["offset"]
+        runs = column["runs"]
+        return self.data[start:start + 8 * runs].view(np.int64), self.data[start + 8 * runs:start + (8 + np.dtype(dtype).itemsize) * runs].view(dtype)
+
+    def _decode(self, column: dict, dtype, start: int, stop: int) -> np.ndarray:
+        if column["encoding"] == "raw":
+            offset = self.data_start + column["offset"]
+            return np.array(self.data[offset + start:offset + stop])
+        starts, values = self._runs(column, dtype)
+        first = max(int(np.searchsorted(starts, start, side="right")) - 1, 0)
+        last = int(np.searchsorted(starts, stop, side="left"))
+        bounds = np.clip(np.append(starts[first:last], stop), start, stop)
+        return np.repeat(values[first:last], np.diff(bounds))
+
+    def column(self, residue: int, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """States of the *residue* (position in the residue table) in the [start, stop) range of frames."""
+        start, stop, _ = slice(start, stop).indices(self.frames)
+        return self._decode(self.columns[residue], np.uint8, start, max(start, stop))
+
+    def states(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """(frames, residues) states of the [start, stop) range of frames."""
+        start, stop, _ = slice(start, stop).indices(self.frames)
+        states = np.empty((max(stop - start, 0), len(self.columns)), dtype=np.uint8)
+        for residue, column in enumerate(self.columns):
+            states[:, residue] = self._decode(column, np.uint8, start, max(start, stop))
+        return states
+
+    def solvent(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """pH (redox potential) of the [start, stop) range of frames."""
+        start, stop, _ = slice(start, stop).indices(self.frames)
+        return self._decode(self.solvent_column, np.float64, start, max(start, stop))
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        for start in range(0, self.frames, self.block_frames):
+            stop = min(start + self.block_frames, self.frames)
+            yield self.states(start, stop), self.solvent(start, stop)
+
+    def read(self) -> Tuple[np.ndarray, np.ndarray]:
+        """States and pH or redox potential of all the frames of the archive."""
+        return self.states(), self.solvent()
+
+
+def open_titration(path, n_residues: int):
+    """Reader of the *path* cpout/ceout file: a CpoutArchive for archives, a streaming CpoutReader otherwise."""
+    if is_archive(path):
+        archive = CpoutArchive(path)
+        if len(archive.columns) != n_residues:
+            raise ValueError("%s has %d titratable residues but the cpin/cein file has %d" % (path, len(archive.columns), n_residues))
+        return archive
+    return CpoutReader(path, n_residues)
+
+
+def parse_conditions(conditional: str, residues: TitratableResidues) -> List[Tuple[str, List[Tuple[int, np.ndarray]]]]:
+    """Parses the <resid>:<state>,<resid>:<state>,... conditional probability definitions (several separated by
+    spaces). States are numbers, several numbers separated by ';', or P/PROT/D/DEPROT (R/RED/O/OX for redox)."""
+    protonated = residues.protonated_table
+    valid = residues.count_table >= 0
+    conditions = []
+    for definition in conditional.split():
+        criteria = []
+        for criterion in definition.split(","):
+            number, _, states = criterion.partition(":")
+            index = residues.index(int(number))
+            mask = np.zeros(protonated.shape[1], dtype=bool)
+            for state in states.split(";"):
+                state = state.strip().upper()
+                if state in ("P", "PROT", "PROTONATED", "R", "RED", "REDUCED"):
+                    mask |= protonated[index]
+                elif state in ("D", "DEPROT", "DEPROTONATED", "O", "OX", "OXIDIZED"):
+                    mask |= valid[index] & ~protonated[index]
+                elif state.isdigit() and int(state) < residues.num_states[index]:
+                    mask[int(state)] = True
+                else:
+                    raise ValueError("Invalid state %s of residue %s in conditional %s" % (state, number, definition))
+            criteria.append((index, mask))
+        conditions.append((definition, criteria))
+    return conditions
+
+
+class _WindowSums:
+    """Averages of a per frame quantity over consecutive windows of *size* frames, from its cumulative sums."""
+
+    def __init__(self, size: int, width: int) -> None:
+        self.size = size
+        self.start = np.zeros(width, dtype=np.int64)
+        self.frames: List[np.ndarray] = []
+        self.values: List[np.ndarray] = []
+
+    def update(self, cumulative: np.ndarray, frames: np.ndarray) -> None:
+        ends = np.flatnonzero(frames % self.size == 0)
+        if len(ends):
+            self.values.append(np.diff(np.vstack((self.start, cumulative[ends])), axis=0) / self.size)
+            self.frames.append(frames[ends])
+            self.start = cumulative[ends[-1]]
+
+    def series(self) -> Tuple[np.ndarray, np.ndarray]:
+        if not self.frames:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(self.start)))
+        return np.concatenate(self.frames), np.concatenate(self.values)
+
+    def to_dict(self) -> dict:
+        frames, values = self.series()
+        return {"start": self.start.tolist(), "frames": frames.tolist(), "values": values.tolist()}
+
+    def load(self, table: dict) -> None:
+        self.start = np.array(table["start"], dtype=np.int64)
+        self.frames, self.values = _series_from_lists(table["frames"], table["values"], len(self.start))
+
+
+def _series_from_lists(frames: list, values: list, width: int) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """Frame and value arrays of a time series stored as lists."""
+    if not frames:
+        return [], []
+    return [np.array(frames, dtype=np.int64)], [np.array(values, dtype=np.float64).reshape(-1, width)]
+
+
+class TitrationStatistics:
+    """
+    Statistics of the titration states of a cpout/ceout file, accumulated in a single pass.
+
+    Blocks of frames are added with update() as they are decoded, so the trajectory is never kept in memory: the
+    state populations, transitions, total protonation, running average, chunk and cumulative time series and the
+    conditional probabilities are all accumulated on the fly. Like cphstats, the first frame (the initial state of
+    the simulation) only counts for the transitions. Window sizes and interval are in MD steps.
+
+    The accumulators are sufficient statistics: to_dict() and from_dict() store and restore them, so the frames of
+    new segments of a simulation can be added later without reading the previous ones again.
+
+    Args:
+        residues (TitratableResidues): Titratable residues of the cpin/cein file.
+        mc_step (int): MD steps between frames (Monte Carlo step size).
+        interval (int): Interval between the points of the running average and cumulative series and window of the conditional probability series.
+        running_avg_window (int): Window of the running average series, 0 to skip it.
+        chunk_window (int): Window of the chunk series, 0 to skip it.
+        conditional (str): Conditional probability definitions, see parse_conditions.
+    """
+
+    def __init__(self, residues: TitratableResidues, mc_step: int = 1, interval: int = 1000, running_avg_window: int = 0, chunk_window: int = 0, conditional: str = "") -> None:
+        self.residues = residues
+        self.arguments = {"mc_step": int(mc_step), "interval": int(interval or 0), "running_avg_window": int(running_avg_window or 0),
+                          "chunk_window": int(chunk_window or 0), "conditional": conditional or ""}
+        self.mc_step = max(int(mc_step), 1)
+        self.interval = max(int(interval or self.mc_step) // self.mc_step, 1)
+        self.running_avg_window = int(running_avg_window or 0) // self.mc_step
+        if running_avg_window:
+            self.running_avg_window = max(self.running_avg_window, 1)
+        n_residues = len(residues.names)
+        self._columns = np.arange(n_residues)
+        self._count_table = residues.count_table
+        self._protonated_table = residues.protonated_table
+        self.frames = 0
+        self.populations = np.zeros(self._count_table.shape, dtype=np.int64)
+        self.transitions = np.zeros(n_residues, dtype=np.int64)
+        self.total_count = 0
+        self._last: Optional[np.ndarray] = None
+        self._protonated_sum = np.zeros(n_residues, dtype=np.int64)
+        self._cumulative_frames: List[np.ndarray] = []
+        self._cumulative_values: List[np.ndarray] = []
+        self._chunks = _WindowSums(max(int(chunk_window) // self.mc_step, 1), n_residues) if chunk_window else None
+        self._running_frames: List[np.ndarray] = []
+        self._running_values: List[np.ndarray] = []
+        self._history = np.zeros((1, n_residues), dtype=np.int64)
+        self.conditions = parse_conditions(conditional, residues) if conditional else []
+        self.condition_counts = np.zeros(len(self.conditions), dtype=np.int64)
+        self._condition_sum = np.zeros(len(self.conditions), dtype=np.int64)
+        self._condition_chunks = _WindowSums(self.interval, len(self.conditions))
+
+    def update(self, states: np.ndarray) -> None:
+        """Adds a (frames, residues) block of states."""
+        if not len(states):
+            return
+        if self._last is None:
+            self._last = self._protonated_table[self._columns, states[0]]
+            states = states[1:]
+            if not len(states):
+                return
+        states = states.astype(np.intp)
+        n_frames, n_residues = states.shape
+        protonated = self._protonated_table[self._columns, states]
+        self.transitions += (protonated[0] != self._last) + (protonated[1:] != protonated[:-1]).sum(axis=0)
+        self._last = protonated[-1]
+        self.populations += np.bincount((states + self._columns * self.populations.shape[1]).ravel(), minlength=self.populations.size).reshape(self.populations.shape)
+        self.total_count += int(self._count_table[self._columns, states].sum())
+
+        frames = self.frames + np.arange(1, n_frames + 1)
+        cumulative = self._protonated_sum + np.cumsum(protonated, axis=0, dtype=np.int64)
+        self._protonated_sum = cumulative[-1]
+        points = np.flatnonzero(frames % self.interval == 0)
+        if len(points):
+            self._cumulative_frames.append(frames[points])
+            self._cumulative_values.append(cumulative[points] / frames[points, None])
+        if self._chunks:
+            self._chunks.update(cumulative, frames)
+        if self.running_avg_window:
+            history = np.vstack((self._history, cumulative))
+            if len(points):
+                # Row of frame k in history is k - (self.frames + 1 - len(self._history))
+                offset = self.frames + 1 - len(self._history)
+                starts = np.maximum(frames[points] - self.running_avg_window, 0)
+                self._running_frames.append(frames[points])
+                self._running_values.append((history[frames[points] - offset] - history[starts - offset]) / (frames[points] - starts)[:, None])
+            self._history = history[-(self.running_avg_window + 1):]
+        if self.conditions:
+            satisfied = np.ones((n_frames, len(self.conditions)), dtype=bool)
+            for i, (_, criteria) in enumerate(self.conditions):
+                for index, mask in criteria:
+                    satisfied[:, i] &= mask[states[:, index]]
+            self.condition_counts += satisfied.sum(axis=0)
+            condition_cumulative = self._condition_sum + np.cumsum(satisfied, axis=0, dtype=np.int64)
+            self._condition_sum = condition_cumulative[-1]
+            self._condition_chunks.update(condition_cumulative, frames)
+        self.frames += n_frames
+
+    def restart(self, state: np.ndarray) -> None:
+        """Continues the statistics from *state* (e.g. the first frame of a replica after an exchange): the next
+        transitions are counted from it and it is not skipped as an initial state."""
+        self._last = self._protonated_table[self._columns, np.asarray(state, dtype=np.intp)]
+
+    def merge(self, other: "TitrationStatistics") -> "TitrationStatistics":
+        """Adds the frames, populations, transitions and conditional probability counts of *other* (statistics of
+        another part of the same ensemble). Time series are not merged."""
+        self.frames += other.frames
+        self.populations += other.populations
+        self.transitions += other.transitions
+        self.total_count += other.total_count
+        self._protonated_sum += other._protonated_sum
+        if len(self.condition_counts) == len(other.condition_counts):
+            self.condition_counts += other.condition_counts
+        return self
+
+    def to_dict(self) -> dict:
+        """Arguments and accumulators of the statistics as a JSON serializable dictionary."""
+        cumulative_frames, cumulative_values = self.series("cumulative")
+        running_frames, running_values = self.series("running_avg")
+        return {
+            "arguments": self.arguments,
+            "frames": self.frames,
+            "populations": self.populations.tolist(),
+            "transitions": self.transitions.tolist(),
+            "total_count": self.total_count,
+            "last": None if self._last is None else self._last.tolist(),
+            "protonated_sum": self._protonated_sum.tolist(),
+            "cumulative": {"frames": cumulative_frames.tolist(), "values": cumulative_values.tolist()},
+            "running_avg": {"frames": running_frames.tolist(), "values": running_values.tolist(), "history": self._history.tolist()},
+            "chunk": self._chunks.to_dict() if self._chunks else None,
+            "condition_counts": self.condition_counts.tolist(),
+            "condition_sum": self._condition_sum.tolist(),
+            "chunk_conditional": self._condition_chunks.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, residues: TitratableResidues, table: dict) -> "TitrationStatistics":
+        """Statistics of the *residues* restored from a to_dict() dictionary."""
+        statistics = cls(residues, **table["arguments"])
+        n_residues = len(residues.names)
+        statistics.frames = int(table["frames"])
+        statistics.populations = np.array(table["populations"], dtype=np.int64).reshape(statistics.populations.shape)
+        statistics.transitions = np.array(table["transitions"], dtype=np.int64)
+        statistics.total_count = int(table["total_count"])
+        statistics._last = None if table["last"] is None else np.array(table["last"], dtype=bool)
+        statistics._protonated_sum = np.array(table["protonated_sum"], dtype=np.int64)
+        statistics._cumulative_frames, statistics._cumulative_values = _series_from_lists(table["cumulative"]["frames"], table["cumulative"]["values"], n_residues)
+        statistics._running_frames, statistics._running_values = _series_from_lists(table["running_avg"]["frames"], table["running_avg"]["values"], n_residues)
+        statistics._history = np.array(table["running_avg"]["history"], dtype=np.int64).reshape(-1, n_residues)
+        if statistics._chunks and table["chunk"]:
+            statistics._chunks.load(table["chunk"])
+        statistics.condition_counts = np.array(table["condition_counts"], dtype=np.int64)
+        statistics._condition_sum = np.array(table["condition_sum"], dtype=np.int64)
+        statistics._condition_chunks.load(table["chunk_conditional"])
+        return statistics
+
+    @property
+    def fraction_protonated(self) -> np.ndarray:
+        """Fraction of frames in a protonated (or reduced) state of each residue."""
+        return self._protonated_sum / max(self.frames, 1)
+
+    @property
+    def average_total(self) -> float:
+        """Average total number of protons (or electrons) of the titratable residues."""
+        return self.total_count / max(self.frames, 1)
+
+    @property
+    def conditional_probabilities(self) -> np.ndarray:
+        """Fraction of frames satisfying each conditional probability definition."""
+        return self.condition_counts / max(self.frames, 1)
+
+    def predict(self, fraction: np.ndarray, solvent: float, temperature: Optional[float] = None) -> np.ndarray:
+        """pKa (Henderson-Hasselbalch) or standard redox potential (Nernst) predicted from the *fraction* protonated (or reduced)."""
+        with np.errstate(divide="ignore"):
+            ratio = np.asarray(fraction) / (1 - np.asarray(fraction))
+            if self.residues.redox:
+                return solvent + BOLTZMANN_EV * (temperature or 300.0) * np.log(ratio)
+            return solvent + np.log10(ratio)
+
+    def series(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Frame numbers and values of the *name* (running_avg, chunk, cumulative or chunk_conditional) time series."""
+        if name == "chunk":
+            return self._chunks.series() if self._chunks else (np.zeros(0, dtype=np.int64), np.zeros((0, len(self._columns))))
+        if name == "chunk_conditional":
+            return self._condition_chunks.series()
+        frames, values = {"running_avg": (self._running_frames, self._running_values), "cumulative": (self._cumulative_frames, self._cumulative_values)}[name]
+        if not frames:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(self._columns)))
+        return np.concatenate(frames), np.concatenate(values)
+
+    def write_calcpka(self, path, solvent: float, temperature: Optional[float] = None, append: bool = False) -> None:
+        """Writes the calcpka-style (calceo-style for redox) statistics, in the format of cphstats (cestats)."""
+        fraction = self.fraction_protonated
+        offset = self.predict(fraction, 0.0, temperature)
+        with open(path, "a" if append else "w") as out:
+            if self.residues.redox:
+                out.write("Redox potential is %9.5f V, temperature is %9.2f K\n" % (solvent, temperature or 300.0))
+                for (name, number), off, frac, transitions in zip(self.residues.names, offset, fraction, self.transitions):
+                    out.write("%3s %-4d: Offset %7.5f V  Pred Eo %8.5f V  Frac Redu %7.5f  Transitions %9d\n" % (name, number, off, solvent + off, frac, transitions))
+                out.write("\nAverage total molecular reduction: %7.5f\n" % self.average_total)
+            else:
+                out.write("Solvent pH is %8.3f\n" % solvent)
+                for (name, number), off, frac, transitions in zip(self.residues.names, offset, fraction, self.transitions):
+                    out.write("%3s %-4d: Offset %6.3f  Pred %6.3f  Frac Prot %5.3f Transitions %9d\n" % (name, number, off, solvent + off, frac, transitions))
+                out.write("\nAverage total molecular protonation: %7.3f\n" % self.average_total)
+
+    def write_population(self, path) -> None:
+        """Writes the population of every state of every residue, in the format of cphstats."""
+        populations = self.populations / max(self.frames, 1)
+        counts = self._count_table
+        with open(path, "w") as out:
+            out.write("   Residue Number " + "".join("    State %2d " % state for state in range(populations.shape[1])) + "\n")
+            out.write("-" * (18 + 13 * populations.shape[1]) + "\n")
+            for i, (name, number) in enumerate(self.residues.names):
+                out.write("Residue: %3s %-4d " % (name, number))
+                out.write("".join("%f (%d) " % (populations[i, state], counts[i, state]) for state in range(self.residues.num_states[i])) + "\n")
+
+    def write_series(self, path, name: str, timestep: float, solvent: float, temperature: Optional[float] = None, protonated: bool = True, predicted: bool = False) -> None:
+        """Writes the *name* time series, one row per point: time (ps) and the fraction protonated (deprotonated if not
+        *protonated*) or predicted pKa/Eo of each residue."""
+        frames, values = self.series(name)
+        if predicted:
+            values = self.predict(values, solvent, temperature)
+        elif not protonated:
+            values = 1 - values
+        labels = ["%s %d" % residue for residue in self.residues.names]
+        with open(path, "w") as out:
+            out.write("#%11s " % "Time (ps)" + " ".join("%10s" % label for label in labels) + "\n")
+            for frame, row in zip(frames.tolist(), values):
+                out.write("%12.3f " % (frame * self.mc_step * timestep) + " ".join("%10.5f" % value for value in row) + "\n")
+
+    def write_conditional(self, path) -> None:
+        """Writes the probability of each conditional probability definition."""
+        with open(path, "w") as out:
+            for (definition, _), probability in zip(self.conditions, self.conditional_probabilities):
+                out.write("P(%s) = %.6f\n" % (definition, probability))
+
+    def write_chunk_conditional(self, path, timestep: float) -> None:
+        """Writes the conditional probabilities over consecutive windows of *interval* MD steps."""
+        frames, values = self.series("chunk_conditional")
+        with open(path, "w") as out:
+            out.write("#%11s " % "Time (ps)" + " ".join("%12s" % definition for definition, _ in self.conditions) + "\n")
+            for frame, row in zip(frames.tolist(), values):
+                out.write("%12.3f " % (frame * self.mc_step * timestep) + " ".join("%12.6f" % value for value in row) + "\n")
+
+
+# INCREMENTAL STATISTICS
+_ANCHOR_SIZE = 64
+
+
+def _is_plain(path) -> bool:
+    """Whether *path* is an uncompressed cpout/ceout file, which can be followed while it grows."""
+    with open(path, "rb") as fp:
+        magic = fp.read(len(ARCHIVE_MAGIC))
+    return not (magic[:2] == b"\x1f\x8b" or magic[:4] == b"PK\x03\x04" or magic == ARCHIVE_MAGIC)
+
+
+def _anchor(path, offset: int) -> str:
+    """Last bytes read of a plain cpout/ceout file, to check later that it was only appended to."""
+    with open(path, "rb") as fp:
+        fp.seek(max(offset - _ANCHOR_SIZE, 0))
+        return fp.read(min(offset, _ANCHOR_SIZE)).decode("latin-1")
+
+
+def load_titration_state(state_path, residues: TitratableResidues, arguments: dict) -> Optional[dict]:
+    """State of the *state_path* sidecar file, None if it does not exist or was written for other residues or arguments."""
+    try:
+        with open(state_path) as fp:
+            state = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if state.get("residues") != residues.to_dict() or state.get("arguments") != arguments:
+        return None
+    return state
+
+
+def save_titration_state(state_path, state: dict) -> None:
+    """Writes the *state_path* sidecar file, replacing the previous one only once completely written."""
+    tmp_path = "%s.%s.tmp" % (state_path, uuid.uuid4().hex)
+    with open(tmp_path, "w") as fp:
+        json.dump(state, fp)
+    os.replace(tmp_path, state_path)
+
+
+def fold_titration(residues: TitratableResidues, input_out_path, state_path, interval: int = 1000, running_avg_window: int = 0, chunk_window: int = 0,
+                   conditional: str = "", out_log=None, global_log=None) -> Tuple[Optional[TitrationStatistics], set, Optional[float]]:
+    """
+    Adds a segment of a constant pH (redox potential) simulation to the statistics kept in the *state_path* JSON sidecar file.
+
+    The sidecar holds the accumulators of TitrationStatistics and the segments already added, so only the new frames
+    are read: a cpout/ceout file not added yet is read as a new segment, whose first frame (the restart state) only
+    counts for the transitions, while for the last plain file added only the records appended since are decoded.
+    Records still being written are left for the next call. The state is started over if it was computed for other
+    residues or arguments.
+
+    Parameters:
+        residues (TitratableResidues): Titratable residues of the cpin/cein file.
+        input_out_path (str): Path to the cpout/ceout file of the segment.
+        state_path (str): Path to the JSON sidecar file holding the statistics.
+        interval, running_avg_window, chunk_window, conditional: See TitrationStatistics.
+
+    Returns:
+        tuple: The statistics of all the segments (None if no record was read yet), their pH (redox potential) values and the temperature.
+    """
+    arguments = {"interval": int(interval or 0), "running_avg_window": int(running_avg_window or 0), "chunk_window": int(chunk_window or 0), "conditional": conditional or ""}
+    state = load_titration_state(state_path, residues, arguments)
+    if state is None:
+        if Path(state_path).exists():
+            fu.log("WARNING: %s was computed for other residues or arguments, starting over" % state_path, out_log, global_log)
+        state = {"residues": residues.to_dict(), "arguments": arguments, "segments": [], "solvent_values": [], "temperature": None, "statistics": None}
+    statistics = TitrationStatistics.from_dict(residues, state["statistics"]) if state["statistics"] else None
+    n_residues = len(residues.names)
+    path = str(Path(input_out_path).resolve())
+    segments = state["segments"]
+    segment = next((segment for segment in segments if segment["path"] == path), None)
+
+    reader = None
+    if segment is None:
+        reader = CpoutReader(path, n_residues, follow=True) if _is_plain(path) else open_titration(path, n_residues)
+        segment = {"path": path, "cursor": None, "anchor": None}
+        segments.append(segment)
+    elif segment is segments[-1] and segment["cursor"]:
+        offset = segment["cursor"]["offset"]
+        if os.path.getsize(path) < offset or _anchor(path, offset) != segment["anchor"]:
+            raise ValueError("%s was modified after its records were added to %s, remove it to start over" % (input_out_path, state_path))
+        reader = CpoutReader(path, n_residues, cursor=segment["cursor"], follow=True)
+    else:
+        fu.log("%s already added to %s, skipped" % (input_out_path, state_path), out_log, global_log)
+
+    if reader is not None:
+        frames = statistics.frames if statistics else 0
+        # The first frame of a new segment is its initial (restart) state
+        restart = statistics is not None and not getattr(reader, "offset", 0)
+        for states, _ in reader:
+            if statistics is None:
+                statistics = TitrationStatistics(residues, reader.mc_step or 1, **arguments)
+            elif restart:
+                statistics.restart(states[0])
+                states = states[1:]
+            restart = False
+            statistics.update(states)
+        if isinstance(reader, CpoutReader) and reader.follow:
+            segment["cursor"], segment["anchor"] = reader.cursor, _anchor(path, reader.offset)
+        state["solvent_values"] = sorted(set(state["solvent_values"]) | reader.solvent_values)
+        state["temperature"] = state["temperature"] if reader.temperature is None else reader.temperature
+        fu.log("%d new frames of %s added to %s" % ((statistics.frames if statistics else 0) - frames, input_out_path, state_path), out_log)
+
+    if statistics is not None:
+        state["statistics"] = statistics.to_dict()
+    save_titration_state(state_path, state)
+    return statistics, set(state["solvent_values"]), state["temperature"]
+
+
+def analyse_titration(input_in_path, input_out_path, outputs: Dict[str, Optional[str]], timestep: float = 0.002, interval: int = 1000,
+                      running_avg_window: int = 0, chunk_window: int = 0, conditional: str = "", protonated: bool = True, predicted: bool = False,
+                      summary: bool = True, state_path=None, out_log=None, global_log=None) -> TitrationStatistics:
+    """Computes all the statistics requested in *outputs* (output_dat_path, output_population_path, output_chunk_path,
+    output_cumulative_path, output_running_avg_path, output_conditional_path and output_chunk_conditional_path keys)
+    in a single pass over the *input_out_path* cpout/ceout file, and writes them. With a *state_path* sidecar file,
+    the file is added to the statistics of the previous segments (see fold_titration)."""
+    if not conditional and (outputs.get("output_conditional_path") or outputs.get("output_chunk_conditional_path")):
+        raise ValueError("Conditional probability outputs requested without conditional probability definitions")
+    residues = TitratableResidues.read(input_in_path)
+    running_avg_window = running_avg_window if outputs.get("output_running_avg_path") else 0
+    chunk_window = chunk_window if outputs.get("output_chunk_path") else 0
+    if state_path:
+        statistics, solvent_values, temperature = fold_titration(residues, input_out_path, state_path, interval, running_avg_window, chunk_window, conditional, out_log, global_log)
+    else:
+        reader = open_titration(input_out_path, len(residues.names))
+        statistics = None
+        for states, _ in reader:
+            if statistics is None:
+                statistics = TitrationStatistics(residues, reader.mc_step or 1, interval, running_avg_window, chunk_window, conditional)
+            statistics.update(states)
+        solvent_values, temperature = reader.solvent_values, reader.temperature
+    if statistics is None:
+        raise ValueError("%s has no titration records" % input_out_path)
+    fu.log("%d frames of %d titratable residues read from %s" % (statistics.frames, len(residues.names), input_out_path), out_log)
+    if len(solvent_values) > 1:
+        fu.log("WARNING: %s has records at %d different pH/redox potential values (replica exchange), use fix_remd to reassemble the ensembles" % (input_out_path, len(solvent_values)), out_log, global_log)
+    solvent = min(solvent_values) if solvent_values else 0.0
+
+    if summary and outputs.get("output_dat_path"):
+        statistics.write_calcpka(outputs["output_dat_path"], solvent, temperature)
+    if outputs.get("output_population_path"):
+        statistics.write_population(outputs["output_population_path"])
+    for name in ("running_avg", "chunk", "cumulative"):
+        if outputs.get("output_%s_path" % name):
+            statistics.write_series(outputs["output_%s_path" % name], name, timestep, solvent, temperature, protonated, predicted)
+    if outputs.get("output_conditional_path"):
+        statistics.write_conditional(outputs["output_conditional_path"])
+    if outputs.get("output_chunk_conditional_path"):
+        statistics.write_chunk_conditional(outputs["output_chunk_conditional_path"], timestep)
+    return statistics
+
+
+# PH-REMD ENSEMBLES
+Segment = Tuple[int, int, np.ndarray, np.ndarray]
+
+
+def replica_ensembles(input_cpin_path, input_cpout_path) -> Dict[float, Tuple[TitrationStatistics, List[Segment]]]:
+    """Splits the frames of a replica exchange cpout file by pH (redox potential for ceout files). Returns the
+    statistics of the frames at each pH and the segments the replica spent at it: first and last frame and
+    their protonation, used to join the ensembles of all the replicas in merge_ensembles. The file is read block
+    by block, a segment continuing in the next block while the pH does not change."""
+    residues = TitratableResidues.read(input_cpin_path)
+    columns = np.arange(len(residues.names))
+    ensembles: Dict[float, Tuple[TitrationStatistics, List[Segment]]] = {}
+    # pH, first frame and its protonation of the segment being read, and protonation of its last frame read
+    segment: Optional[Tuple[float, int, np.ndarray]] = None
+    last = np.zeros(0, dtype=bool)
+    frames = 0
+    for states, solvent in open_titration(input_cpout_path, len(residues.names)):
+        protonated = residues.protonated_table[columns, states.astype(np.intp)]
+        cuts = (np.flatnonzero(np.diff(solvent) != 0) + 1).tolist()
+        for start, end in zip([0] + cuts, cuts + [len(states)]):
+            if segment is None or start or solvent[start] != segment[0]:
+                if segment is not None:
+                    ensembles[segment[0]][1].append((segment[1], frames + start, segment[2], last))
+                segment = (float(solvent[start]), frames + start, protonated[start])
+                statistics = ensembles.setdefault(segment[0], (TitrationStatistics(residues), []))[0]
+                # The first frame of the file is the initial state: counted for the transitions only
+                if frames + start:
+                    statistics.restart(states[start])
+            ensembles[segment[0]][0].update(states[start:end])
+            last = protonated[end - 1]
+        frames += len(states)
+    if segment is not None:
+        ensembles[segment[0]][1].append((segment[1], frames, segment[2], last))
+    return ensembles
+
+
+def merge_ensembles(replicas: List[Dict[float, Tuple[TitrationStatistics, List[Segment]]]]) -> Dict[float, TitrationStatistics]:
+    """Joins the per pH statistics of all the replicas, like the fix_remd option of cphstats: the frames of each pH
+    ensemble are ordered by time, so the transitions between the segments of consecutive replicas are added."""
+    ensembles: Dict[float, TitrationStatistics] = {}
+    segments: Dict[float, List[Segment]] = {}
+    for replica in replicas:
+        for solvent, (statistics, replica_segments) in replica.items():
+            if solvent in ensembles:
+                ensembles[solvent].merge(statistics)
+            else:
+                ensembles[solvent] = statistics
+            segments.setdefault(solvent, []).extend(replica_segments)
+    for solvent, ensemble_segments in segments.items():
+        ensemble_segments.sort(key=lambda segment: segment[0])
+        for previous, current in zip(ensemble_segments[:-1], ensemble_segments[1:]):
+            ensembles[solvent].transitions += previous[3] != current[2]
+    return dict(sorted(ensembles.items()))
+
+
+def hill_fit(solvent: np.ndarray, fractions: np.ndarray, redox: bool = False, temperature: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Fits the titration curves of all the residues at once to the Hill equation, linearized as
+    log10((1 - f) / f) = n (pH - pKa) (kT ln((1 - f) / f) = n (E - Eo) for redox) and weighted by f (1 - f).
+    *fractions* has the fraction protonated (reduced) of each residue (columns) at each *solvent* pH (rows).
+    Returns the pKa (Eo) and Hill coefficient of each residue, NaN for residues titrating at less than two pHs."""
+    solvent = np.asarray(solvent, dtype=float)[:, None]
+    fractions = np.asarray(fractions, dtype=float)
+    titrating = (fractions > 0) & (fractions < 1)
+    clipped = np.where(titrating, fractions, 0.5)
+    y = np.log((1 - clipped) / clipped) * (BOLTZMANN_EV * (temperature or 300.0) if redox else 1 / np.log(10))
+    weights = np.where(titrating, clipped * (1 - clipped), 0.0)
+    total = weights.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_x = (weights * solvent).sum(axis=0) / total
+        mean_y = (weights * y).sum(axis=0) / total
+        hill = (weights * (solvent - mean_x) * (y - mean_y)).sum(axis=0) / (weights * (solvent - mean_x) ** 2).sum(axis=0)
+        pka = mean_x - mean_y / hill
+    fitted = titrating.sum(axis=0) >= 2
+    return np.where(fitted, pka, np.nan), np.where(fitted, hill, np.nan)
+
+
+def write_pka_table(path, residues: TitratableResidues, ensembles: Dict[float, TitrationStatistics], temperature: Optional[float] = None) -> None:
+    """Writes the pKa (Eo) and Hill coefficient fitted for each residue over all the pH (redox potential) ensembles,
+    followed by its fraction protonated (reduced) at each of them."""
+    solvent = np.array(list(ensembles))
+    fractions = np.array([statistics.fraction_protonated for statistics in ensembles.values()])
+    pka, hill = hill_fit(solvent, fractions, residues.redox, temperature)
+    unit = ("E %.4f" if residues.redox else "pH %.2f")
+    with open(path, "w") as out:
+        out.write("#%-9s %9s %9s" % ("Residue", "Eo" if residues.redox else "pKa", "Hill") + "".join(" %9s" % (unit % value) for value in solvent) + "\n")
+        for i, (name, number) in enumerate(residues.names):
+            out.write("%-10s %9.4f %9.4f" % ("%s %d" % (name, number), pka[i], hill[i]) + "".join(" %9.4f" % fraction for fraction in fractions[:, i]) + "\n")
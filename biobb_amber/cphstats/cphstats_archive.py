@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""Module containing the CphstatsArchive class and the command line interface."""
+
+from typing import Optional
+
+from biobb_common.generic.biobb_object import BiobbObject
+from biobb_common.tools.file_utils import launchlogger
+
+from biobb_amber.cphstats.common import check_input_path, check_output_path, write_archive
+
+
+class CphstatsArchive(BiobbObject):
+    """
+    | biobb_amber.cphstats.cphstats_archive CphstatsArchive
+    | Converts an AMBER cpout (constant pH) or ceout (constant redox potential) file to a compact binary archive.
+    | Converts an AMBER cpout or ceout file to a compact, memory-mappable columnar archive (cpz) holding the residue table of the cpin/cein file and the state of each residue in each frame, run-length encoded when smaller. The archives are accepted by CphstatsRun, CestatsRun and CphstatsRemd, that read them without parsing the text files again.
+
+    Args:
+        input_cpin_path (str): Input constant pH (AMBER cpin) or constant redox potential (AMBER cein) file. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/cphstats/structure.cpin>`_. Accepted formats: cpin (edam:format_2330), cein (edam:format_2330).
+        input_cpout_path (str): Output constant pH (AMBER cpout) or constant redox potential (AMBER ceout) file. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/cphstats/sander.pH.cpout>`_. Accepted formats: cpout (edam:format_2330), ceout (edam:format_2330), zip (edam:format_3987), gzip (edam:format_3987).
+        output_archive_path (str): Output compact binary archive of the cpout/ceout file. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/cphstats/sander.pH.cpz>`_. Accepted formats: cpz (edam:format_2333).
+        properties (dict - Python dictionary object containing the tool parameters, not input/output files):
+            * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
+            * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
+            * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+
+    Examples:
+        This is a use example of how to use the building block from Python::
+
+            from biobb_amber.cphstats.cphstats_archive import cphstats_archive
+            cphstats_archive(input_cpin_path='/path/to/cpin.cpin',
+                             input_cpout_path='/path/to/cpout.cpout',
+                             output_archive_path='/path/to/archive.cpz')
+
+    Info:
+        * ontology:
+            * name: EDAM
+            * schema: http://edamontology.org/EDAM.owl
+
+    """
+
+    def __init__(self, input_cpin_path: str, input_cpout_path: str, output_archive_path: str,
+                 properties: Optional[dict] = None, **kwargs) -> None:
+
+        properties = properties or {}
+
+        # Call parent class constructor
+        super().__init__(properties)
+        self.locals_var_dict = locals().copy()
+
+        # Input/Output files
+        self.io_dict = {
+            'in': {'input_cpin_path': input_cpin_path,
+                   'input_cpout_path': input_cpout_path},
+            'out': {'output_archive_path': output_archive_path}
+        }
+
+        # Properties specific for BB
+        self.properties = properties
+
+        # Check the properties
+        self.check_properties(properties)
+        self.check_arguments()
+
+    def check_data_params(self, out_log, err_log):
+        """ Checks input/output paths correctness """
+
+        # Check input(s)
+        self.io_dict["in"]["input_cpin_path"] = check_input_path(self.io_dict["in"]["input_cpin_path"], "input_cpin_path", False, out_log, self.__class__.__name__)
+        self.io_dict["in"]["input_cpout_path"] = check_input_path(self.io_dict["in"]["input_cpout_path"], "input_cpout_path", False, out_log, self.__class__.__name__)
+
+        # Check output(s)
+        self.io_dict["out"]["output_archive_path"] = check_output_path(self.io_dict["out"]["output_archive_path"], "output_archive_path", False, out_log, self.__class__.__name__)
+
+    @launchlogger
+    def launch(self):
+        """Launches the execution of the CphstatsArchive module."""
+
+        # check input/output paths and parameters
+        self.check_data_params(self.out_log, self.err_log)
+
+        # Setup Biobb
+        if self.check_restart():
+            return 0
+
+        write_archive(self.io_dict['in']['input_cpin_path'], self.io_dict['in']['input_cpout_path'], self.io_dict['out']['output_archive_path'], self.out_log)
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+
+def cphstats_archive(input_cpin_path: str, input_cpout_path: str, output_archive_path: str,
+                     properties: Optional[dict] = None, **kwargs) -> int:
+    """Create the :class:`CphstatsArchive <cphstats.cphstats_archive.CphstatsArchive>` class and
+    execute the :meth:`launch() <cphstats.cphstats_archive.CphstatsArchive.launch>` method."""
+    return CphstatsArchive(**dict(locals())).launch()
+
+
+cphstats_archive.__doc__ = CphstatsArchive.__doc__
+main = CphstatsArchive.get_main(cphstats_archive, "Converts an AMBER cpout (constant pH) or ceout (constant redox potential) file to a compact binary archive.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+"""Module containing the CphstatsRemd class and the command line interface."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Optional, Union
+
+from biobb_common.generic.biobb_object import BiobbObject
+from biobb_common.tools import file_utils as fu
+from biobb_common.tools.file_utils import launchlogger
+
+from biobb_amber.cphstats.common import (
+    TitratableResidues,
+    check_input_path,
+    check_output_path,
+    merge_ensembles,
+    replica_ensembles,
+    write_pka_table,
+)
+from biobb_amber.process.common import expand_log_paths
+
+
+class CphstatsRemd(BiobbObject):
+    """
+    | biobb_amber.cphstats.cphstats_remd CphstatsRemd
+    | Analyses all the replicas of a pH replica exchange (pH-REMD) constant pH simulation in parallel.
+    | Reassembles the pH-specific ensembles of the cpout files of all the replicas, like the fix_remd option of cphstats, parsing the replicas on a pool of worker processes with the native cpout parser of CphstatsRun. Fits the titration curve of each residue over all the pHs to the Hill equation and writes a single pKa table.
+
+    Args:
+        input_cpin_path (str): Input constant pH file (AMBER cpin). File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/cphstats/structure.cpin>`_. Accepted formats: cpin (edam:format_2330).
+        input_cpouts_path (str): Output constant pH files of the replicas (AMBER cpout): a glob pattern (e.g. "replica_*/md.cpout"), a list of paths (Python API only) or a zip file containing the cpout files. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/cphstats/sander.pH.remd.zip>`_. Accepted formats: cpout (edam:format_2330), zip (edam:format_3987), gzip (edam:format_3987), cpz (edam:format_2333).
+        output_pka_path (str): Output file with the pKa and Hill coefficient fitted for each residue, followed by its fraction protonated at each pH. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/cphstats/cphstats.remd.pka.dat>`_. Accepted formats: dat (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
+        output_dat_path (str) (Optional): Output file to which the standard calcpka-type statistics of each pH ensemble are written. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/cphstats/cphstats.remd.dat>`_. Accepted formats: dat (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
+        properties (dict - Python dictionary object containing the tool parameters, not input/output files):
+            * **num_workers** (*int*) - (0) [0~1000|1] Number of worker processes parsing the cpout files. 0 uses all the CPU cores of the node.
+            * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
+            * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
+            * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+
+    Examples:
+        This is a use example of how to use the building block from Python::
+
+            from biobb_amber.cphstats.cphstats_remd import cphstats_remd
+            prop = {
+                'num_workers' : 8
+            }
+            cphstats_remd(input_cpin_path='/path/to/cpin.cpin',
+                          input_cpouts_path='/path/to/replica_*/md.cpout',
+                          output_pka_path='/path/to/pka.dat',
+                          properties=prop)
+
+    Info:
+        * ontology:
+            * name: EDAM
+            * schema: http://edamontology.org/EDAM.owl
+
+    """
+
+    def __init__(self, input_cpin_path: str, input_cpouts_path: Union[str, list[str]], output_pka_path: str, output_dat_path: Optional[str] = None,
+                 properties: Optional[dict] = None, **kwargs) -> None:
+
+        properties = properties or {}
+
+        # Call parent class constructor
+        super().__init__(properties)
+        self.locals_var_dict = locals().copy()
+
+        # Input/Output files
+        self.io_dict = {
+            'in': {'input_cpin_path': input_cpin_path,
+                   'input_cpouts_path': expand_log_paths(input_cpouts_path)},
+            'out': {'output_pka_path': output_pka_path,
+                    'output_dat_path': output_dat_path}
+        }
+        # The generic argument checks expect a single path
+        if self.io_dict['in']['input_cpouts_path']:
+            self.locals_var_dict['input_cpouts_path'] = self.io_dict['in']['input_cpouts_path'][0]
+
+        # Properties specific for BB
+        self.properties = properties
+        self.num_workers = properties.get('num_workers', 0)
+
+        # Check the properties
+        self.check_properties(properties)
+        self.check_arguments()
+
+    def check_data_params(self, out_log, err_log):
+        """ Checks input/output paths correctness """
+
+        # Check input(s)
+        self.io_dict["in"]["input_cpin_path"] = check_input_path(self.io_dict["in"]["input_cpin_path"], "input_cpin_path", False, out_log, self.__class__.__name__)
+        self.io_dict["in"]["input_cpouts_path"] = [check_input_path(path, "input_cpouts_path", False, out_log, self.__class__.__name__) for path in self.io_dict["in"]["input_cpouts_path"]]
+
+        # Check output(s)
+        self.io_dict["out"]["output_pka_path"] = check_output_path(self.io_dict["out"]["output_pka_path"], "output_pka_path", False, out_log, self.__class__.__name__)
+        self.io_dict["out"]["output_dat_path"] = check_output_path(self.io_dict["out"]["output_dat_path"], "output_dat_path", True, out_log, self.__class__.__name__)
+
+    @launchlogger
+    def launch(self):
+        """Launches the execution of the CphstatsRemd module."""
+
+        # check input/output paths and parameters
+        self.check_data_params(self.out_log, self.err_log)
+
+        # Setup Biobb
+        if self.check_restart():
+            return 0
+
+        cpout_paths = self.io_dict['in']['input_cpouts_path']
+        if len(cpout_paths) == 1 and cpout_paths[0].endswith('.zip'):
+            tmp_folder = fu.create_unique_dir()
+            fu.log('Creating %s temporary folder' % tmp_folder, self.out_log)
+            cpout_paths = sorted(path for path in fu.unzip_list(cpout_paths[0], tmp_folder, self.out_log) if Path(path).is_file())
+            self.tmp_files.append(tmp_folder)
+
+        # Each worker splits the frames of a replica by pH, the pH ensembles are joined afterwards
+        input_cpin_path = self.io_dict['in']['input_cpin_path']
+        num_workers = min(self.num_workers or os.cpu_count() or 1, len(cpout_paths))
+        fu.log('Parsing %d cpout files with %d worker processes' % (len(cpout_paths), num_workers), self.out_log)
+        if num_workers > 1:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                replicas = list(executor.map(partial(replica_ensembles, input_cpin_path), cpout_paths))
+        else:
+            replicas = [replica_ensembles(input_cpin_path, path) for path in cpout_paths]
+        ensembles = merge_ensembles(replicas)
+
+        frames = {statistics.frames for statistics in ensembles.values()}
+        fu.log('%d pH ensembles of %s frames' % (len(ensembles), '/'.join(str(count) for count in sorted(frames))), self.out_log)
+        if len(frames) > 1:
+            fu.log('WARNING: the pH ensembles have different number of frames, check that the cpout files of all the replicas are provided', self.out_log, self.global_log)
+
+        residues = TitratableResidues.read(input_cpin_path)
+        write_pka_table(self.io_dict['out']['output_pka_path'], residues, ensembles)
+        if self.io_dict['out']['output_dat_path']:
+            for i, (solvent, statistics) in enumerate(ensembles.items()):
+                statistics.write_calcpka(self.io_dict['out']['output_dat_path'], solvent, append=bool(i))
+
+        # Remove temporary file(s)
+        self.remove_tmp_files()
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+
+def cphstats_remd(input_cpin_path: str, input_cpouts_path: Union[str, list[str]], output_pka_path: str,
+                  output_dat_path: Optional[str] = None,
+                  properties: Optional[dict] = None, **kwargs) -> int:
+    """Create the :class:`CphstatsRemd <cphstats.cphstats_remd.CphstatsRemd>` class and
+    execute the :meth:`launch() <cphstats.cphstats_remd.CphstatsRemd.launch>` method."""
+    return CphstatsRemd(**dict(locals())).launch()
+
+
+cphstats_remd.__doc__ = CphstatsRemd.__doc__
+main = CphstatsRemd.get_main(cphstats_remd, "Analyses all the replicas of a pH replica exchange (pH-REMD) constant pH simulation in parallel.")
+
+if __name__ == '__main__':
+    main()
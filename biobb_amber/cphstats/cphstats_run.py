@@ -2,13 +2,15 @@
 
 """Module containing the Cphstats class and the command line interface."""
 
+from pathlib import Path
 from typing import Optional
-from biobb_common.generic.biobb_object import BiobbObject
+from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
-from biobb_amber.cphstats.common import check_input_path, check_output_path
+from biobb_amber.cphstats.common import analyse_titration, check_input_path, check_output_path, is_archive
+from biobb_amber.staging import StagingBiobbObject
 
 
-class CphstatsRun(BiobbObject):
+class CphstatsRun(StagingBiobbObject):
     """
     | biobb_amber CphstatsRun
     | Wrapper of the `AmberTools (AMBER MD Package) cphstats tool <https://ambermd.org/AmberTools.php>`_ module.
@@ -16,13 +18,14 @@ class CphstatsRun(BiobbObject):
 
     Args:
         input_cpin_path (str): Input constant pH file (AMBER cpin). File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/cphstats/structure.cpin>`_. Accepted formats: cpin (edam:format_2330).
-        input_cpout_path (str): Output constant pH file (AMBER cpout). File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/cphstats/sander.pH.cpout>`_. Accepted formats: cpout (edam:format_2330), zip (edam:format_3987), gzip (edam:format_3987).
+        input_cpout_path (str): Output constant pH file (AMBER cpout). File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/cphstats/sander.pH.cpout>`_. Accepted formats: cpout (edam:format_2330), zip (edam:format_3987), gzip (edam:format_3987), cpz (edam:format_2333).
         output_dat_path (str): Output file to which the standard calcpka-type statistics are written. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/cphstats/cphstats.pH.dat>`_. Accepted formats: dat (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
         output_population_path (str) (Optional): Output file where protonation state populations are printed for every state of every residue. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/cphstats/cphstats.pH.pop.dat>`_. Accepted formats: dat (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
         output_chunk_path (str) (Optional): Output file where the time series data calculated over chunks of the simulation are printed. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/cphstats/cphstats.pH.dat>`_. Accepted formats: dat (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
         output_cumulative_path (str) (Optional): Output file where the cumulative time series data is printed. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/cphstats/cphstats.pH.dat>`_. Accepted formats: dat (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
         output_conditional_path (str) (Optional): Output file with requested conditional probabilities. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/cphstats/cphstats.pH.dat>`_. Accepted formats: dat (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
         output_chunk_conditional_path (str) (Optional): Output file with a time series of the conditional probabilities over a trajectory split up into chunks. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/cphstats/cphstats.pH.dat>`_. Accepted formats: dat (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
+        output_running_avg_path (str) (Optional): Output file where the running averages of the time series data of each residue are printed. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/cphstats/cphstats.pH.dat>`_. Accepted formats: dat (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **timestep** (*float*) - (0.002) Simulation time step -in ps-, used to print data as a function of time.
             * **verbose** (*bool*) - (False) Controls how much information is printed to the calcpka-style output file. Options are: False - Just print fraction protonated. True - Print everything calcpka prints.
@@ -35,10 +38,13 @@ class CphstatsRun(BiobbObject):
             * **cumulative** (*bool*) - (False) Computes the cumulative average time series data over the course of the trajectory.
             * **fix_remd** (*str*) - ("") This option will trigger cphstats to reassemble the titration data into pH-specific ensembles. This is an exclusive mode of the program, no other analyses will be done.
             * **conditional** (*str*) - ("") Evaluates conditional probabilities. CONDITIONAL should be a string of the format: <resid>:<state>,<resid>:<state>,... or <resid>:PROT,<resid>:DEPROT,... or <resid>:<state1>;<state2>,<resid>:PROT,... where <resid> is the residue number in the prmtop and <state> is either the state number or -p-rotonated or -d-eprotonated, case-insensitive.
+            * **native** (*bool*) - (True) Analyse the cpout file in a single pass with the built-in streaming parser instead of running cphstats. The verbose and fix_remd options are only available with cphstats. Binary and container properties are ignored when enabled. Always enabled for cpz archives.
+            * **incremental** (*bool*) - (False) Add the cpout file to the statistics of the previous segments of the simulation, kept in a "<output_dat_path>.state" sidecar file: a new file is added as a new segment and only the records appended since the previous call are read from the last one. Requires native.
             * **binary_path** (*str*) - ("cphstats") Path to the cphstats executable binary.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
             * **container_path** (*str*) - (None) Container path definition.
             * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
             * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
@@ -71,7 +77,7 @@ class CphstatsRun(BiobbObject):
 
     def __init__(self, input_cpin_path: str, input_cpout_path: str, output_dat_path: str, output_population_path: Optional[str] = None,
                  output_chunk_path: Optional[str] = None, output_cumulative_path: Optional[str] = None, output_conditional_path: Optional[str] = None, output_chunk_conditional_path: Optional[str] = None,
-                 properties: Optional[dict] = None, **kwargs) -> None:
+                 output_running_avg_path: Optional[str] = None, properties: Optional[dict] = None, **kwargs) -> None:
 
         properties = properties or {}
 
@@ -88,7 +94,8 @@ class CphstatsRun(BiobbObject):
                     'output_chunk_path': output_chunk_path,
                     'output_cumulative_path': output_cumulative_path,
                     'output_conditional_path': output_conditional_path,
-                    'output_chunk_conditional_path': output_chunk_conditional_path}
+                    'output_chunk_conditional_path': output_chunk_conditional_path,
+                    'output_running_avg_path': output_running_avg_path}
         }
 
         # Properties specific for BB
@@ -104,6 +111,8 @@ class CphstatsRun(BiobbObject):
         self.cumulative = properties.get('cumulative', False)
         self.fix_remd = properties.get('fix_remd', "")
         self.conditional = properties.get('conditional', "")
+        self.native = properties.get('native', True)
+        self.incremental = properties.get('incremental', False)
         self.binary_path = properties.get('binary_path', 'cphstats')
 
         # Check the properties
@@ -124,6 +133,12 @@ class CphstatsRun(BiobbObject):
         self.io_dict["out"]["output_cumulative_path"] = check_output_path(self.io_dict["out"]["output_cumulative_path"], "output_cumulative_path", True, out_log, self.__class__.__name__)
         self.io_dict["out"]["output_chunk_conditional_path"] = check_output_path(self.io_dict["out"]["output_chunk_conditional_path"], "output_chunk_conditional_path", True, out_log, self.__class__.__name__)
         self.io_dict["out"]["output_conditional_path"] = check_output_path(self.io_dict["out"]["output_conditional_path"], "output_conditional_path", True, out_log, self.__class__.__name__)
+        self.io_dict["out"]["output_running_avg_path"] = check_output_path(self.io_dict["out"]["output_running_avg_path"], "output_running_avg_path", True, out_log, self.__class__.__name__)
+
+        # Check parameter(s)
+        if not self.conditional and (self.io_dict["out"]["output_conditional_path"] or self.io_dict["out"]["output_chunk_conditional_path"]):
+            fu.log(self.__class__.__name__ + ': conditional property required by output_conditional_path and output_chunk_conditional_path, exiting', out_log)
+            raise SystemExit(self.__class__.__name__ + ': conditional property required by output_conditional_path and output_chunk_conditional_path')
 
     @launchlogger
     def launch(self):
@@ -135,6 +150,29 @@ class CphstatsRun(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+
+        # Archives written by CphstatsArchive are only readable by the native parser
+        archive = is_archive(self.io_dict['in']['input_cpout_path'])
+        if self.native and not archive and (self.verbose or self.fix_remd):
+            fu.log('WARNING: verbose and fix_remd are not supported by the native cpout parser, running %s' % self.binary_path, self.out_log, self.global_log)
+        elif self.native or archive:
+            # Single pass over the cpout file computing all the requested outputs, no sandbox needed
+            fu.log('Analysing %s with the native cpout parser' % self.io_dict['in']['input_cpout_path'], self.out_log)
+            if self.cumulative and not self.io_dict['out']['output_cumulative_path']:
+                fu.log('WARNING: cumulative property set without output_cumulative_path, cumulative time series not written', self.out_log, self.global_log)
+            state_path = None
+            if self.incremental:
+                # Only the new frames are read, the statistics of the previous ones are kept in a sidecar file
+                state_path = str(self.io_dict['out']['output_dat_path']) + '.state'
+                if self.calcpka and not Path(self.io_dict['out']['output_dat_path']).exists() and Path(state_path).exists():
+                    Path(state_path).unlink()
+            analyse_titration(self.io_dict['in']['input_cpin_path'], self.io_dict['in']['input_cpout_path'], self.io_dict['out'],
+                              timestep=self.timestep, interval=self.interval, running_avg_window=self.running_avg_window, chunk_window=self.chunk_window,
+                              conditional=self.conditional, protonated=self.protonated, predicted=self.pka, summary=self.calcpka,
+                              state_path=state_path, out_log=self.out_log, global_log=self.global_log)
+            self.check_arguments(output_files_created=True, raise_exception=False)
+            return self.return_code
+
         self.stage_files()
 
         # Command line
@@ -161,6 +199,10 @@ class CphstatsRun(BiobbObject):
             self.cmd.append('--cumulative-out ')
             self.cmd.append(self.stage_io_dict['out']['output_cumulative_path'])
 
+        if self.io_dict['out']['output_running_avg_path']:
+            self.cmd.append('-R')
+            self.cmd.append(self.stage_io_dict['out']['output_running_avg_path'])
+
         if self.io_dict['out']['output_conditional_path']:
             self.cmd.append('--conditional-output ')
             self.cmd.append(self.stage_io_dict['out']['output_conditional_path'])
@@ -222,7 +264,7 @@ def cphstats_run(input_cpin_path: str, input_cpout_path: str,
                  output_dat_path: str,
                  output_population_path: Optional[str] = None, output_chunk_path: Optional[str] = None,
                  output_conditional_path: Optional[str] = None, output_chunk_conditional_path: Optional[str] = None,
-                 output_cumulative_path: Optional[str] = None,
+                 output_cumulative_path: Optional[str] = None, output_running_avg_path: Optional[str] = None,
                  properties: Optional[dict] = None, **kwargs) -> int:
     """Create the :class:`CphstatsRun <cphstats.cphstats_run.CphstatsRun>` class and
     execute the :meth:`launch() <cphstats.cphstats_run.CphstatsRun.launch>` method."""
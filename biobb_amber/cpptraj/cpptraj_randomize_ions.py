@@ -2,15 +2,17 @@
 
 """Module containing the CpptrajRandomizeIons class and the command line interface."""
 
+import re
 from typing import Optional
 from pathlib import PurePath
-from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
 from biobb_amber.cpptraj.common import check_input_path, check_output_path
+from biobb_amber.leap.prmtop import check_coordinates
+from biobb_amber.staging import StagingBiobbObject
 
 
-class CpptrajRandomizeIons(BiobbObject):
+class CpptrajRandomizeIons(StagingBiobbObject):
     """
     | biobb_amber.cpptraj.cpptraj_randomize_ions CpptrajRandomizeIons
     | Wrapper of the `AmberTools (AMBER MD Package) cpptraj tool <https://ambermd.org/AmberTools.php>`_ module.
@@ -27,9 +29,11 @@ class CpptrajRandomizeIons(BiobbObject):
             * **distance** (*float*) - (5.0) Minimum distance cutoff for the ions around the defined solute.
             * **overlap** (*float*) - (3.5) Minimum distance between ions.
             * **binary_path** (*str*) - ("cpptraj") Path to the cpptraj executable binary.
+            * **prmtop_cache_path** (*str*) - (None) Folder where the %FLAG section offsets of input_top_path are stored and reused while the topology does not change, so the next blocks reading it do not scan it again.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
             * **container_path** (*str*) - (None) Container path definition.
             * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
             * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
@@ -88,6 +92,7 @@ class CpptrajRandomizeIons(BiobbObject):
         self.distance = properties.get('distance', 5.0)
         self.overlap = properties.get('overlap', 3.5)
         self.binary_path = properties.get('binary_path', 'cpptraj')
+        self.prmtop_cache_path = properties.get('prmtop_cache_path', None)
 
         # Check the properties
         self.check_properties(properties)
@@ -114,6 +119,12 @@ class CpptrajRandomizeIons(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+
+        # Topology, coordinates and ions consistency, read from the lazy prmtop index
+        prmtop = check_coordinates(self.io_dict['in']['input_top_path'], self.io_dict['in']['input_crd_path'], self.out_log, self.global_log, self.prmtop_cache_path)
+        ion_names = set(self.ion_mask.lstrip(':').split(',')) if re.fullmatch(r':[\w+-]+(,[\w+-]+)*', self.ion_mask) else set()
+        if prmtop and ion_names and not ion_names & prmtop.residue_names:
+            fu.log('WARNING: no %s ions found in %s, nothing to randomize' % (self.ion_mask, self.io_dict['in']['input_top_path']), self.out_log, self.global_log)
         self.stage_files()
 
         if self.container_path:
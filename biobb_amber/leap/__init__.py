@@ -2,6 +2,7 @@ from . import leap_build_linear_structure
 from . import leap_gen_top
 from . import leap_solvate
 from . import leap_add_ions
+from . import leap_prepare_system
 
 name = "leap"
-__all__ = ["leap_build_linear_structure", "leap_gen_top", "leap_solvate", "leap_add_ions"]
+__all__ = ["leap_build_linear_structure", "leap_gen_top", "leap_solvate", "leap_add_ions", "leap_prepare_system"]
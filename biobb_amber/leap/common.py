@@ -1,10 +1,21 @@
 """Common functions for package biobb_amber.leap"""
 
+import atexit
+import math
+import os
+import re
+import subprocess
+import threading
+import time
+import uuid
 from pathlib import Path, PurePath
 from typing import Optional, Union
 
+import numpy as np
 from biobb_common.tools import file_utils as fu
 
+from biobb_amber.leap.prmtop import WATER_RESIDUES
+
 
 # CHECK INPUT PARAMETERS
 def check_input_path(path, argument, optional, out_log, classname):
@@ -65,6 +76,185 @@ def is_valid_file(ext, argument):
     return ext in formats[argument]
 
 
+def count_pdb_waters(pdb_path: str) -> int:
+    """Number of water residues of a PDB file, read in a single pass from the fixed residue name, chain, number and
+    insertion code columns of the ATOM/HETATM records. Counting residues instead of atoms keeps the extra points
+    of 4 and 5 point water models (TIP4P, OPC...) and any atom naming out of the count."""
+    water_names = {name.encode() for name in WATER_RESIDUES}
+    with open(pdb_path, "rb") as pdb:
+        data = np.frombuffer(pdb.read(), dtype=np.uint8)
+    if not data.size:
+        return 0
+    # Start and length of each line
+    ends = np.flatnonzero(data == ord("\n"))
+    if not ends.size or ends[-1] != data.size - 1:
+        ends = np.append(ends, data.size)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    starts = starts[ends - starts >= 27]
+    # ATOM/HETATM records
+    records = data[starts[:, None] + np.arange(6)].copy().view("S6").ravel()
+    starts = starts[(records == b"ATOM  ") | (records == b"HETATM")]
+    if not starts.size:
+        return 0
+    # resName (18-21), chainID (22), resSeq (23-26) and iCode (27) of each atom
+    residues = data[starts[:, None] + np.arange(17, 27)].copy().view("S10").ravel()
+    # First atom of each residue: residue numbers wrap around in big boxes, so consecutive atoms are compared
+    first_atoms = residues[np.concatenate(([True], residues[1:] != residues[:-1]))]
+    return sum(1 for residue in first_atoms.tolist() if residue[:4].strip() in water_names)
+
+
+# FORCE FIELD LEAPRC FILES
+_LEAPRC_INDEX: dict = {}
+_LEAPRC_INDEX_LOCK = threading.Lock()
+
+
+def _directory_files(directory: str) -> frozenset:
+    """Names of the files of *directory*, listed once per process and listed again only if the directory
+    modification time changes. Empty if the directory does not exist."""
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return frozenset()
+    with _LEAPRC_INDEX_LOCK:
+        cached = _LEAPRC_INDEX.get(directory)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    listed_ns = time.time_ns()
+    try:
+        with os.scandir(directory) as entries:
+            names = frozenset(entry.name for entry in entries if entry.is_file())
+    except OSError:
+        names = frozenset()
+    # Files added in the same timestamp tick as the listing would not change the modification time, so listings
+    # of directories modified in the last second are not kept
+    if listed_ns - mtime > 1_000_000_000:
+        with _LEAPRC_INDEX_LOCK:
+            _LEAPRC_INDEX[directory] = (mtime, names)
+    return names
+
+
+def find_leaprc_paths(forcefields: list[str]) -> list[str]:
+    """
+    Find the leaprc paths for the force fields provided.
+
+    For each item in the forcefields list, the function checks if the str is a path to an existing file.
+    If not, it tries to find the file in the $AMBERHOME/dat/leap/cmd/ directory or the $AMBERHOME/dat/leap/cmd/oldff/
+    directory with and without the leaprc prefix. The contents of both directories are listed once per process
+    (and again if they are modified) instead of probing each candidate path.
+
+    Args:
+        forcefields (list[str]): List of force fields to find the leaprc files for.
+
+    Returns:
+        list[str]: List of leaprc file paths.
+    """
+    cmd_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd')
+    oldff_path = os.path.join(cmd_path, 'oldff')
+
+    leaprc_paths = []
+    for forcefield in forcefields:
+
+        # Check if the forcefield is a path to an existing file
+        if os.path.exists(forcefield):
+            leaprc_paths.append(forcefield)
+            continue
+
+        # Check the leaprc and oldff directories, with and without the leaprc prefix
+        for directory, name in ((cmd_path, f"leaprc.{forcefield}"), (oldff_path, f"leaprc.{forcefield}"), (cmd_path, forcefield), (oldff_path, forcefield)):
+            if os.sep in name:
+                found = os.path.exists(os.path.join(directory, name))
+            else:
+                found = name in _directory_files(directory)
+            if found:
+                leaprc_paths.append(os.path.join(directory, name))
+                break
+        else:
+            raise ValueError(f"Force field {forcefield} not found. Check the $AMBERHOME/dat/leap/cmd/ directory for available force fields or provide the path to an existing leaprc file.")
+
+    return leaprc_paths
+
+
+# SALT CONCENTRATION
+ION_METHODS = ("water_count", "volume", "sltcap")
+
+# Ions per cubic Angstrom of a 1 M solution (Avogadro constant / 1e27 A^3 per L)
+_IONS_PER_MOLAR_A3 = 6.02214076e23 * 1e-27
+
+_PDB_BOX = re.compile(r"^(?:OCTBOX|CRYST1)" + r"\s+(\d+\.\d+)" * 6, re.M)
+_TLEAP_CHARGE = re.compile(r"Total unperturbed charge:\s*(-?\d+\.\d+)")
+_TLEAP_VOLUME = re.compile(r"Volume:\s*(\d+\.?\d*)\s*A\^3")
+
+
+def box_volume(a: float, b: float, c: float, alpha: float = 90.0, beta: float = 90.0, gamma: float = 90.0) -> float:
+    """Volume (A^3) of a periodic box from its lengths (A) and angles (degrees)."""
+    cos_a, cos_b, cos_g = (math.cos(math.radians(angle)) for angle in (alpha, beta, gamma))
+    return a * b * c * math.sqrt(max(0.0, 1 - cos_a ** 2 - cos_b ** 2 - cos_g ** 2 + 2 * cos_a * cos_b * cos_g))
+
+
+def pdb_box_volume(pdb_path: str) -> Optional[float]:
+    """Volume (A^3) of the box of the OCTBOX or CRYST1 record of a PDB file, None if it has no box."""
+    with open(pdb_path) as pdb:
+        for line in pdb:
+            if line.startswith(("ATOM", "HETATM")):
+                break
+            match = _PDB_BOX.match(line)
+            if match:
+                return box_volume(*map(float, match.groups()))
+    return None
+
+
+def tleap_log_values(log_path: str) -> dict:
+    """Net charge of the last charge command, volume of the last solvate command and number of residues added
+    (waters) read from a tleap log file."""
+    with open(log_path) as log:
+        text = log.read()
+    values: dict = {}
+    for key, regex, conv in (("charge", _TLEAP_CHARGE, float), ("volume", _TLEAP_VOLUME, float), ("waters", re.compile(r"Added (\d+) residues"), int)):
+        found = regex.findall(text)
+        if found:
+            values[key] = conv(found[-1])
+    return values
+
+
+def salt_ions(method: str, concentration: float, n_waters: int = 0, volume: Optional[float] = None, charge: Optional[float] = None,
+              neutralised: bool = True, out_log=None, global_log=None) -> tuple[int, int]:
+    """Numbers of positive and negative ions giving a *concentration* (mM) salt solution.
+
+    * water_count: #waters / 55 M * concentration ion pairs.
+    * volume: concentration * box *volume* * Avogadro constant ion pairs.
+    * sltcap: screening layer tally by container average potential (Schmit et al. J. Chem. Theory Comput. 2018, 14, 1823),
+      N+/- = N0 * (sqrt(1 + (Q / 2 N0)^2) -/+ Q / 2 N0) for a solute of net *charge* Q, N0 being the water_count pairs.
+      If *neutralised*, the counterions are added apart, so only the pairs beyond the neutralisation are returned.
+
+    Falls back to water_count when the volume or the net charge are not available."""
+    molar = concentration / 1000
+    if method == "volume" and not volume:
+        fu.log("WARNING: box volume not available, using the water_count ions method", out_log, global_log)
+        method = "water_count"
+    if method == "sltcap" and charge is None:
+        fu.log("WARNING: net charge of the solute not available, using the water_count ions method", out_log, global_log)
+        method = "water_count"
+
+    if method == "volume":
+        pairs = molar * _IONS_PER_MOLAR_A3 * float(volume or 0)
+        fu.log("%.1f A^3 box, %d ion pairs for a %s mM concentration" % (float(volume or 0), int(pairs), concentration), out_log, global_log)
+        return int(pairs), int(pairs)
+
+    pairs = n_waters / 55 * molar
+    if method != "sltcap" or not pairs:
+        fu.log("%d water molecules, %d ion pairs for a %s mM concentration" % (n_waters, int(pairs), concentration), out_log, global_log)
+        return int(pairs), int(pairs)
+
+    ratio = float(charge or 0) / (2 * pairs)
+    positive = pairs * (math.sqrt(1 + ratio ** 2) - ratio)
+    negative = pairs * (math.sqrt(1 + ratio ** 2) + ratio)
+    fu.log("SLTCAP: %d water molecules and %+.1f net charge, %d positive and %d negative ions for a %s mM concentration"
+           % (n_waters, float(charge or 0), round(positive), round(negative), concentration), out_log, global_log)
+    if neutralised:
+        return round(min(positive, negative)), round(min(positive, negative))
+    return round(positive), round(negative)
+
+
 def _from_string_to_list(input_data: Optional[Union[str, list[str]]]) -> list[str]:
     """
     Converts a string to a list, splitting by commas or spaces. If the input is already a list, returns it as is.
@@ -91,3 +281,220 @@ def _from_string_to_list(input_data: Optional[Union[str, list[str]]]) -> list[st
     processed_items = [item.strip() for item in items if item.strip()]
 
     return processed_items
+
+
+# PERSISTENT TLEAP SESSIONS
+_LOAD_COMMANDS = ("source", "loadoff", "loadamberparams", "loadamberprep")
+_ASSIGNMENT = re.compile(r"^\s*([A-Za-z_]\w*)\s*=")
+_TLEAP_POOL: dict = {}
+_TLEAP_POOL_LOCK = threading.Lock()
+# Seconds a tleap session may spend on the commands of an execution when the block has no timeout property
+TLEAP_SESSION_TIMEOUT = 3600
+
+
+def absolute_sandbox_paths(stage_io_dict: dict) -> None:
+    """Makes the local sandbox paths of the *stage_io_dict* absolute. With chdir_sandbox they are names relative to the
+    sandbox, which tleap sessions (started outside the sandbox) and the job folders of split_tleap_script do not resolve."""
+    unique_dir = stage_io_dict["unique_dir"]
+    for io in ("in", "out"):
+        # New dictionaries, without disable_sandbox they are the ones of io_dict
+        paths = dict(stage_io_dict.get(io, {}))
+        for file_ref, file_path in paths.items():
+            path = os.path.join(unique_dir, file_path) if file_path else None
+            if path and (io == "out" or os.path.exists(path)):
+                paths[file_ref] = os.path.abspath(path)
+        stage_io_dict[io] = paths
+
+
+def _session_key(binary_path: str, preload: list[str]) -> tuple:
+    return (binary_path, os.getcwd(), os.getenv("AMBERHOME", ""), tuple(preload))
+
+
+class TleapSession:
+    """Long-lived tleap process reading the commands from its standard input.
+    The *preload* commands (force fields, water models, ion libraries) are executed once when the process starts."""
+
+    def __init__(self, binary_path: str, preload: list[str]) -> None:
+        self.key = _session_key(binary_path, preload)
+        self.process = subprocess.Popen([binary_path, "-f", "-"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, text=True, bufsize=1)
+        self.dirty = False
+        self._output: list[str] = []
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        self.send(preload)
+
+    def _read(self) -> None:
+        assert self.process.stdout
+        for line in self.process.stdout:
+            with self._lock:
+                self._output.append(line)
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def send(self, commands: list[str]) -> None:
+        assert self.process.stdin
+        self.process.stdin.write("".join(command if command.endswith("\n") else command + "\n" for command in commands))
+        self.process.stdin.flush()
+
+    def take_output(self) -> str:
+        with self._lock:
+            output, self._output = "".join(self._output), []
+        return output
+
+    def run(self, commands: list[str], marker_path: str, log_path: Optional[str] = None, timeout: Optional[float] = None,
+            out_log=None, poll: float = 0.01) -> int:
+        """Executes the *commands* and waits until tleap opens the *marker_path* log file sent after them.
+        If *log_path* is set, the tleap log of the commands is written (and closed) in that file.
+        The process is killed if the commands take more than *timeout* seconds (TLEAP_SESSION_TIMEOUT if None).
+        Returns 0 or the exit code of tleap if it dies in the middle."""
+        timeout = timeout or TLEAP_SESSION_TIMEOUT
+        deadline = time.monotonic() + timeout
+        self.send((["logFile %s" % log_path] if log_path else []) + commands + ["logFile %s" % marker_path])
+        while not os.path.exists(marker_path):
+            if not self.alive():
+                self._reader.join(timeout=1)
+                return self.process.returncode or 1
+            if time.monotonic() > deadline:
+                fu.log("Timeout: %s seconds expired, killing tleap session %d" % (timeout, self.process.pid), out_log)
+                self.process.kill()
+                self.process.wait()
+                self._reader.join(timeout=1)
+                return 1
+            time.sleep(poll)
+        return 0
+
+    def close(self) -> None:
+        if self.alive():
+            try:
+                self.send(["quit"])
+                assert self.process.stdin
+                self.process.stdin.close()
+                self.process.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+
+
+def _load_argument(line: str) -> Optional[str]:
+    """Returns the file loaded by a source/loadOff/loadAmberParams/loadAmberPrep tleap command or None."""
+    words = line.split()
+    if len(words) == 2 and words[0].lower() in _LOAD_COMMANDS:
+        return words[1]
+    return None
+
+
+def _is_job_file(path: str, job_dirs: list[str]) -> bool:
+    path = os.path.abspath(path)
+    return any(path.startswith(os.path.abspath(job_dir) + os.sep) for job_dir in job_dirs if job_dir)
+
+
+def split_tleap_script(lines: list[str], job_dirs: list[str]) -> tuple[list[str], list[str]]:
+    """Splits the tleap script *lines* in the leading commands loading files outside the *job_dirs* folders
+    (force fields, water models, ion libraries), shared by all the executions, and the job commands.
+    Empty lines and quit commands are removed."""
+    lines = [line.strip() for line in lines if line.strip() and line.split()[0].lower() != "quit"]
+    num_preload = 0
+    for line in lines:
+        argument = _load_argument(line)
+        if argument is None or _is_job_file(argument, job_dirs):
+            break
+        num_preload += 1
+    return lines[:num_preload], lines[num_preload:]
+
+
+def loads_job_files(commands: list[str], job_dirs: list[str]) -> bool:
+    """True if the tleap *commands* load parameters from files inside the *job_dirs* folders."""
+    return any(_is_job_file(argument, job_dirs) for argument in map(_load_argument, commands) if argument)
+
+
+def clear_variables_command(commands: list[str]) -> list[str]:
+    """tleap command removing the variables assigned by the *commands*, if any."""
+    variables = sorted({match.group(1) for match in map(_ASSIGNMENT.match, commands) if match})
+    return ["clearVariables { %s }" % " ".join(variables)] if variables else []
+
+
+def acquire_tleap_session(binary_path: str, preload: list[str], out_log=None) -> TleapSession:
+    """Takes an idle tleap session with the same *preload* commands from the pool or starts a new one."""
+    key = _session_key(binary_path, preload)
+    with _TLEAP_POOL_LOCK:
+        idle = _TLEAP_POOL.setdefault(key, [])
+        while idle and not idle[-1].alive():
+            idle.pop()
+        session = idle.pop() if idle else None
+    if session:
+        fu.log("Reusing tleap session %d" % session.process.pid, out_log)
+        return session
+    session = TleapSession(binary_path, preload)
+    fu.log("Starting tleap session %d: %s" % (session.process.pid, "; ".join(preload)), out_log)
+    return session
+
+
+def release_tleap_session(session: TleapSession, return_code: int = 0) -> None:
+    """Returns the *session* to the pool, or closes it if the execution failed or loaded job specific parameters."""
+    if return_code or session.dirty or not session.alive():
+        session.close()
+        return
+    with _TLEAP_POOL_LOCK:
+        _TLEAP_POOL.setdefault(session.key, []).append(session)
+
+
+def run_tleap_session(binary_path: str, instructions_file: str, job_dirs: list[str], out_log=None, timeout: Optional[float] = None) -> int:
+    """Executes the *instructions_file* tleap script in a pooled persistent tleap process.
+
+    The leading commands loading files outside the *job_dirs* folders (force fields, water models, ion libraries)
+    are run once per process and identify the pool of processes that can be reused. The variables created by the
+    script are cleared afterwards, and processes that loaded job specific parameters (files inside *job_dirs*) are
+    closed instead of being returned to the pool. The process is killed if the script takes more than *timeout* seconds."""
+    with open(instructions_file) as leapin:
+        preload, commands = split_tleap_script(leapin.readlines(), job_dirs)
+    session = acquire_tleap_session(binary_path, preload, out_log)
+    session.dirty = loads_job_files(commands, job_dirs)
+    marker_path = str(PurePath(instructions_file).parent.joinpath("leap.%s.done" % uuid.uuid4().hex))
+    try:
+        return_code = session.run(commands + clear_variables_command(commands), marker_path, timeout=timeout, out_log=out_log)
+        output = session.take_output()
+        if output:
+            fu.log(output, out_log)
+    except BaseException:
+        session.close()
+        raise
+    release_tleap_session(session, return_code)
+    return return_code
+
+
+def tleap_net_charge(binary_path: str, commands: list[str], job_dirs: list[str], work_dir: str, pooled: bool = False, out_log=None,
+                     timeout: Optional[float] = None) -> Optional[float]:
+    """Net charge of the *mol* unit built by the tleap *commands*, computed in a tleap session
+    (a pooled one if *pooled*) without saving any file. Returns None if tleap fails."""
+    preload, job_commands = split_tleap_script(commands, job_dirs)
+    if pooled:
+        session = acquire_tleap_session(binary_path, preload, out_log)
+        session.dirty = loads_job_files(job_commands, job_dirs)
+    else:
+        session = TleapSession(binary_path, preload)
+        session.dirty = True
+    log_path = str(PurePath(work_dir).joinpath("charge.log"))
+    try:
+        return_code = session.run(job_commands + ["charge mol"] + clear_variables_command(job_commands),
+                                  str(PurePath(work_dir).joinpath("leap.%s.done" % uuid.uuid4().hex)), log_path, timeout, out_log)
+        session.take_output()
+    except BaseException:
+        session.close()
+        raise
+    release_tleap_session(session, return_code)
+    if return_code or not os.path.exists(log_path):
+        return None
+    return tleap_log_values(log_path).get("charge")
+
+
+@atexit.register
+def close_tleap_sessions() -> None:
+    """Closes all the pooled tleap sessions."""
+    with _TLEAP_POOL_LOCK:
+        sessions = [session for idle in _TLEAP_POOL.values() for session in idle]
+        _TLEAP_POOL.clear()
+    for session in sessions:
+        session.close()
@@ -4,19 +4,27 @@
 
 import os
 import re
-import shutil
-from decimal import Decimal
 from pathlib import PurePath
-from typing import List, Optional
+from typing import Optional, Tuple
 
-from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
 
-from biobb_amber.leap.common import _from_string_to_list
-
-
-class LeapAddIons(BiobbObject):
+from biobb_amber.leap.common import (
+    _from_string_to_list,
+    absolute_sandbox_paths,
+    count_pdb_waters,
+    find_leaprc_paths,
+    pdb_box_volume,
+    run_tleap_session,
+    salt_ions,
+    tleap_net_charge,
+)
+from biobb_amber.leap.prmtop import POINTERS, Prmtop
+from biobb_amber.cache import CachedBiobbObject
+
+
+class LeapAddIons(CachedBiobbObject):
     """
     | biobb_amber LeapAddIons
     | Wrapper of the `AmberTools (AMBER MD Package) leap tool <https://ambermd.org/AmberTools.php>`_ module.
@@ -39,14 +47,19 @@ class LeapAddIons(BiobbObject):
             * **ions_type** (*str*) - ("ionsjc_tip3p") Ions type. Values: ionsjc_tip3p, ionsjc_spce, ionsff99_tip3p, ions_charmm22, ionsjc_tip4pew, None.
             * **neutralise** (*bool*) - ("True") Energetically neutralise the system adding the necessary counterions.
             * **ionic_concentration** (*float*) - (50) Additional ionic concentration to include in the system box. Units in mM/L.
+            * **ions_method** (*str*) - ("water_count") Algorithm computing the number of ions of the *ionic_concentration*. Values: water_count (Ion pairs from the number of water molecules of the system: #waters / 55 M * concentration), volume (Ion pairs from the volume of the system box: concentration * volume * Avogadro constant), sltcap (SLTCAP screening layer method: positive and negative ions from the number of water molecules and the net charge of the system computed by tLeap. More accurate for large or highly charged solutes. Only in local executions).
             * **positive_ions_number** (*int*) - (0) Number of additional positive ions to include in the system box.
             * **negative_ions_number** (*int*) - (0) Number of additional negative ions to include in the system box.
             * **positive_ions_type** (*str*) - ("Na+") Type of additional positive ions to include in the system box. Values: Na+,K+.
             * **negative_ions_type** (*str*) - ("Cl-") Type of additional negative ions to include in the system box. Values: Cl-.
             * **binary_path** (*str*) - ("tleap") Path to the tleap executable binary.
+            * **tleap_session** (*bool*) - (False) Run the tleap commands in a pooled tleap process kept alive between executions of the same Python session, loading the force fields only once. The process is killed if an execution takes longer than the timeout property (1 hour if not set). Not available with containers.
+            * **cache_path** (*str*) - (None) Path to the result cache folder. If set, the outputs of a previous execution with the same input file contents, properties, tleap binary and force field files are restored from the cache instead of running tleap. The random positions of the ions (addionsRand) are reused too.
+            * **cache_size** (*int*) - (1024) [1~1000000|1] Maximum size of the result cache folder in MB. The least recently used results are evicted.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
             * **container_path** (*str*) - (None) Container path definition.
             * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
             * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
@@ -145,80 +158,25 @@ class LeapAddIons(BiobbObject):
             )
 
             # Find the paths of the leaprc files if only the force field names are provided
-            self.forcefield = self.find_leaprc_paths(self.forcefield)
+            self.forcefield = find_leaprc_paths(self.forcefield)
 
         self.water_type = properties.get("water_type", "TIP3PBOX")
         self.box_type = properties.get("box_type", "truncated_octahedron")
         self.ions_type = properties.get("ions_type", "ionsjc_tip3p")
         self.neutralise = properties.get("neutralise", True)
         self.ionic_concentration = properties.get("ionic_concentration", 50)
+        self.ions_method = properties.get("ions_method", "water_count")
         self.positive_ions_number = properties.get("positive_ions_number", 0)
         self.positive_ions_type = properties.get("positive_ions_type", "Na+")
         self.negative_ions_number = properties.get("negative_ions_number", 0)
         self.negative_ions_type = properties.get("negative_ions_type", "Cl-")
         self.binary_path = properties.get("binary_path", "tleap")
+        self.tleap_session = properties.get("tleap_session", False)
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
-    def find_leaprc_paths(self, forcefields: List[str]) -> List[str]:
-        """
-        Find the leaprc paths for the force fields provided.
-
-        For each item in the forcefields list, the function checks if the str is a path to an existing file.
-        If not, it tries to find the file in the $AMBERHOME/dat/leap/cmd/ directory or the $AMBERHOME/dat/leap/cmd/oldff/
-        directory with and without the leaprc prefix.
-
-        Args:
-            forcefields (List[str]): List of force fields to find the leaprc files for.
-
-        Returns:
-            List[str]: List of leaprc file paths.
-        """
-
-        leaprc_paths = []
-
-        for forcefield in forcefields:
-
-            num_paths = len(leaprc_paths)
-
-            # Check if the forcefield is a path to an existing file
-            if os.path.exists(forcefield):
-                leaprc_paths.append(forcefield)
-                continue
-
-            # Check if the forcefield is in the leaprc directory
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', f"leaprc.{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            # Check if the forcefield is in the oldff directory
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', 'oldff', f"leaprc.{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            # Check if the forcefield is in the leaprc directory without the leaprc prefix
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', f"{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            # Check if the forcefield is in the oldff directory without the leaprc prefix
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', 'oldff', f"{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            new_num_paths = len(leaprc_paths)
-
-            if new_num_paths == num_paths:
-                raise ValueError(f"Force field {forcefield} not found. Check the $AMBERHOME/dat/leap/cmd/ directory for available force fields or provide the path to an existing leaprc file.")
-
-        return leaprc_paths
-
     # def check_data_params(self, out_log, err_log):
     #     """ Checks input/output paths correctness """
 
@@ -234,28 +192,15 @@ class LeapAddIons(BiobbObject):
     #     self.io_dict["out"]["output_top_path"] = check_output_path(self.io_dict["out"]["output_top_path"], "output_top_path", False, out_log, self.__class__.__name__)
     #     self.io_dict["out"]["output_crd_path"] = check_output_path(self.io_dict["out"]["output_crd_path"], "output_crd_path", False, out_log, self.__class__.__name__)
 
-    def find_out_number_of_ions(self):
-        """Computes the number of positive and negative ions from the input ionic
-        concentration and the number of water molecules in the system box."""
-
-        # Finding number of water molecules in the box
-        cnt = 0
-        with open(self.io_dict["in"]["input_pdb_path"]) as fp:
-            for line in fp:
-                # Water molecules are identified with different resids
-                # by different forcefields / MD packages
-                pq = re.compile((r"WAT|HOH|TP3|TIP3|SOL"), re.M)
-                if pq.search(line):
-                    # Incrementing number of water molecules just in the water
-                    # oxygen atom, ignoring hydrogen or dummy atoms
-                    pq2 = re.compile(r"H|EPW|EP1|EP2", re.M)
-                    if not pq2.search(line):
-                        cnt = cnt + 1
-
-        # To get to X mM ions we need
-        # n(NaCl) = #waters / 55 Mol * X M
-        # where X M = X mM / 1000
-        self.nio = int((cnt / 55) * (self.ionic_concentration / 1000))
+    def find_out_number_of_ions(self, charge: Optional[float] = None) -> Tuple[int, int]:
+        """Computes the number of positive and negative ions from the input ionic concentration with the
+        ions_method algorithm, using the water molecules and the box of the input PDB and the net *charge* of the system."""
+        input_pdb_path = self.io_dict["in"]["input_pdb_path"]
+        volume = pdb_box_volume(input_pdb_path) if self.ions_method == "volume" else None
+        npos, nneg = salt_ions(self.ions_method, self.ionic_concentration, count_pdb_waters(input_pdb_path), volume, charge,
+                               self.neutralise, self.out_log, self.global_log)
+        self.nio = npos
+        return npos, nneg
 
     @launchlogger
     def launch(self):
@@ -267,7 +212,12 @@ class LeapAddIons(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+        if self.restore_cache(self.forcefield):
+            return 0
         self.stage_files()
+        if not self.container_path:
+            # The tleap sessions run outside the sandbox
+            absolute_sandbox_paths(self.stage_io_dict)
 
         # Water Type
         # leaprc.water.tip4pew, tip4pd, tip3p, spceb, spce, opc, fb4, fb3
@@ -282,44 +232,6 @@ class LeapAddIons(BiobbObject):
         if re.match(r"OPC", self.water_type):
             source_wat_command = "source leaprc.water.opc"
 
-        # Counterions
-        ions_command = ""
-        if self.neutralise:
-            # ions_command = ions_command + "addions mol " + self.negative_ions_type + " 0 \n"
-            # ions_command = ions_command + "addions mol " + self.positive_ions_type + " 0 \n"
-            ions_command = (
-                ions_command + "addionsRand mol " + self.negative_ions_type + " 0 \n"
-            )
-            ions_command = (
-                ions_command + "addionsRand mol " + self.positive_ions_type + " 0 \n"
-            )
-
-        if (
-            self.ionic_concentration and self.negative_ions_number == 0 and self.positive_ions_number == 0
-        ):
-            self.find_out_number_of_ions()
-            nneg = self.nio  # Update with function
-            npos = self.nio  # Update with function
-            # ions_command = ions_command + "addions mol " + self.negative_ions_type + " " + str(nneg) + " \n"
-            # ions_command = ions_command + "addions mol " + self.positive_ions_type + " " + str(npos) + " \n"
-            ions_command = (
-                ions_command + "addionsRand mol " + self.negative_ions_type + " " + str(nneg) + " \n"
-            )
-            ions_command = (
-                ions_command + "addionsRand mol " + self.positive_ions_type + " " + str(npos) + " \n"
-            )
-        else:
-            if self.negative_ions_number != 0:
-                # ions_command = ions_command + "addions mol " + self.negative_ions_type + " " + str(self.negative_ions_number) + " \n"
-                ions_command = (
-                    ions_command + "addionsRand mol " + self.negative_ions_type + " " + str(self.negative_ions_number) + " \n"
-                )
-            if self.positive_ions_number != 0:
-                # ions_command = ions_command + "addions mol " + self.positive_ions_type + " " + str(self.positive_ions_number) + " \n"
-                ions_command = (
-                    ions_command + "addionsRand mol " + self.positive_ions_type + " " + str(self.positive_ions_number) + " \n"
-                )
-
         # Creating temporary folder & Leap configuration (instructions) file
         if self.container_path:
             instructions_file = str(
@@ -439,6 +351,53 @@ class LeapAddIons(BiobbObject):
                 "mol = loadpdb " + self.stage_io_dict["in"]["input_pdb_path"] + " \n"
             )
 
+        # Net charge of the system, computed by tleap from the commands above
+        charge = None
+        if self.ions_method == "sltcap" and self.ionic_concentration and self.negative_ions_number == 0 and self.positive_ions_number == 0:
+            if self.container_path:
+                fu.log("WARNING: the net charge of the system for the sltcap ions_method is only available in local executions", self.out_log, self.global_log)
+            else:
+                with open(instructions_file) as leapin:
+                    charge = tleap_net_charge(self.binary_path, leapin.readlines(), [self.stage_io_dict["unique_dir"], str(tmp_folder)],
+                                              str(tmp_folder), self.tleap_session, self.out_log, self.timeout)
+
+        # Counterions
+        ions_command = ""
+        if self.neutralise:
+            # ions_command = ions_command + "addions mol " + self.negative_ions_type + " 0 \n"
+            # ions_command = ions_command + "addions mol " + self.positive_ions_type + " 0 \n"
+            ions_command = (
+                ions_command + "addionsRand mol " + self.negative_ions_type + " 0 \n"
+            )
+            ions_command = (
+                ions_command + "addionsRand mol " + self.positive_ions_type + " 0 \n"
+            )
+
+        if (
+            self.ionic_concentration and self.negative_ions_number == 0 and self.positive_ions_number == 0
+        ):
+            npos, nneg = self.find_out_number_of_ions(charge)
+            # ions_command = ions_command + "addions mol " + self.negative_ions_type + " " + str(nneg) + " \n"
+            # ions_command = ions_command + "addions mol " + self.positive_ions_type + " " + str(npos) + " \n"
+            ions_command = (
+                ions_command + "addionsRand mol " + self.negative_ions_type + " " + str(nneg) + " \n"
+            )
+            ions_command = (
+                ions_command + "addionsRand mol " + self.positive_ions_type + " " + str(npos) + " \n"
+            )
+        else:
+            if self.negative_ions_number != 0:
+                # ions_command = ions_command + "addions mol " + self.negative_ions_type + " " + str(self.negative_ions_number) + " \n"
+                ions_command = (
+                    ions_command + "addionsRand mol " + self.negative_ions_type + " " + str(self.negative_ions_number) + " \n"
+                )
+            if self.positive_ions_number != 0:
+                # ions_command = ions_command + "addions mol " + self.positive_ions_type + " " + str(self.positive_ions_number) + " \n"
+                ions_command = (
+                    ions_command + "addionsRand mol " + self.positive_ions_type + " " + str(self.positive_ions_number) + " \n"
+                )
+
+        with open(instructions_file, "a") as leapin:
             # Adding ions
             leapin.write(ions_command)
 
@@ -464,7 +423,10 @@ class LeapAddIons(BiobbObject):
         self.cmd = [self.binary_path, "-f", instructions_file_path]
 
         # Run Biobb block
-        self.run_biobb()
+        if self.tleap_session and not self.container_path:
+            self.return_code = run_tleap_session(self.binary_path, instructions_file, [self.stage_io_dict["unique_dir"], str(tmp_folder)], self.out_log, self.timeout)
+        else:
+            self.run_biobb()
 
         # Copy files to host
         self.copy_to_host()
@@ -497,13 +459,6 @@ class LeapAddIons(BiobbObject):
                 for coord in box:
                     box_line += "{:12.7f}".format(float(coord))
 
-                # PRMTOP info: 1.09471219E+02  8.63157502E+01  8.63157502E+01  8.63157502E+01
-                top_box_line = ""
-                top_box_line += "  %.8E" % Decimal(float(box[3]))
-                top_box_line += "  %.8E" % Decimal(float(box[0]))
-                top_box_line += "  %.8E" % Decimal(float(box[1]))
-                top_box_line += "  %.8E" % Decimal(float(box[2]))
-
                 # Removing box generated by tleap from the crd file (last line)
                 with open(self.io_dict["out"]["output_crd_path"]) as file:
                     lines = file.readlines()
@@ -517,44 +472,20 @@ class LeapAddIons(BiobbObject):
                         file.write(str(line))
                     file.write("\n")
 
-                # Now fixing IFBOX param in prmtop.
-                box_flag = False
-                ifbox_flag = 0
-                # %FLAG BOX_DIMENSIONS
-                # %FORMAT(5E16.8)
-                # 1.09471219E+02  8.63157502E+01  8.63157502E+01  8.63157502E+01
-
-                tmp_parmtop = str(
-                    # PurePath(str(tmp_folder)).joinpath("top_temp.parmtop")
-                    PurePath(self.stage_io_dict["unique_dir"]).joinpath("top_temp.parmtop")
-                )
-                shutil.copyfile(self.io_dict["out"]["output_top_path"], tmp_parmtop)
-
-                with open(self.io_dict["out"]["output_top_path"], "w") as new_top:
-                    with open(tmp_parmtop, "r") as old_top:
-                        for line in old_top:
-                            if "BOX_DIMENSIONS" in line:
-                                box_flag = True
-                                new_top.write(line)
-                            elif box_flag and "FORMAT" not in line:
-                                new_top.write(top_box_line + "\n")
-                                box_flag = False
-                            elif (
-                                "FLAG POINTERS" in line or ifbox_flag == 1 or ifbox_flag == 2 or ifbox_flag == 3
-                            ):
-                                ifbox_flag += 1
-                                new_top.write(line)
-                            elif ifbox_flag == 4:
-                                # new_top.write(top_box_line + "\n")
-                                new_top.write(line[:56] + "       2" + line[64:])
-                                ifbox_flag += 1
-                            else:
-                                new_top.write(line)
+                # Now fixing IFBOX and BOX_DIMENSIONS in the prmtop (beta angle and box lengths).
+                # PRMTOP info: 1.09471219E+02  8.63157502E+01  8.63157502E+01  8.63157502E+01
+                prmtop = Prmtop(self.io_dict["out"]["output_top_path"])
+                pointers = prmtop.read("POINTERS")
+                pointers[POINTERS.index("IFBOX")] = 2
+                prmtop.write({"POINTERS": pointers, "BOX_DIMENSIONS": [float(box[3]), float(box[0]), float(box[1]), float(box[2])]})
 
         # remove temporary folder(s)
         self.tmp_files.extend([str(tmp_folder), "leap.log"])
         self.remove_tmp_files()
 
+        # Store the outputs in the result cache
+        self.store_cache()
+
         self.check_arguments(output_files_created=True, raise_exception=False)
 
         return self.return_code
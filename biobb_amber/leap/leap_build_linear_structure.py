@@ -4,16 +4,16 @@
 
 import os
 from pathlib import PurePath
-from typing import List, Optional
+from typing import Optional
 
-from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
 
-from biobb_amber.leap.common import _from_string_to_list, check_output_path
+from biobb_amber.leap.common import _from_string_to_list, check_output_path, find_leaprc_paths
+from biobb_amber.cache import CachedBiobbObject
 
 
-class LeapBuildLinearStructure(BiobbObject):
+class LeapBuildLinearStructure(CachedBiobbObject):
     """
     | biobb_amber.leap.leap_build_linear_structure LeapBuildLinearStructure
     | Wrapper of the `AmberTools (AMBER MD Package) leap tool <https://ambermd.org/AmberTools.php>`_ module.
@@ -26,9 +26,12 @@ class LeapBuildLinearStructure(BiobbObject):
             * **forcefield** (*list*) - (["protein.ff14SB","DNA.bsc1","gaff"]) Forcefields to be used for the structure generation. Each item should be either a path to a leaprc file or a string with the leaprc file name if the force field is included with Amber (e.g. "/path/to/leaprc.protein.ff14SB" or "protein.ff14SB"). Default values: ["protein.ff14SB","DNA.bsc1","gaff"].
             * **build_library** (*bool*) - (False) Generate AMBER lib file for the structure.
             * **binary_path** (*str*) - ("tleap") Path to the tleap executable binary.
+            * **cache_path** (*str*) - (None) Path to the result cache folder. If set, the outputs of a previous execution with the same input file contents, properties, tleap binary and force field files are restored from the cache instead of running tleap.
+            * **cache_size** (*int*) - (1024) [1~1000000|1] Maximum size of the result cache folder in MB. The least recently used results are evicted.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
             * **container_path** (*str*) - (None) Container path definition.
             * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
             * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
@@ -89,7 +92,7 @@ class LeapBuildLinearStructure(BiobbObject):
             )
 
             # Find the paths of the leaprc files if only the force field names are provided
-            self.forcefield = self.find_leaprc_paths(self.forcefield)
+            self.forcefield = find_leaprc_paths(self.forcefield)
 
         self.sequence = properties.get("sequence", "ALA GLY SER PRO ARG ALA PRO GLY")
         self.build_library = properties.get("build_library", False)
@@ -111,63 +114,6 @@ class LeapBuildLinearStructure(BiobbObject):
             self.__class__.__name__,
         )
 
-    def find_leaprc_paths(self, forcefields: List[str]) -> List[str]:
-        """
-        Find the leaprc paths for the force fields provided.
-
-        For each item in the forcefields list, the function checks if the str is a path to an existing file.
-        If not, it tries to find the file in the $AMBERHOME/dat/leap/cmd/ directory or the $AMBERHOME/dat/leap/cmd/oldff/
-        directory with and without the leaprc prefix.
-
-        Args:
-            forcefields (List[str]): List of force fields to find the leaprc files for.
-
-        Returns:
-            List[str]: List of leaprc file paths.
-        """
-
-        leaprc_paths = []
-
-        for forcefield in forcefields:
-
-            num_paths = len(leaprc_paths)
-
-            # Check if the forcefield is a path to an existing file
-            if os.path.exists(forcefield):
-                leaprc_paths.append(forcefield)
-                continue
-
-            # Check if the forcefield is in the leaprc directory
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', f"leaprc.{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            # Check if the forcefield is in the oldff directory
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', 'oldff', f"leaprc.{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            # Check if the forcefield is in the leaprc directory without the leaprc prefix
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', f"{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            # Check if the forcefield is in the oldff directory without the leaprc prefix
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', 'oldff', f"{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            new_num_paths = len(leaprc_paths)
-
-            if new_num_paths == num_paths:
-                raise ValueError(f"Force field {forcefield} not found. Check the $AMBERHOME/dat/leap/cmd/ directory for available force fields or provide the path to an existing leaprc file.")
-
-        return leaprc_paths
-
     @launchlogger
     def launch(self):
         """Launches the execution of the LeapBuildLinearStructure module."""
@@ -178,6 +124,8 @@ class LeapBuildLinearStructure(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+        if self.restore_cache(self.forcefield):
+            return 0
         self.stage_files()
 
         # create .in file
@@ -228,6 +176,9 @@ class LeapBuildLinearStructure(BiobbObject):
         self.tmp_files.extend([str(tmp_folder), "leap.log"])
         self.remove_tmp_files()
 
+        # Store the outputs in the result cache
+        self.store_cache()
+
         self.check_arguments(output_files_created=True, raise_exception=False)
 
         return self.return_code
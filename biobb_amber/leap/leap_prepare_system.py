@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+
+"""Module containing the LeapPrepareSystem class and the command line interface."""
+
+import os
+import re
+import uuid
+from pathlib import PurePath
+from typing import List, Optional
+
+from biobb_common.tools import file_utils as fu
+from biobb_common.tools.file_utils import launchlogger
+
+from biobb_amber.cache import CachedBiobbObject
+from biobb_amber.leap.common import (
+    TleapSession,
+    _from_string_to_list,
+    absolute_sandbox_paths,
+    acquire_tleap_session,
+    clear_variables_command,
+    find_leaprc_paths,
+    loads_job_files,
+    release_tleap_session,
+    run_tleap_session,
+    salt_ions,
+    split_tleap_script,
+    tleap_log_values,
+)
+
+
+class LeapPrepareSystem(CachedBiobbObject):
+    """
+    | biobb_amber.leap.leap_prepare_system LeapPrepareSystem
+    | Wrapper of the `AmberTools (AMBER MD Package) leap tool <https://ambermd.org/AmberTools.php>`_ module.
+    | Generates the topology, solvates the system box and adds the counterions of an AMBER MD system in a single tLeap execution, the fused equivalent of LeapGenTop, LeapSolvate and LeapAddIons.
+
+    Args:
+        input_pdb_path (str): Input 3D structure PDB file. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/leap/structure.leapin.pdb>`_. Accepted formats: pdb (edam:format_1476).
+        input_lib_path (str) (Optional): Input ligand library parameters file. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/leap/ligand.lib>`_. Accepted formats: lib (edam:format_3889), zip (edam:format_3987).
+        input_frcmod_path (str) (Optional): Input ligand frcmod parameters file. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/leap/ligand.frcmod>`_. Accepted formats: frcmod (edam:format_3888), zip (edam:format_3987).
+        input_params_path (str) (Optional): Additional leap parameter files to load with loadAmberParams Leap command. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/leap/frcmod.ionsdang_spce.txt>`_. Accepted formats: in (edam:format_2330), leapin (edam:format_2330), txt (edam:format_2330), zip (edam:format_3987).
+        input_prep_path (str) (Optional): Additional leap parameter files to load with loadAmberPrep Leap command. File type: input. Accepted formats: in (edam:format_2330), leapin (edam:format_2330), txt (edam:format_2330), zip (edam:format_3987).
+        input_source_path (str) (Optional): Additional leap command files to load with source Leap command. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/leap/leaprc.water.spce.txt>`_. Accepted formats: in (edam:format_2330), leapin (edam:format_2330), txt (edam:format_2330), zip (edam:format_3987).
+        output_pdb_path (str): Output 3D structure PDB file matching the topology file. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/leap/structure.ions.pdb>`_. Accepted formats: pdb (edam:format_1476).
+        output_top_path (str): Output topology file (AMBER ParmTop). File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/leap/structure.ions.top>`_. Accepted formats: top (edam:format_3881), parmtop (edam:format_3881), prmtop (edam:format_3881).
+        output_crd_path (str): Output coordinates file (AMBER crd). File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/leap/structure.ions.crd>`_. Accepted formats: crd (edam:format_3878), mdcrd (edam:format_3878), inpcrd (edam:format_3878).
+        properties (dic - Python dictionary object containing the tool parameters, not input/output files):
+            * **forcefield** (*list*) - (["protein.ff14SB","DNA.bsc1","gaff"]) Forcefields to be used for the structure generation. Each item should be either a path to a leaprc file or a string with the leaprc file name if the force field is included with Amber (e.g. "/path/to/leaprc.protein.ff14SB" or "protein.ff14SB"). Default values: ["protein.ff14SB","DNA.bsc1","gaff"].
+            * **water_type** (*str*) - ("TIP3PBOX") Water molecule parameters to be used for the topology. Values: POL3BOX, QSPCFWBOX, SPCBOX, SPCFWBOX, TIP3PBOX, TIP3PFBOX, TIP4PBOX, TIP4PEWBOX, OPCBOX, OPC3BOX, TIP5PBOX.
+            * **box_type** (*str*) - ("truncated_octahedron") Type for the MD system box. Values: cubic, truncated_octahedron.
+            * **ions_type** (*str*) - ("ionsjc_tip3p") Ions type. Values: ionsjc_tip3p, ionsjc_spce, ionsff99_tip3p, ions_charmm22, ionsjc_tip4pew, None.
+            * **distance_to_molecule** (*float*) - ("8.0") Size for the MD system box -in Angstroms-, defined such as the minimum distance between any atom originally present in solute and the edge of the periodic box is given by this distance parameter.
+            * **closeness** (*float*) - ("1.0") How close, in Å, solvent ATOMs may come to solute ATOMs.
+            * **iso** (*bool*) - ("False") Make the box isometric.
+            * **neutralise** (*bool*) - ("True") Energetically neutralise the system adding the necessary counterions.
+            * **ionic_concentration** (*float*) - (50) Additional ionic concentration to include in the system box. Units in mM/L. Computed from the tLeap solvation of the same execution, only used if the ions numbers are not set.
+            * **ions_method** (*str*) - ("water_count") Algorithm computing the number of ions of the *ionic_concentration*. Values: water_count (Ion pairs from the number of water molecules of the system: #waters / 55 M * concentration), volume (Ion pairs from the volume of the system box: concentration * volume * Avogadro constant), sltcap (SLTCAP screening layer method: positive and negative ions from the number of water molecules and the net charge of the system computed by tLeap. More accurate for large or highly charged solutes. Only in local executions).
+            * **positive_ions_number** (*int*) - (0) Number of additional positive ions to include in the system box.
+            * **negative_ions_number** (*int*) - (0) Number of additional negative ions to include in the system box.
+            * **positive_ions_type** (*str*) - ("Na+") Type of additional positive ions to include in the system box. Values: Na+,K+.
+            * **negative_ions_type** (*str*) - ("Cl-") Type of additional negative ions to include in the system box. Values: Cl-.
+            * **binary_path** (*str*) - ("tleap") Path to the tleap executable binary.
+            * **tleap_session** (*bool*) - (False) Run the tleap commands in a pooled tleap process kept alive between executions of the same Python session, loading the force fields only once. The process is killed if an execution takes longer than the timeout property (1 hour if not set). Not available with containers.
+            * **cache_path** (*str*) - (None) Path to the result cache folder. If set, the outputs of a previous execution with the same input file contents, properties, tleap binary and force field files are restored from the cache instead of running tleap. The random positions of the ions (addionsRand) are reused too.
+            * **cache_size** (*int*) - (1024) [1~1000000|1] Maximum size of the result cache folder in MB. The least recently used results are evicted.
+            * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
+            * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
+            * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
+            * **container_path** (*str*) - (None) Container path definition.
+            * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
+            * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
+            * **container_working_dir** (*str*) - (None) Container working directory definition.
+            * **container_user_id** (*str*) - (None) Container user_id definition.
+            * **container_shell_path** (*str*) - ('/bin/bash') Path to default shell inside the container.
+
+    Examples:
+        This is a use example of how to use the building block from Python::
+
+            from biobb_amber.leap.leap_prepare_system import leap_prepare_system
+            prop = {
+                'forcefield': ['protein.ff14SB'],
+                'water_type': 'TIP3PBOX',
+                'box_type': 'truncated_octahedron',
+                'neutralise' : True,
+                'ionic_concentration' : 150
+            }
+            leap_prepare_system(input_pdb_path='/path/to/structure.pdb',
+                                output_pdb_path='/path/to/newStructure.pdb',
+                                output_top_path='/path/to/newTopology.top',
+                                output_crd_path='/path/to/newCoordinates.crd',
+                                properties=prop)
+
+    Info:
+        * wrapped_software:
+            * name: AmberTools tLeap
+            * version: >20.9
+            * license: LGPL 2.1
+        * ontology:
+            * name: EDAM
+            * schema: http://edamontology.org/EDAM.owl
+
+    """
+
+    def __init__(
+        self,
+        input_pdb_path: str,
+        output_pdb_path: str,
+        output_top_path: str,
+        output_crd_path: str,
+        input_lib_path: Optional[str] = None,
+        input_frcmod_path: Optional[str] = None,
+        input_params_path: Optional[str] = None,
+        input_prep_path: Optional[str] = None,
+        input_source_path: Optional[str] = None,
+        properties: Optional[dict] = None,
+        **kwargs,
+    ):
+        properties = properties or {}
+
+        # Call parent class constructor
+        super().__init__(properties)
+        self.locals_var_dict = locals().copy()
+
+        # Input/Output files
+        self.io_dict = {
+            "in": {
+                "input_pdb_path": input_pdb_path,
+                "input_lib_path": input_lib_path,
+                "input_frcmod_path": input_frcmod_path,
+                "input_params_path": input_params_path,
+                "input_prep_path": input_prep_path,
+                "input_source_path": input_source_path,
+            },
+            "out": {
+                "output_pdb_path": output_pdb_path,
+                "output_top_path": output_top_path,
+                "output_crd_path": output_crd_path,
+            },
+        }
+
+        # Properties specific for BB
+        self.properties = properties
+
+        # Set default forcefields
+        if self.container_path:
+            self.forcefield = _from_string_to_list(
+                properties.get("forcefield", ['leaprc.protein.ff14SB', 'leaprc.DNA.bsc1', 'leaprc.gaff'])
+            )
+        else:
+            amber_home_path = os.getenv("AMBERHOME")
+            protein_ff14SB_path = os.path.join(amber_home_path, 'dat', 'leap', 'cmd', 'leaprc.protein.ff14SB')
+            dna_bsc1_path = os.path.join(amber_home_path, 'dat', 'leap', 'cmd', 'leaprc.DNA.bsc1')
+            gaff_path = os.path.join(amber_home_path, 'dat', 'leap', 'cmd', 'leaprc.gaff')
+
+            self.forcefield = _from_string_to_list(
+                properties.get("forcefield", [protein_ff14SB_path, dna_bsc1_path, gaff_path])
+            )
+
+            # Find the paths of the leaprc files if only the force field names are provided
+            self.forcefield = find_leaprc_paths(self.forcefield)
+
+        self.water_type = properties.get("water_type", "TIP3PBOX")
+        self.box_type = properties.get("box_type", "truncated_octahedron")
+        self.ions_type = properties.get("ions_type", "ionsjc_tip3p")
+        self.distance_to_molecule = properties.get("distance_to_molecule", 8.0)
+        self.closeness = properties.get("closeness", 1.0)
+        self.iso = properties.get("iso", False)
+        self.neutralise = properties.get("neutralise", True)
+        self.ionic_concentration = properties.get("ionic_concentration", 50)
+        self.ions_method = properties.get("ions_method", "water_count")
+        self.positive_ions_number = properties.get("positive_ions_number", 0)
+        self.positive_ions_type = properties.get("positive_ions_type", "Na+")
+        self.negative_ions_number = properties.get("negative_ions_number", 0)
+        self.negative_ions_type = properties.get("negative_ions_type", "Cl-")
+        self.binary_path = properties.get("binary_path", "tleap")
+        self.tleap_session = properties.get("tleap_session", False)
+
+        # Check the properties
+        self.check_properties(properties)
+        self.check_arguments()
+
+    def input_file_list(self, file_ref: str, tmp_folder: Optional[str]) -> List[str]:
+        """Staged path(s) of the *file_ref* optional input, unzipping it in *tmp_folder* if needed."""
+        if self.io_dict["in"][file_ref] is None:
+            return []
+        if self.io_dict["in"][file_ref].endswith(".zip"):
+            return fu.unzip_list(self.stage_io_dict["in"][file_ref], dest_dir=tmp_folder, out_log=self.out_log)
+        return [self.stage_io_dict["in"][file_ref]]
+
+    def ions_commands(self, solvation: Optional[dict]) -> List[str]:
+        """Counterions commands. The ionic concentration needs the number of water molecules added, the box volume
+        or the net charge of the system read from the tLeap log of the *solvation* step."""
+        commands = []
+        if self.neutralise:
+            commands.append("addionsRand mol " + self.negative_ions_type + " 0")
+            commands.append("addionsRand mol " + self.positive_ions_type + " 0")
+
+        negative_ions_number, positive_ions_number = self.negative_ions_number, self.positive_ions_number
+        if self.ionic_concentration and negative_ions_number == 0 and positive_ions_number == 0 and solvation:
+            positive_ions_number, negative_ions_number = salt_ions(self.ions_method, self.ionic_concentration, solvation.get("waters", 0), solvation.get("volume"),
+                                                                   solvation.get("charge"), self.neutralise, self.out_log, self.global_log)
+        if negative_ions_number != 0:
+            commands.append("addionsRand mol " + self.negative_ions_type + " " + str(negative_ions_number))
+        if positive_ions_number != 0:
+            commands.append("addionsRand mol " + self.positive_ions_type + " " + str(positive_ions_number))
+        return commands
+
+    @launchlogger
+    def launch(self):
+        """Launches the execution of the LeapPrepareSystem module."""
+
+        # Setup Biobb
+        if self.check_restart():
+            return 0
+        if self.restore_cache(self.forcefield):
+            return 0
+        self.stage_files()
+        if not self.container_path:
+            # The tleap sessions run outside the sandbox
+            absolute_sandbox_paths(self.stage_io_dict)
+
+        # Water Type
+        # leaprc.water.tip4pew, tip4pd, tip3p, spceb, spce, opc, fb4, fb3
+        source_wat_command = "source leaprc.water.tip3p"
+        if self.water_type == "TIP4PEWBOX":
+            source_wat_command = "source leaprc.water.tip4pew"
+        if self.water_type == "TIP4PBOX":
+            source_wat_command = "source leaprc.water.tip4pd"
+        if re.match(r"SPC", self.water_type):
+            source_wat_command = "source leaprc.water.spce"
+        if re.match(r"OPC", self.water_type):
+            source_wat_command = "source leaprc.water.opc"
+
+        box_command = "solvateBox" if self.box_type == "cubic" else "solvateOct"
+
+        # Creating temporary folder & Leap configuration (instructions) file
+        if self.container_path:
+            instructions_file = str(PurePath(self.stage_io_dict["unique_dir"]).joinpath("leap.in"))
+            instructions_file_path = str(PurePath(self.container_volume_path).joinpath("leap.in"))
+            tmp_folder = None
+        else:
+            tmp_folder = fu.create_unique_dir()
+            instructions_file = str(PurePath(tmp_folder).joinpath("leap.in"))
+            fu.log("Creating %s temporary folder" % tmp_folder, self.out_log)
+            instructions_file_path = instructions_file
+
+        # Forcefields loaded from input forcefield property
+        commands = ["source " + (f"leaprc.{t}" if self.container_path else t) for t in self.forcefield]
+        commands += ["source " + path for path in self.input_file_list("input_source_path", tmp_folder)]
+        commands.append(source_wat_command)
+        if self.ions_type != "None":
+            commands.append("loadamberparams frcmod." + self.ions_type)
+        commands += ["loadamberparams " + path for path in self.input_file_list("input_params_path", tmp_folder)]
+        commands += ["loadamberprep " + path for path in self.input_file_list("input_prep_path", tmp_folder)]
+        commands.append("loadOff atomic_ions.lib")
+        commands += ["loadOff " + path for path in self.input_file_list("input_lib_path", tmp_folder)]
+        commands += ["loadamberparams " + path for path in self.input_file_list("input_frcmod_path", tmp_folder)]
+
+        # Topology, box and water molecules of the same molecule: the box is kept, no need to fix it
+        commands.append("mol = loadpdb " + self.stage_io_dict["in"]["input_pdb_path"])
+        if self.ions_method == "sltcap":
+            commands.append("charge mol")
+        commands.append(box_command + " mol " + self.water_type + " " + str(self.distance_to_molecule) + (" iso " if self.iso else " ") + str(self.closeness))
+
+        save_commands = [
+            "savepdb mol " + self.stage_io_dict["out"]["output_pdb_path"],
+            "saveAmberParm mol " + self.stage_io_dict["out"]["output_top_path"] + " " + self.stage_io_dict["out"]["output_crd_path"],
+        ]
+
+        concentration = self.ionic_concentration and self.negative_ions_number == 0 and self.positive_ions_number == 0
+        if concentration and self.container_path:
+            fu.log("WARNING: ionic_concentration needs the number of water molecules added by tLeap, only available in local executions. Set positive_ions_number and negative_ions_number instead.", self.out_log, self.global_log)
+
+        if not concentration or self.container_path:
+            # One-shot script
+            with open(instructions_file, "w") as leapin:
+                leapin.write("\n".join(commands + self.ions_commands(None) + save_commands + ["quit"]) + "\n")
+
+            if self.container_path and not self.container_working_dir:
+                fu.log('WARNING: container_working_dir property was not set. Defining it with the same value as container_volume_path', self.out_log, self.global_log)
+                self.container_working_dir = self.container_volume_path
+
+            # Command line
+            self.cmd = [self.binary_path, "-f", instructions_file_path]
+
+            # Run Biobb block
+            if self.tleap_session and not self.container_path:
+                self.return_code = run_tleap_session(self.binary_path, instructions_file, [self.stage_io_dict["unique_dir"], str(tmp_folder)], self.out_log, self.timeout)
+            else:
+                self.run_biobb()
+        else:
+            # The same tleap process solvates the system, reports the number of water molecules added and adds the ions
+            job_dirs = [self.stage_io_dict["unique_dir"], str(tmp_folder)]
+            preload, job_commands = split_tleap_script(commands, job_dirs)
+            if self.tleap_session:
+                session = acquire_tleap_session(self.binary_path, preload, self.out_log)
+                session.dirty = loads_job_files(job_commands, job_dirs)
+            else:
+                # Private tleap process closed at the end of the execution
+                session = TleapSession(self.binary_path, preload)
+                session.dirty = True
+            solvate_log = str(PurePath(tmp_folder).joinpath("solvate.log"))
+            try:
+                self.return_code = session.run(job_commands, str(PurePath(tmp_folder).joinpath("leap.%s.done" % uuid.uuid4().hex)), solvate_log,
+                                               self.timeout, self.out_log)
+                if not self.return_code:
+                    solvation = tleap_log_values(solvate_log)
+                    if "waters" not in solvation:
+                        fu.log("WARNING: number of water molecules added not found in the tLeap log, ionic_concentration ignored", self.out_log, self.global_log)
+                    ions_commands = self.ions_commands(solvation if "waters" in solvation else None)
+                    commands += ions_commands
+                    self.return_code = session.run(ions_commands + save_commands + clear_variables_command(job_commands),
+                                                   str(PurePath(tmp_folder).joinpath("leap.%s.done" % uuid.uuid4().hex)), timeout=self.timeout, out_log=self.out_log)
+                output = session.take_output()
+                if output:
+                    fu.log(output, self.out_log)
+            except BaseException:
+                # An interrupted execution (e.g. a timeout) leaves the session in an unknown state
+                session.close()
+                raise
+            release_tleap_session(session, self.return_code)
+
+            # Script finally executed
+            with open(instructions_file, "w") as leapin:
+                leapin.write("\n".join(commands + save_commands + ["quit"]) + "\n")
+
+        # Copy files to host
+        self.copy_to_host()
+
+        # remove temporary folder(s)
+        if tmp_folder:
+            self.tmp_files.append(str(tmp_folder))
+        self.tmp_files.append("leap.log")
+        self.remove_tmp_files()
+
+        # Store the outputs in the result cache
+        self.store_cache()
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+
+def leap_prepare_system(
+    input_pdb_path: str,
+    output_pdb_path: str,
+    output_top_path: str,
+    output_crd_path: str,
+    input_lib_path: Optional[str] = None,
+    input_frcmod_path: Optional[str] = None,
+    input_params_path: Optional[str] = None,
+    input_prep_path: Optional[str] = None,
+    input_source_path: Optional[str] = None,
+    properties: Optional[dict] = None,
+    **kwargs,
+) -> int:
+    """Create the :class:`LeapPrepareSystem <leap.leap_prepare_system.LeapPrepareSystem>` class and
+    execute the :meth:`launch() <leap.leap_prepare_system.LeapPrepareSystem.launch>` method."""
+    return LeapPrepareSystem(**dict(locals())).launch()
+
+
+leap_prepare_system.__doc__ = LeapPrepareSystem.__doc__
+main = LeapPrepareSystem.get_main(leap_prepare_system, "Generates the topology, solvates the system box and adds the counterions of an AMBER MD system in a single tLeap execution.")
+
+if __name__ == "__main__":
+    main()
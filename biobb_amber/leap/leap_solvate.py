@@ -5,16 +5,16 @@
 import os
 import re
 from pathlib import PurePath
-from typing import List, Optional
+from typing import Optional
 
-from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
 
-from biobb_amber.leap.common import _from_string_to_list
+from biobb_amber.leap.common import _from_string_to_list, absolute_sandbox_paths, find_leaprc_paths, run_tleap_session
+from biobb_amber.cache import CachedBiobbObject
 
 
-class LeapSolvate(BiobbObject):
+class LeapSolvate(CachedBiobbObject):
     """
     | biobb_amber LeapSolvate
     | Wrapper of the `AmberTools (AMBER MD Package) leap tool <https://ambermd.org/AmberTools.php>`_ module.
@@ -44,9 +44,13 @@ class LeapSolvate(BiobbObject):
             * **distance_to_molecule** (*float*) - ("8.0") Size for the MD system box -in Angstroms-, defined such as the minimum distance between any atom originally present in solute and the edge of the periodic box is given by this distance parameter.
             * **closeness** (*float*) - ("1.0") How close, in Å, solvent ATOMs may come to solute ATOMs.
             * **binary_path** (*str*) - ("tleap") Path to the tleap executable binary.
+            * **tleap_session** (*bool*) - (False) Run the tleap commands in a pooled tleap process kept alive between executions of the same Python session, loading the force fields only once. The process is killed if an execution takes longer than the timeout property (1 hour if not set). Not available with containers.
+            * **cache_path** (*str*) - (None) Path to the result cache folder. If set, the outputs of a previous execution with the same input file contents, properties, tleap binary and force field files are restored from the cache instead of running tleap.
+            * **cache_size** (*int*) - (1024) [1~1000000|1] Maximum size of the result cache folder in MB. The least recently used results are evicted.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
             * **container_path** (*str*) - (None) Container path definition.
             * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
             * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
@@ -145,7 +149,7 @@ class LeapSolvate(BiobbObject):
             )
 
             # Find the paths of the leaprc files if only the force field names are provided
-            self.forcefield = self.find_leaprc_paths(self.forcefield)
+            self.forcefield = find_leaprc_paths(self.forcefield)
 
         self.water_type = properties.get("water_type", "TIP3PBOX")
         self.box_type = properties.get("box_type", "truncated_octahedron")
@@ -159,68 +163,12 @@ class LeapSolvate(BiobbObject):
         self.distance_to_molecule = properties.get("distance_to_molecule", 8.0)
         self.closeness = properties.get("closeness", 1.0)
         self.binary_path = properties.get("binary_path", "tleap")
+        self.tleap_session = properties.get("tleap_session", False)
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
-    def find_leaprc_paths(self, forcefields: List[str]) -> List[str]:
-        """
-        Find the leaprc paths for the force fields provided.
-
-        For each item in the forcefields list, the function checks if the str is a path to an existing file.
-        If not, it tries to find the file in the $AMBERHOME/dat/leap/cmd/ directory or the $AMBERHOME/dat/leap/cmd/oldff/
-        directory with and without the leaprc prefix.
-
-        Args:
-            forcefields (List[str]): List of force fields to find the leaprc files for.
-
-        Returns:
-            List[str]: List of leaprc file paths.
-        """
-
-        leaprc_paths = []
-
-        for forcefield in forcefields:
-
-            num_paths = len(leaprc_paths)
-
-            # Check if the forcefield is a path to an existing file
-            if os.path.exists(forcefield):
-                leaprc_paths.append(forcefield)
-                continue
-
-            # Check if the forcefield is in the leaprc directory
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', f"leaprc.{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            # Check if the forcefield is in the oldff directory
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', 'oldff', f"leaprc.{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            # Check if the forcefield is in the leaprc directory without the leaprc prefix
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', f"{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            # Check if the forcefield is in the oldff directory without the leaprc prefix
-            leaprc_path = os.path.join(os.environ.get('AMBERHOME', ''), 'dat', 'leap', 'cmd', 'oldff', f"{forcefield}")
-            if os.path.exists(leaprc_path):
-                leaprc_paths.append(leaprc_path)
-                continue
-
-            new_num_paths = len(leaprc_paths)
-
-            if new_num_paths == num_paths:
-                raise ValueError(f"Force field {forcefield} not found. Check the $AMBERHOME/dat/leap/cmd/ directory for available force fields or provide the path to an existing leaprc file.")
-
-        return leaprc_paths
-
     # def check_data_params(self, out_log, err_log):
     #     """ Checks input/output paths correctness """
 
@@ -246,7 +194,12 @@ class LeapSolvate(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+        if self.restore_cache(self.forcefield):
+            return 0
         self.stage_files()
+        if not self.container_path:
+            # The tleap sessions run outside the sandbox
+            absolute_sandbox_paths(self.stage_io_dict)
 
         box_command = "solvateOct"
         if self.box_type == "cubic":
@@ -429,7 +382,10 @@ class LeapSolvate(BiobbObject):
         self.cmd = [self.binary_path, "-f", instructions_file_path]
 
         # Run Biobb block
-        self.run_biobb()
+        if self.tleap_session and not self.container_path:
+            self.return_code = run_tleap_session(self.binary_path, instructions_file, [self.stage_io_dict["unique_dir"], str(tmp_folder)], self.out_log, self.timeout)
+        else:
+            self.run_biobb()
 
         # Copy files to host
         self.copy_to_host()
@@ -452,6 +408,9 @@ class LeapSolvate(BiobbObject):
         self.tmp_files.extend([str(tmp_folder), "leap.log"])
         self.remove_tmp_files()
 
+        # Store the outputs in the result cache
+        self.store_cache()
+
         self.check_arguments(output_files_created=True, raise_exception=False)
 
         return self.return_code
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+
+"""Module containing the streaming reader and writer of the %FLAG sections of the AMBER topology (prmtop) files."""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import uuid
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Union
+
+import numpy as np
+from biobb_common.tools import file_utils as fu
+
+from biobb_amber.staging import copy_bytes
+
+_FORTRAN_FORMAT = re.compile(r"\(\s*(\d+)\s*([aAiIeEfF])\s*(\d+)(?:\.(\d+))?\s*\)")
+
+# Names of the values of the POINTERS section, in order
+POINTERS = (
+    "NATOM", "NTYPES", "NBONH", "MBONA", "NTHETH", "MTHETA", "NPHIH", "MPHIA", "NHPARM", "NPARM",
+    "NNB", "NRES", "NBONA", "NTHETA", "NPHIA", "NUMBND", "NUMANG", "NPTRA", "NATYP", "NPHB",
+    "IFPERT", "NBPER", "NGPER", "NDPER", "MBPER", "MGPER", "MDPER", "IFBOX", "NMXRS", "IFCAP",
+    "NUMEXTRA", "NCOPY",
+)
+
+# Residue names of the water models of AmberTools and other MD packages
+WATER_RESIDUES = ("WAT", "HOH", "TP3", "TIP3", "TP4", "TIP4", "TP5", "TIP5", "T4E", "SPC", "OPC", "PL3", "FB3", "FB4", "SOL")
+
+# Titratable residue names of the constant pH (AS4, GL4, HIP) and constant redox potential (HEH) topologies
+CPH_RESIDUES = ("AS4", "GL4", "HIP", "AS2", "GL2", "HEH")
+
+# IFBOX flag of the POINTERS section
+BOX_TYPES = {0: None, 1: "cubic", 2: "truncated_octahedron", 3: "triclinic"}
+
+Value = Union[str, int, float]
+
+
+class PrmtopFormat(NamedTuple):
+    """Fortran format of a prmtop section, e.g. %FORMAT(10I8): 10 values per line, integers, 8 columns each."""
+    per_line: int
+    kind: str
+    width: int
+    decimals: int
+
+    @classmethod
+    def parse(cls, format_line: str) -> "PrmtopFormat":
+        """Builds the format from a %FORMAT(...) line."""
+        match = _FORTRAN_FORMAT.search(format_line)
+        if not match:
+            raise ValueError("Unknown prmtop format: %s" % format_line.strip())
+        per_line, kind, width, decimals = match.groups()
+        return cls(int(per_line), kind.upper(), int(width), int(decimals or 0))
+
+    def parse_line(self, line: str) -> List[Value]:
+        """Splits a data line in its fixed width columns and converts them."""
+        line = line.rstrip("\r\n")
+        if self.kind == "A":
+            line = line.rstrip()
+        columns = [line[i:i + self.width] for i in range(0, len(line), self.width)]
+        if self.kind == "A":
+            return [column.strip() for column in columns]
+        if self.kind == "I":
+            return [int(column) for column in columns if column.strip()]
+        return [float(column) for column in columns if column.strip()]
+
+    def format_value(self, value: Value) -> str:
+        """Formats a value in its fixed width column."""
+        if self.kind == "A":
+            return str(value)[:self.width].ljust(self.width)
+        if self.kind == "I":
+            return "%*d" % (self.width, int(value))
+        return ("%*.*" + self.kind) % (self.width, self.decimals, float(value))
+
+    def format_values(self, values: List[Value], padded: bool = False) -> str:
+        """Formats the data lines of a section. Empty sections have a single empty line.
+        Text lines are *padded* with blanks to the full line width if set (e.g. the TITLE written by tleap)."""
+        if not values:
+            return "\n"
+        if self.kind == "A":
+            lines = []
+            for i in range(0, len(values), self.per_line):
+                line = "".join(self.format_value(value) for value in values[i:i + self.per_line])
+                lines.append(line.ljust(self.per_line * self.width) if padded else line)
+            return "\n".join(lines) + "\n"
+        # Numeric sections are formatted with a single % operation over all the values
+        field = "%%%dd" % self.width if self.kind == "I" else "%%%d.%d%s" % (self.width, self.decimals, self.kind)
+        full, rest = divmod(len(values), self.per_line)
+        template = (field * self.per_line + "\n") * full + (field * rest + "\n" if rest else "")
+        return template % tuple(values)
+
+
+class PrmtopSection(NamedTuple):
+    """A %FLAG section of a prmtop file: its format and the byte offsets of its data lines."""
+    flag: str
+    format: PrmtopFormat
+    start: int
+    end: int
+
+
+class Prmtop:
+    """
+    Index of the %FLAG sections of an AMBER topology (prmtop) file.
+
+    Only the header lines are scanned when the file is opened: the values of a section are read and parsed on demand,
+    so metadata like the number of atoms, the residue labels or the box is available without parsing the whole file.
+    Sections are rewritten in place when their size does not change, or with a single streamed copy of the file otherwise.
+
+    Args:
+        path (str): Path to the prmtop file.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]) -> None:
+        self.path = str(path)
+        self.sections: Dict[str, PrmtopSection] = {}
+        self.index()
+
+    def index(self) -> None:
+        """Scans the %FLAG and %FORMAT lines storing the byte offsets of the data of each section."""
+        sections = {}
+        flag, section_format, start, offset = None, None, 0, 0
+        with open(self.path, "rb") as prmtop:
+            for line in prmtop:
+                if line.startswith(b"%FLAG"):
+                    if flag and section_format:
+                        sections[flag] = PrmtopSection(flag, section_format, start, offset)
+                    flag, section_format = line[5:].strip().decode(), None
+                elif line.startswith(b"%FORMAT") and flag:
+                    section_format = PrmtopFormat.parse(line.decode())
+                    start = offset + len(line)
+                offset += len(line)
+        if flag and section_format:
+            sections[flag] = PrmtopSection(flag, section_format, start, offset)
+        self.sections = sections
+
+    def __contains__(self, flag: str) -> bool:
+        return flag in self.sections
+
+    def read(self, flag: str) -> List[Value]:
+        """Reads and parses the values of the *flag* section."""
+        section = self.sections[flag]
+        with open(self.path, "rb") as prmtop:
+            prmtop.seek(section.start)
+            data = prmtop.read(section.end - section.start).decode()
+        values: List[Value] = []
+        for line in data.splitlines():
+            if not line.startswith("%"):
+                values.extend(section.format.parse_line(line))
+        return values
+
+    def pointer(self, name: str) -> int:
+        """Value of the *name* entry of the POINTERS section (NATOM, NRES, IFBOX...)."""
+        return int(self.read("POINTERS")[POINTERS.index(name)])
+
+    @property
+    def natom(self) -> int:
+        """Number of atoms."""
+        return self.pointer("NATOM")
+
+    @property
+    def nres(self) -> int:
+        """Number of residues."""
+        return self.pointer("NRES")
+
+    @property
+    def residue_labels(self) -> List[str]:
+        """Names of the residues."""
+        return [str(label) for label in self.read("RESIDUE_LABEL")]
+
+    @property
+    def box_dimensions(self) -> Optional[List[float]]:
+        """Box angle (beta) and lengths (a, b, c) or None for non periodic systems."""
+        if "BOX_DIMENSIONS" not in self:
+            return None
+        return [float(value) for value in self.read("BOX_DIMENSIONS")]
+
+    def write(self, values: Dict[str, List[Value]], output_path: Optional[str] = None) -> None:
+        """Replaces the values of the sections in the *values* dictionary, writing the result to *output_path*
+        (the same file by default)."""
+        if write_sections(self.path, self.sections, values, output_path):
+            self.index()
+
+
+def _is_padded(path: str, section: PrmtopSection) -> bool:
+    """True if the last data line of the *section* text section is padded with blanks to the full line width."""
+    if section.format.kind != "A":
+        return False
+    width = section.format.per_line * section.format.width
+    with open(path, "rb") as prmtop:
+        start = max(section.start, section.end - width - 2)
+        prmtop.seek(start)
+        lines = prmtop.read(section.end - start).splitlines()
+    return bool(lines) and len(lines[-1]) == width and lines[-1].endswith(b" ")
+
+
+def write_sections(path: str, sections: Dict[str, PrmtopSection], values: Dict[str, List[Value]], output_path: Optional[str] = None) -> bool:
+    """Replaces the values of the *sections* of the *path* prmtop file in the *values* dictionary, writing the result
+    to *output_path* (the same file by default). Returns True if the file was modified in place."""
+    data = {flag: sections[flag].format.format_values(section_values, _is_padded(path, sections[flag])).encode() for flag, section_values in values.items()}
+    changed = sorted((sections[flag] for flag in data), key=lambda section: section.start)
+    output_path = str(output_path or path)
+    in_place = os.path.exists(output_path) and os.path.samefile(output_path, path)
+
+    if in_place and all(len(data[section.flag]) == section.end - section.start for section in changed):
+        # Same size: overwrite the bytes of the changed sections only
+        with open(path, "r+b") as prmtop:
+            for section in changed:
+                prmtop.seek(section.start)
+                prmtop.write(data[section.flag])
+    else:
+        # Single streamed copy replacing the changed sections on the fly
+        tmp_path = "%s.%s.tmp" % (output_path, uuid.uuid4().hex)
+        with open(path, "rb") as source, open(tmp_path, "wb") as target:
+            position = 0
+            for section in changed:
+                copy_bytes(source, target, section.start - position)
+                target.write(data[section.flag])
+                source.seek(section.end)
+                position = section.end
+            shutil.copyfileobj(source, target)
+        os.replace(tmp_path, output_path)
+    return in_place
+
+
+def crd_atom_count(crd_path: Union[str, os.PathLike]) -> Optional[int]:
+    """Number of atoms of an ASCII AMBER coordinates/restart file (second line), None for binary or unreadable files."""
+    try:
+        with open(crd_path) as crd:
+            crd.readline()
+            return int(crd.readline().split()[0])
+    except (OSError, UnicodeDecodeError, ValueError, IndexError):
+        return None
+
+
+class PrmtopIndex(Prmtop):
+    """
+    Prmtop whose sections are decoded into NumPy arrays.
+
+    The file is memory mapped to record the byte offsets of its %FLAG sections, and only the sections requested are
+    decoded. If *cache_path* is set, the offsets are stored in a file of that folder and reused while the modification
+    time and size of the topology do not change.
+
+    Args:
+        path (str): Path to the prmtop file.
+        cache_path (str): Folder of the stored section offsets, not stored if None.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], cache_path: Optional[str] = None) -> None:
+        self.cache_path = cache_path
+        self._arrays: Dict[str, np.ndarray] = {}
+        super().__init__(path)
+
+    def index(self) -> None:
+        """Loads the stored section offsets, or finds the %FLAG lines of the memory mapped file."""
+        stat = os.stat(self.path)
+        self.mtime_ns, self.size = stat.st_mtime_ns, stat.st_size
+        self._arrays = {}
+        self.sections = self.load_index()
+        if not self.sections:
+            self.sections = self.scan()
+            self.save_index()
+
+    def scan(self) -> Dict[str, PrmtopSection]:
+        """Finds the %FLAG lines of the memory mapped file."""
+        sections: Dict[str, PrmtopSection] = {}
+        if not self.size:
+            return sections
+        with open(self.path, "rb") as prmtop, mmap.mmap(prmtop.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            starts = []
+            position = data.find(b"%FLAG")
+            while position != -1:
+                if position == 0 or data[position - 1:position] == b"\n":
+                    starts.append(position)
+                position = data.find(b"%FLAG", position + 5)
+            for i, start in enumerate(starts):
+                end = starts[i + 1] if i + 1 < len(starts) else len(data)
+                line_end = data.find(b"\n", start, end)
+                flag = data[start + 5:line_end].strip().decode()
+                # Skip %COMMENT lines until the %FORMAT one
+                while line_end != -1 and not data[line_end + 1:line_end + 8] == b"%FORMAT":
+                    line_end = data.find(b"\n", line_end + 1, end)
+                if line_end == -1:
+                    continue
+                format_end = data.find(b"\n", line_end + 1, end)
+                format_end = end if format_end == -1 else format_end + 1
+                section_format = PrmtopFormat.parse(data[line_end + 1:format_end].decode())
+                sections[flag] = PrmtopSection(flag, section_format, format_end, end)
+        return sections
+
+    def index_path(self) -> Optional[str]:
+        """Path of the file storing the section offsets in the cache folder, None if not cached."""
+        if not self.cache_path:
+            return None
+        return str(Path(self.cache_path).joinpath("%s.json" % hashlib.sha256(os.path.realpath(self.path).encode()).hexdigest()))
+
+    def load_index(self) -> Dict[str, PrmtopSection]:
+        """Stored sections, empty if not cached or stored for another version of the topology."""
+        index_path = self.index_path()
+        if not index_path:
+            return {}
+        try:
+            with open(index_path) as index_file:
+                index = json.load(index_file)
+            if index["mtime_ns"] != self.mtime_ns or index["size"] != self.size:
+                return {}
+            return {flag: PrmtopSection(flag, PrmtopFormat(*values[:4]), values[4], values[5]) for flag, values in index["sections"].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            return {}
+
+    def save_index(self) -> None:
+        """Stores the sections in the cache folder, silently skipped if it can not be written."""
+        index_path = self.index_path()
+        if not index_path:
+            return
+        index = {
+            "mtime_ns": self.mtime_ns,
+            "size": self.size,
+            "sections": {flag: list(section.format) + [section.start, section.end] for flag, section in self.sections.items()},
+        }
+        try:
+            Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(index_path, "w") as index_file:
+                json.dump(index, index_file)
+        except OSError:
+            pass
+
+    def section(self, flag: str) -> np.ndarray:
+        """Values of the *flag* section: int64, float64 or str array depending on its format."""
+        if flag not in self._arrays:
+            section = self.sections[flag]
+            with open(self.path, "rb") as prmtop, mmap.mmap(prmtop.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                raw = data[section.start:section.end]
+            self._arrays[flag] = self.decode(raw, section.format)
+        return self._arrays[flag]
+
+    @staticmethod
+    def decode(raw: bytes, section_format: PrmtopFormat) -> np.ndarray:
+        """Splits the fixed width columns of the data lines of a section and converts them."""
+        width = section_format.width
+        line_width = section_format.per_line * width
+        if section_format.kind != "A" and b"%" not in raw and b"\r" not in raw:
+            # Fast path: full lines but the last one, no padding, so the columns are contiguous once the newlines are removed
+            data = np.frombuffer(raw, dtype=np.uint8)
+            ends = np.flatnonzero(data == ord("\n"))
+            lengths = np.diff(np.concatenate(([-1], ends))) - 1
+            if len(ends) and ends[-1] == len(raw) - 1 and (lengths[:-1] == line_width).all() and 0 < lengths[-1] <= line_width and lengths[-1] % width == 0:
+                values = np.frombuffer(raw.replace(b"\n", b""), dtype="S%d" % width)
+                return values.astype(np.int64) if section_format.kind == "I" else values.astype(np.float64)
+        columns = []
+        for line in raw.split(b"\n"):
+            line = line.rstrip(b"\r")[:line_width]
+            if section_format.kind == "A":
+                line = line.rstrip()
+            if not line.strip() or line.startswith(b"%"):
+                continue
+            columns.append(line.ljust(-(-len(line) // width) * width))
+        values = np.frombuffer(b"".join(columns), dtype="S%d" % width)
+        if section_format.kind == "A":
+            return np.char.strip(values.astype(str))
+        if section_format.kind == "I":
+            return values.astype(np.int64)
+        return values.astype(np.float64)
+
+    def pointer(self, name: str) -> int:
+        """Value of the *name* entry of the POINTERS section (NATOM, NRES, IFBOX...)."""
+        return int(self.section("POINTERS")[POINTERS.index(name)])
+
+    @property
+    def residue_names(self) -> set:
+        """Different residue names of the topology."""
+        return set(self.section("RESIDUE_LABEL").tolist())
+
+    @property
+    def n_waters(self) -> int:
+        """Number of water molecules."""
+        return int(np.isin(self.section("RESIDUE_LABEL"), WATER_RESIDUES).sum())
+
+    @property
+    def box_type(self) -> Optional[str]:
+        """Periodic box type (cubic, truncated_octahedron or triclinic), None for non periodic systems."""
+        return BOX_TYPES.get(self.pointer("IFBOX"), "triclinic")
+
+    @property
+    def is_cph(self) -> bool:
+        """Whether the topology has the titratable residues of the constant pH or redox potential simulations."""
+        return bool(self.residue_names.intersection(CPH_RESIDUES))
+
+
+def check_coordinates(top_path: str, crd_path: Optional[str], out_log=None, global_log=None, cache_path: Optional[str] = None) -> Optional[PrmtopIndex]:
+    """Warns when the number of atoms of the *crd_path* coordinates does not match the *top_path* topology.
+    Returns the index of the topology (its section offsets stored in *cache_path* if set), or None if it could not be read."""
+    try:
+        index = PrmtopIndex(top_path, cache_path)
+        natom = index.natom
+    except (OSError, KeyError, ValueError):
+        return None
+    crd_natom = crd_atom_count(crd_path) if crd_path else None
+    if crd_natom is not None and crd_natom != natom:
+        fu.log("WARNING: %s has %d atoms but the %s topology has %d atoms" % (crd_path, crd_natom, top_path, natom), out_log, global_log)
+    return index
@@ -1,6 +1,9 @@
 """ Common functions for package biobb_amber.parmed """
 from pathlib import Path, PurePath
+from typing import Optional
+import numpy as np
 from biobb_common.tools import file_utils as fu
+from biobb_amber.leap.prmtop import WATER_RESIDUES, PrmtopIndex
 
 
 # CHECK INPUT PARAMETERS
@@ -41,3 +44,55 @@ def is_valid_file(ext, argument):
         'output_cpin_path': ['cpin']
     }
     return ext in formats[argument]
+
+
+# HYDROGEN MASS REPARTITION
+def hmass_repartition(input_top_path, output_top_path, hydrogen_mass: float = 3.024, exclude_water: bool = True, cache_path: Optional[str] = None) -> int:
+    """
+    Hydrogen mass repartition of an AMBER topology, like the hmassrepartition action of parmed.
+
+    The mass of each hydrogen atom is set to *hydrogen_mass* and the difference is removed from the heavy atom it is
+    bonded to. For hydrogens bonded to several heavy atoms it is the one with the lowest index, as parmed takes the
+    first of the bond partners sorted by index, not the first in the BONDS_INC_HYDROGEN order. Only the MASS, ATOMIC_NUMBER and BONDS_INC_HYDROGEN
+    sections (and RESIDUE_LABEL and RESIDUE_POINTER to find the water molecules) are decoded, and the MASS section is
+    replaced while the rest of the file is copied unchanged.
+
+    Parameters:
+        input_top_path (str): Path to the input prmtop file.
+        output_top_path (str): Path to the output prmtop file.
+        hydrogen_mass (float): Mass of the hydrogen atoms after the repartition.
+        exclude_water (bool): Leave the masses of the water molecules unchanged.
+        cache_path (str): Folder of the stored section offsets of the input topology, see PrmtopIndex.
+
+    Returns:
+        int: Number of hydrogen atoms repartitioned.
+    """
+    index = PrmtopIndex(input_top_path, cache_path)
+    for flag in ("MASS", "ATOMIC_NUMBER", "BONDS_INC_HYDROGEN"):
+        if flag not in index:
+            raise ValueError("%s has no %s section, set native to False to repartition the masses with parmed" % (input_top_path, flag))
+    mass = index.section("MASS").copy()
+    atomic_number = index.section("ATOMIC_NUMBER")
+    # Bonds are stored as (3 * first atom, 3 * second atom, bond type) triplets
+    bonds = index.section("BONDS_INC_HYDROGEN").reshape(-1, 3)[:, :2] // 3
+
+    # (hydrogen, heavy atom) pairs, ordered by hydrogen and keeping the lowest index heavy atom bonded to each hydrogen
+    hydrogen = atomic_number[bonds] == 1
+    pairs = np.concatenate((bonds[hydrogen[:, 0] & ~hydrogen[:, 1]], bonds[hydrogen[:, 1] & ~hydrogen[:, 0]][:, ::-1]))
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    pairs = pairs[np.unique(pairs[:, 0], return_index=True)[1]]
+    if exclude_water and len(pairs):
+        first_atoms = index.section("RESIDUE_POINTER") - 1
+        water = np.isin(index.section("RESIDUE_LABEL"), WATER_RESIDUES)
+        pairs = pairs[~water[np.searchsorted(first_atoms, pairs[:, 0], side="right") - 1]]
+
+    # Sequential subtraction, in the order of the hydrogens, for heavy atoms bonded to several of them
+    transfer = hydrogen_mass - mass[pairs[:, 0]]
+    mass[pairs[:, 0]] = hydrogen_mass
+    np.subtract.at(mass, pairs[:, 1], transfer)
+    negative = np.flatnonzero((mass <= 0) & (atomic_number > 0))
+    if len(negative):
+        raise ValueError("Too much mass removed from atom %d, the hydrogen mass must be smaller" % (negative[0] + 1))
+
+    index.write({"MASS": mass.tolist()}, output_top_path)
+    return len(pairs)
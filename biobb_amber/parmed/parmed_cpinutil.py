@@ -3,13 +3,14 @@
 """Module containing the ParmedCpinUtil class and the command line interface."""
 
 from typing import Optional
-from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
 from biobb_amber.parmed.common import check_input_path, check_output_path
+from biobb_amber.leap.prmtop import check_coordinates
+from biobb_amber.staging import StagingBiobbObject
 
 
-class ParmedCpinUtil(BiobbObject):
+class ParmedCpinUtil(StagingBiobbObject):
     """
     | biobb_amber ParmedCpinUtil
     | Wrapper of the `AmberTools (AMBER MD Package) parmed tool <https://ambermd.org/AmberTools.php>`_ module.
@@ -24,9 +25,11 @@ class ParmedCpinUtil(BiobbObject):
             * **igb** (*int*) - (2) Generalized Born model which you intend to use to evaluate dynamics or protonation state swaps. Values: 1, 2, 5, 7, 8.
             * **system** (*str*) - ("Unknown") Name of system to titrate.
             * **binary_path** (*str*) - ("cpinutil.py") Path to the cpinutil.py executable binary.
+            * **prmtop_cache_path** (*str*) - (None) Folder where the %FLAG section offsets of input_top_path are stored and reused while the topology does not change, so the next blocks reading it do not scan it again.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
             * **container_path** (*str*) - (None) Container path definition.
             * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
             * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
@@ -81,6 +84,7 @@ class ParmedCpinUtil(BiobbObject):
         self.igb = properties.get('igb', 2)
         self.system = properties.get('system', "Unknown")
         self.binary_path = properties.get('binary_path', 'cpinutil.py')
+        self.prmtop_cache_path = properties.get('prmtop_cache_path', None)
 
         # Check the properties
         self.check_properties(properties)
@@ -106,6 +110,13 @@ class ParmedCpinUtil(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+
+        # Titratable residues requested, checked in the lazy prmtop index before running cpinutil.py
+        if self.resnames:
+            prmtop = check_coordinates(self.io_dict['in']['input_top_path'], None, cache_path=self.prmtop_cache_path)
+            missing = sorted(set(str(self.resnames).split()) - prmtop.residue_names) if prmtop else []
+            if missing:
+                fu.log('WARNING: residues %s not found in %s' % (', '.join(missing), self.io_dict['in']['input_top_path']), self.out_log, self.global_log)
         self.stage_files()
 
         # Creating temporary folder
@@ -3,13 +3,13 @@
 """Module containing the ParmedHMassRepartition class and the command line interface."""
 from typing import Optional
 from pathlib import PurePath
-from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
-from biobb_amber.parmed.common import check_input_path, check_output_path
+from biobb_amber.parmed.common import check_input_path, check_output_path, hmass_repartition
+from biobb_amber.cache import CachedBiobbObject
 
 
-class ParmedHMassRepartition(BiobbObject):
+class ParmedHMassRepartition(CachedBiobbObject):
     """
     | biobb_amber ParmedHMassRepartition
     | Wrapper of the `AmberTools (AMBER MD Package) parmed tool <https://ambermd.org/AmberTools.php>`_ module.
@@ -19,10 +19,17 @@ class ParmedHMassRepartition(BiobbObject):
         input_top_path (str): Input AMBER topology file. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/parmed/input.hmass.prmtop>`_. Accepted formats: top (edam:format_3881), parmtop (edam:format_3881), prmtop (edam:format_3881).
         output_top_path (str): Output topology file (AMBER ParmTop). File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/parmed/output.hmass.prmtop>`_. Accepted formats: top (edam:format_3881), parmtop (edam:format_3881), prmtop (edam:format_3881).
         properties (dic - Python dictionary object containing the tool parameters, not input/output files):
+            * **hydrogen_mass** (*float*) - (3.024) [0.5~10|0.001] Mass (in Da) of the hydrogen atoms after the repartition. The mass added to each hydrogen atom is removed from the heavy atom it is bonded to.
+            * **exclude_water** (*bool*) - (True) Leave the masses of the water molecules unchanged (dowater option of parmed when False).
+            * **native** (*bool*) - (True) Repartition the masses with the built-in engine, reading only the MASS, ATOMIC_NUMBER, BONDS_INC_HYDROGEN and residue sections of the topology and copying the rest of the file unchanged, instead of running parmed. Binary and container properties are ignored when enabled.
             * **binary_path** (*str*) - ("parmed") Path to the parmed executable binary.
+            * **cache_path** (*str*) - (None) Path to the result cache folder. If set, the outputs of a previous execution with the same input file contents, properties and parmed binary are restored from the cache instead of running parmed.
+            * **cache_size** (*int*) - (1024) [1~1000000|1] Maximum size of the result cache folder in MB. The least recently used results are evicted.
+            * **prmtop_cache_path** (*str*) - (None) Folder where the %FLAG section offsets of input_top_path are stored and reused while the topology does not change, so the next blocks reading it do not scan it again.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
             * **container_path** (*str*) - (None) Container path definition.
             * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
             * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
@@ -64,7 +71,11 @@ class ParmedHMassRepartition(BiobbObject):
 
         # Properties specific for BB
         self.properties = properties
+        self.hydrogen_mass = properties.get('hydrogen_mass', 3.024)
+        self.exclude_water = properties.get('exclude_water', True)
+        self.native = properties.get('native', True)
         self.binary_path = properties.get('binary_path', 'parmed')
+        self.prmtop_cache_path = properties.get('prmtop_cache_path', None)
 
         # Check the properties
         self.check_properties(properties)
@@ -89,6 +100,19 @@ class ParmedHMassRepartition(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+        if self.restore_cache():
+            return 0
+
+        if self.native:
+            # Only the MASS section is rewritten, in a single streamed copy of the topology: no sandbox needed
+            fu.log('Repartitioning the hydrogen masses of %s with the native prmtop engine' % self.io_dict['in']['input_top_path'], self.out_log)
+            repartitioned = hmass_repartition(self.io_dict['in']['input_top_path'], self.io_dict['out']['output_top_path'],
+                                              float(self.hydrogen_mass), self.exclude_water, self.prmtop_cache_path)
+            fu.log('Mass of %d hydrogen atoms set to %s' % (repartitioned, self.hydrogen_mass), self.out_log)
+            self.store_cache()
+            self.check_arguments(output_files_created=True, raise_exception=False)
+            return self.return_code
+
         self.stage_files()
 
         # Creating temporary folder & Parmed configuration (instructions) file
@@ -103,7 +127,7 @@ class ParmedHMassRepartition(BiobbObject):
             instructions_file_path = instructions_file
 
         with open(instructions_file, 'w') as parmedin:
-            parmedin.write("hmassrepartition\n")
+            parmedin.write("hmassrepartition %s%s\n" % (self.hydrogen_mass, "" if self.exclude_water else " dowater"))
             parmedin.write("outparm " + self.stage_io_dict['out']['output_top_path'] + "\n")
 
         self.cmd = [self.binary_path,
@@ -122,6 +146,9 @@ class ParmedHMassRepartition(BiobbObject):
         self.tmp_files.extend([str(tmp_folder)])
         self.remove_tmp_files()
 
+        # Store the outputs in the result cache
+        self.store_cache()
+
         self.check_arguments(output_files_created=True, raise_exception=False)
 
         return self.return_code
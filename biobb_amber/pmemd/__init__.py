@@ -1,3 +1,4 @@
 from . import pmemd_mdrun
+from . import pmemd_mdrun_ensemble
 name = "pmemd"
-__all__ = ["pmemd_mdrun"]
+__all__ = ["pmemd_mdrun", "pmemd_mdrun_ensemble"]
@@ -1,6 +1,14 @@
 """ Common functions for package biobb_amber.pmemd """
+import copy
+import hashlib
+import re
+import shutil
+import struct
+from collections import OrderedDict
 from pathlib import Path, PurePath
+from typing import Optional, Union
 from biobb_common.tools import file_utils as fu
+from biobb_amber.staging import copy_bytes
 
 
 # CHECK INPUT PARAMETERS
@@ -46,6 +54,485 @@ def is_valid_file(ext, argument):
         'output_rst_path': ['rst', 'rst7', 'netcdf', 'nc', 'ncrst'],
         'output_cpout_path': ['cpout'],
         'output_cprst_path': ['cprst', 'rst', 'rst7'],
-        'output_mdinfo_path': ['mdinfo']
+        'output_mdinfo_path': ['mdinfo'],
+        'output_zip_path': ['zip']
     }
     return ext in formats[argument]
+
+
+# Tokens of a Fortran namelist body: quoted strings, comments, terminators, separators and bare words
+_NAMELIST_TOKEN = re.compile(r"""'(?:[^'\n]|'')*'|"(?:[^"\n]|"")*"|!.*|&end\b|[=,/\n]|[^\s,'"=!/]+""", re.IGNORECASE)
+_NAMELIST_START = re.compile(r'[ \t]*&(\w+)')
+_NAMELIST_KEY = re.compile(r'^[A-Za-z_]\w*(?:\(\s*\d+(?:\s*,\s*\d+)*\s*\))?$')
+_FORTRAN_LITERAL = re.compile(r"""\s*(?:[+-]?(?:\d+\.?\d*|\.\d+)(?:[eEdD][+-]?\d+)?|\d+\*\S+|\.(?:true|false)\.|'(?:[^']|'')*'|"(?:[^"]|"")*")\s*$""", re.IGNORECASE)
+_VALUE_ITEM = re.compile(r"""(?:'(?:[^']|'')*'|"(?:[^"]|"")*"|[^,'"])+""")
+
+# mdin options of each simulation_type, the md options are shared by nvt, npt, free and heat
+SIMULATION_TYPE_OPTIONS = {
+    'minimization': [('imin', '1')],
+    'min_vacuo': [('imin', '1'), ('ncyc', '250'), ('ntb', '0'), ('igb', '0'), ('cut', '12')],
+    'md': [('imin', '0'), ('cut', '10.0'), ('ntr', '0'), ('ntc', '2'), ('ntf', '2'), ('ntt', '3'), ('ig', '-1'),
+           ('ioutfm', '1'), ('iwrap', '1'), ('nstlim', '5000'), ('dt', '0.002')],
+    'npt': [('irest', '1'), ('gamma_ln', '5.0'), ('pres0', '1.0'), ('ntp', '1'), ('taup', '2.0'), ('ntx', '5')],
+    'nvt': [('irest', '1'), ('gamma_ln', '5.0'), ('ntb', '1'), ('ntx', '5')],
+    'heat': [('tempi', '0.0'), ('temp0', '300.0'), ('irest', '0'), ('ntb', '1'), ('gamma_ln', '1.0')],
+    'free': []
+}
+MD_SIMULATION_TYPES = ('nvt', 'npt', 'free', 'heat')
+
+# Parsed mdin templates keyed by the SHA-256 of the file
+_MDIN_CACHE: "OrderedDict[str, Mdin]" = OrderedDict()
+_MDIN_CACHE_SIZE = 64
+
+
+def format_value(value) -> str:
+    """ Returns a value as a Fortran namelist value: numbers, logicals and quoted strings (or lists of them) are kept, anything else is quoted """
+    value = str(value).strip()
+    if value and all(_FORTRAN_LITERAL.match(item) for item in _VALUE_ITEM.findall(value)):
+        return value
+    return "'%s'" % value if '"' in value else '"%s"' % value
+
+
+class Namelist:
+    """
+    Fortran namelist group of an AMBER mdin file (e.g. &cntrl, &ewald, &wt, &rst).
+
+    Options are kept in file order in a dictionary keyed by the lower case option name, so looking up or
+    overriding an option is O(1) and keeps its position.
+
+    Parameters:
+        name (str): Name of the namelist group, without the &.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name.lower()
+        self.options: dict[str, list] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key.strip().lower() in self.options
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """ Value of an option """
+        option = self.options.get(key.strip().lower())
+        return option[1] if option else default
+
+    def set(self, key: str, value, comment: Optional[str] = None) -> None:
+        """ Sets the value (and comment) of an option, validating its name and quoting string values """
+        key = key.strip()
+        if not _NAMELIST_KEY.match(key):
+            raise ValueError('%s is not a valid &%s option name' % (key, self.name))
+        self.options[key.lower()] = [key, format_value(value), comment]
+
+    def parse(self, text: str, pos: int) -> int:
+        """ Reads the options from pos until the / or &end terminator, returns the position of the line following it """
+        key = None
+        pending = None
+        line_keys: list[str] = []
+
+        def flush():
+            if pending is not None and key is not None:
+                option = self.options[key]
+                option[1] = pending if option[1] is None else option[1] + ', ' + pending
+
+        for token in _NAMELIST_TOKEN.finditer(text, pos):
+            value = token.group()
+            if value == '=':
+                if pending is not None:
+                    key = pending.lower()
+                    self.options[key] = [pending, None, None]
+                    line_keys.append(key)
+                pending = None
+                continue
+            if value in (',', '\n', '/') or value.startswith('!') or value.lower() == '&end':
+                flush()
+                pending = None
+            else:
+                flush()
+                pending = value
+                continue
+            if value == '\n':
+                line_keys = []
+            elif value.startswith('!'):
+                for line_key in line_keys:
+                    self.options[line_key][2] = value[1:].strip()
+            elif value == '/' or value.lower() == '&end':
+                end = text.find('\n', token.end())
+                break
+        else:
+            end = -1
+        for option in self.options.values():
+            option[1] = '' if option[1] is None else option[1]
+        return len(text) if end < 0 else end + 1
+
+    def lines(self) -> list[str]:
+        """ Lines of the namelist group in mdin format """
+        lines = ['&' + self.name]
+        for key, value, comment in self.options.values():
+            lines.append('  %s = %s' % (key, value) + (' ! ' + comment if comment else ''))
+        lines.append('/')
+        return lines
+
+
+class Mdin:
+    """
+    AMBER mdin file: title and free-format lines (e.g. restraint groups or DISANG redirections) kept verbatim,
+    and Fortran namelist groups parsed into Namelist objects.
+
+    Parameters:
+        blocks (list): Lines (str) and Namelist groups in file order.
+    """
+
+    def __init__(self, blocks: Optional[list] = None) -> None:
+        self.blocks: list = blocks or []
+
+    @classmethod
+    def parse(cls, text: str) -> "Mdin":
+        """ Parses the text of a mdin file """
+        blocks: list = []
+        pos = 0
+        while pos < len(text):
+            start = _NAMELIST_START.match(text, pos)
+            if start and start.group(1).lower() != 'end':
+                namelist = Namelist(start.group(1))
+                pos = namelist.parse(text, start.end())
+                blocks.append(namelist)
+                continue
+            end = text.find('\n', pos)
+            end = len(text) if end < 0 else end
+            blocks.append(text[pos:end].rstrip())
+            pos = end + 1
+        return cls(blocks)
+
+    def namelists(self) -> list[Namelist]:
+        """ Namelist groups in file order """
+        return [block for block in self.blocks if isinstance(block, Namelist)]
+
+    def group(self, name: str) -> Namelist:
+        """ First namelist group with the given name. If missing, it is added after &cntrl and the groups following it,
+        before any &wt group, so the free-format lines read after the &wt type='END' group (e.g. DISANG= or LISTOUT=) stay last """
+        for namelist in self.namelists():
+            if namelist.name == name.lower():
+                return namelist
+        namelist = Namelist(name)
+        self.blocks.insert(self.insert_position(), namelist)
+        return namelist
+
+    def insert_position(self) -> int:
+        """ Position of a new namelist group in blocks """
+        position = next((i + 1 for i, block in enumerate(self.blocks) if isinstance(block, Namelist) and block.name == 'cntrl'), None)
+        if position is None:
+            return next((i for i, block in enumerate(self.blocks) if isinstance(block, Namelist) and block.name == 'wt'), len(self.blocks))
+        while position < len(self.blocks) and isinstance(self.blocks[position], Namelist) and self.blocks[position].name != 'wt':
+            position += 1
+        return position
+
+    def get(self, key: str, default: Optional[str] = None, group: str = 'cntrl') -> Optional[str]:
+        """ Value of an option of a namelist group """
+        for namelist in self.namelists():
+            if namelist.name == group and key in namelist:
+                return namelist.get(key)
+        return default
+
+    def update(self, options: dict, comment: Optional[str] = None) -> "Mdin":
+        """ Sets options of the &cntrl group, or of any other group with a group prefix (e.g. "ewald.skinnb") """
+        for key, value in options.items():
+            group, _, name = str(key).rpartition('.')
+            self.group(group or 'cntrl').set(name, value, comment)
+        return self
+
+    def copy(self) -> "Mdin":
+        """ Deep copy of the mdin """
+        return copy.deepcopy(self)
+
+    def __str__(self) -> str:
+        lines: list[str] = []
+        for block in self.blocks:
+            lines.extend(block.lines() if isinstance(block, Namelist) else [block])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: Union[str, Path]) -> str:
+        """ Writes the mdin file """
+        with open(path, 'w') as mdin:
+            mdin.write(str(self))
+        return str(path)
+
+
+def read_mdin(path: Union[str, Path]) -> Mdin:
+    """ Parses a mdin file, parsed files are cached by content hash and a copy is returned """
+    data = Path(path).read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    mdin = _MDIN_CACHE.get(digest)
+    if mdin is None:
+        mdin = Mdin.parse(data.decode('latin-1'))
+        _MDIN_CACHE[digest] = mdin
+        if len(_MDIN_CACHE) > _MDIN_CACHE_SIZE:
+            _MDIN_CACHE.popitem(last=False)
+    else:
+        _MDIN_CACHE.move_to_end(digest)
+    return mdin.copy()
+
+
+def simulation_type_mdin(simulation_type: str) -> Mdin:
+    """ Returns the mdin with the default options of a simulation_type """
+    mdin = Mdin(["This mdin file has been created by the biobb_amber module from the BioBB library ", "Type of mdin: " + simulation_type])
+    cntrl = mdin.group('cntrl')
+    if simulation_type in MD_SIMULATION_TYPES:
+        for key, value in SIMULATION_TYPE_OPTIONS['md']:
+            cntrl.set(key, value, 'BioBB simulation_type nvt|npt|free|heat')
+    for key, value in SIMULATION_TYPE_OPTIONS.get(simulation_type, []):
+        cntrl.set(key, value, 'BioBB simulation_type ' + simulation_type)
+    return mdin
+
+
+def write_mdin(path: Union[str, Path], simulation_type: str, options: dict, input_mdin_path: Optional[str] = None) -> str:
+    """ Writes a mdin file from an input mdin template (or the simulation_type defaults) overridden by the options of the mdin property """
+    if input_mdin_path:
+        mdin = read_mdin(input_mdin_path)
+        mdin.blocks[:0] = ["Mdin read from input file: " + str(input_mdin_path), "and modified by the biobb_amber module from the BioBB library "]
+    else:
+        mdin = simulation_type_mdin(simulation_type)
+    return mdin.update(options, 'BioBB property').write(path)
+
+
+# Size in bytes of the NetCDF classic external types (NC_BYTE, NC_CHAR, NC_SHORT, NC_INT, NC_FLOAT, NC_DOUBLE)
+NC_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 4, 6: 8}
+
+
+def read_netcdf_header(path: Union[str, Path]) -> tuple[int, list[tuple[bytes, int]], list[tuple[list[int], int, int, int]]]:
+    """ Returns the number of records, the dimensions (name, size) and the variables (dimension ids, type, vsize, begin offset) of a NetCDF classic file """
+    with open(path, 'rb') as fp:
+        def read_int():
+            data = fp.read(4)
+            if len(data) < 4:
+                raise ValueError('%s has a truncated NetCDF header' % path)
+            return struct.unpack('>i', data)[0]
+
+        def read_name():
+            size = read_int()
+            return fp.read(size + (-size) % 4)[:size]
+
+        def skip_attributes():
+            read_int()
+            for _ in range(read_int()):
+                read_name()
+                nc_type = read_int()
+                size = read_int() * NC_TYPE_SIZES[nc_type]
+                fp.read(size + (-size) % 4)
+
+        magic = fp.read(4)
+        if magic[:3] != b'CDF' or magic[3] not in (1, 2):
+            raise ValueError('%s is not a NetCDF classic file' % path)
+        offset_size = 8 if magic[3] == 2 else 4
+        numrecs = struct.unpack('>I', fp.read(4))[0]
+        read_int()
+        dimensions = [(read_name(), read_int()) for _ in range(read_int())]
+        skip_attributes()
+        read_int()
+        variables = []
+        for _ in range(read_int()):
+            read_name()
+            dimids = [read_int() for _ in range(read_int())]
+            skip_attributes()
+            nc_type = read_int()
+            vsize = read_int()
+            begin = int.from_bytes(fp.read(offset_size), 'big')
+            variables.append((dimids, nc_type, vsize, begin))
+    return numrecs, dimensions, variables
+
+
+def netcdf_record_layout(path: Union[str, Path]) -> tuple[int, int, int]:
+    """ Returns the number of records, the offset of the first record and the record size of a NetCDF classic (AMBER trajectory) file """
+    numrecs, dimensions, variables = read_netcdf_header(path)
+    record_vars = []
+    for dimids, nc_type, vsize, begin in variables:
+        if dimids and dimensions[dimids[0]][1] == 0:
+            size = NC_TYPE_SIZES[nc_type]
+            for dimid in dimids[1:]:
+                size *= dimensions[dimid][1]
+            record_vars.append((begin, vsize, size))
+
+    if not record_vars:
+        raise ValueError('%s has no record variables' % path)
+    begin = min(var[0] for var in record_vars)
+    # A single record variable is stored without padding
+    record_size = record_vars[0][2] if len(record_vars) == 1 else sum(var[1] for var in record_vars)
+    if numrecs == 0xFFFFFFFF:
+        numrecs = (Path(path).stat().st_size - begin) // record_size
+    return numrecs, begin, record_size
+
+
+def restart_atom_count(path: Union[str, Path]) -> Optional[int]:
+    """ Returns the number of atoms of a complete AMBER restart file (NetCDF or ASCII), None if it is missing or was truncated while being written """
+    if not Path(path).exists():
+        return None
+    with open(path, 'rb') as fp:
+        netcdf = fp.read(3) == b'CDF'
+
+    if netcdf:
+        try:
+            _, dimensions, variables = read_netcdf_header(path)
+        except (ValueError, KeyError, struct.error):
+            return None
+        natom = dict(dimensions).get(b'atom')
+        # Restart files only have fixed size variables, all of them stored before the end of the file
+        if natom is None or Path(path).stat().st_size < max((begin + vsize for _, _, vsize, begin in variables), default=0):
+            return None
+        return natom
+
+    # ASCII restart: title, atoms (and time) line, then 12 characters values, 6 per line: coordinates,
+    # optional velocities and optional box
+    with open(path) as fp:
+        fp.readline()
+        try:
+            natom = int(fp.readline().split()[0])
+        except (ValueError, IndexError):
+            return None
+        text = fp.read()
+    if not text.endswith('\n'):
+        return None
+    values = sum(len(line.rstrip()) // 12 + (len(line.rstrip()) % 12 > 0) for line in text.splitlines())
+    return natom if values in (3 * natom, 3 * natom + 6, 6 * natom, 6 * natom + 6) else None
+
+
+def stopped_run_return_code(rst_path: str, natom: Optional[int] = None, out_log=None, global_log=None) -> int:
+    """ Returns the return code of a run stopped on convergence: 0 if its restart file is complete (with natom atoms if set), 1 if it is missing or the engine was stopped while writing it """
+    rst_natom = restart_atom_count(rst_path)
+    if rst_natom is None or (natom is not None and rst_natom != natom):
+        fu.log('Run stopped on convergence but the %s restart file is missing or incomplete' % rst_path, out_log, global_log)
+        return 1
+    return 0
+
+
+def engine_arguments(mdin_path: str, paths: dict) -> list[str]:
+    """ Returns the sander/pmemd command line arguments (without the binary) for a mdin file and the input/output paths keyed as in io_dict """
+    arguments = ['-O',
+                 '-i', mdin_path,
+                 '-p', paths['input_top_path'],
+                 '-c', paths['input_crd_path'],
+                 '-r', paths['output_rst_path'],
+                 '-o', paths['output_log_path'],
+                 '-x', paths['output_traj_path']
+                 ]
+    for flag, key in (('-ref', 'input_ref_path'), ('-cpin', 'input_cpin_path'), ('-inf', 'output_mdinfo_path'),
+                      ('-cpout', 'output_cpout_path'), ('-cprestrt', 'output_cprst_path')):
+        if paths.get(key):
+            arguments.append(flag)
+            arguments.append(paths[key])
+    return arguments
+
+
+def engine_cmd(binary_path: str, mdin_path: str, paths: dict, mpi_bin: Optional[str] = None, mpi_np: Optional[int] = None,
+               mpi_flags: Optional[str] = None, pid_path: Optional[str] = None) -> list[str]:
+    """ Returns the sander/pmemd command line for a mdin file and the input/output paths keyed as in io_dict, launched by mpi_bin if set.
+    If pid_path is set, the shell records the engine PID in it before replacing itself with the engine """
+    # pmemd -O -i mdin/min.mdin -p $1.cpH.prmtop -c ph$i/$1.inpcrd -r ph$i/$1.min.rst7 -o ph$i/$1.min.o
+    cmd = [binary_path] + engine_arguments(mdin_path, paths)
+
+    # general mpi properties
+    if mpi_bin:
+        mpi_cmd = [mpi_bin]
+        if mpi_np:
+            mpi_cmd.append('-n')
+            mpi_cmd.append(str(mpi_np))
+        if mpi_flags:
+            mpi_cmd.append(mpi_flags)
+        cmd = mpi_cmd + cmd
+
+    if pid_path:
+        cmd = ['echo', '$$', '>', pid_path, ';', 'exec'] + cmd
+
+    return cmd
+
+
+# sander/pmemd -rem value of each replica exchange type
+REMD_TYPES = {'temperature': 1, 'hamiltonian': 3, 'ph': 4, 'redox': 5}
+
+
+def replica_path(path: Optional[str], replica: int) -> Optional[str]:
+    """ Path of a file of a replica (numbered from 1) of a multi-group run: replica 1 uses the path itself and the others a <stem>.<NNN><suffix> file next to it """
+    if not path or replica == 1:
+        return path
+    pure_path = PurePath(path)
+    return str(pure_path.with_name('%s.%03d%s' % (pure_path.stem, replica, pure_path.suffix)))
+
+
+def remlog_path(log_path: str) -> str:
+    """ Path of the replica exchange log written next to the log file of a multi-group run """
+    return str(PurePath(log_path).with_suffix('.remlog'))
+
+
+def replica_inputs(inputs: dict, num_replicas: int) -> list[dict]:
+    """ Input paths of each replica of a multi-group run: the replica files of input_crd_path and input_cpin_path (e.g. the restarts of a previous multi-group run) are used if they exist """
+    replicas = []
+    for replica in range(1, num_replicas + 1):
+        paths = dict(inputs)
+        for key in ('input_crd_path', 'input_cpin_path'):
+            if paths.get(key) and Path(str(replica_path(paths[key], replica))).exists():
+                paths[key] = replica_path(paths[key], replica)
+        replicas.append(paths)
+    return replicas
+
+
+def multigroup_cmd(mpi_bin: str, mpi_np: Optional[int], mpi_flags: Optional[str], binary_path: str, num_groups: int, groupfile_path: str,
+                   remd_type: Optional[str] = None, remlog: Optional[str] = None) -> list[str]:
+    """ Returns the command line running num_groups groups of a groupfile in a single MPI launch, exchanging replicas if remd_type is set """
+    cmd = [mpi_bin, '-n', str(mpi_np or num_groups)]
+    if mpi_flags:
+        cmd.append(mpi_flags)
+    cmd += [binary_path, '-ng', str(num_groups), '-groupfile', groupfile_path]
+    if remd_type:
+        cmd += ['-rem', str(REMD_TYPES[remd_type]), '-remlog', str(remlog)]
+    return cmd
+
+
+def write_groupfile(path: Union[str, Path], arguments: list[list[str]]) -> str:
+    """ Writes a sander/pmemd groupfile with the command line arguments of each group (-ng run), one group per line """
+    with open(path, 'w') as groupfile:
+        for group in arguments:
+            groupfile.write(' '.join(group) + '\n')
+    return str(path)
+
+
+def is_completed_log(path: Union[str, Path]) -> bool:
+    """ Checks if a sander/pmemd log file belongs to a run that reached its end """
+    if not Path(path).exists():
+        return False
+    with open(path, 'rb') as fp:
+        fp.seek(max(Path(path).stat().st_size - 8192, 0))
+        return re.search(rb'Run +done at', fp.read()) is not None
+
+
+def concatenate_trajectories(paths: list[str], output_path: Union[str, Path]) -> None:
+    """ Concatenates the frames of AMBER trajectories (NetCDF or ASCII mdcrd) written by consecutive runs of the same system """
+    with open(paths[0], 'rb') as fp:
+        netcdf = fp.read(3) == b'CDF'
+
+    with open(output_path, 'wb') as output:
+        if netcdf:
+            layouts = [netcdf_record_layout(path) for path in paths]
+            if len({layout[2] for layout in layouts}) != 1:
+                raise ValueError('Trajectories with different record sizes can not be concatenated')
+            # Header and fixed size variables of the first file, with the total number of records
+            with open(paths[0], 'rb') as fp:
+                header = bytearray(fp.read(layouts[0][1]))
+            header[4:8] = struct.pack('>I', sum(layout[0] for layout in layouts))
+            output.write(header)
+            for path, (numrecs, begin, record_size) in zip(paths, layouts):
+                with open(path, 'rb') as fp:
+                    fp.seek(begin)
+                    copy_bytes(fp, output, numrecs * record_size)
+        else:
+            # ASCII trajectories start with a title line, kept from the first file only
+            for i, path in enumerate(paths):
+                with open(path, 'rb') as fp:
+                    if i:
+                        fp.readline()
+                    shutil.copyfileobj(fp, output)
+
+
+def concatenate_files(paths: list[str], output_path: Union[str, Path]) -> None:
+    """ Concatenates text files (logs, cpout) written by consecutive runs """
+    with open(output_path, 'wb') as output:
+        for path in paths:
+            with open(path, 'rb') as fp:
+                shutil.copyfileobj(fp, output)
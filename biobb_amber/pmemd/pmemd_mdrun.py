@@ -2,15 +2,18 @@
 
 """Module containing the PmemdMDRun class and the command line interface."""
 from typing import Optional
-import re
+import json
+import shutil
 from pathlib import Path
-from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
-from biobb_amber.pmemd.common import check_input_path, check_output_path
+from biobb_amber.pmemd.common import check_input_path, check_output_path, REMD_TYPES, concatenate_files, concatenate_trajectories, engine_arguments, engine_cmd, is_completed_log, multigroup_cmd, remlog_path, read_mdin, replica_inputs, replica_path, stopped_run_return_code, write_groupfile, write_mdin
+from biobb_amber.process.common import ConvergenceMonitor
+from biobb_amber.leap.prmtop import CPH_RESIDUES, check_coordinates
+from biobb_amber.staging import StagingBiobbObject
 
 
-class PmemdMDRun(BiobbObject):
+class PmemdMDRun(StagingBiobbObject):
     """
     | biobb_amber PmemdMDRun
     | Wrapper of the `AmberTools (AMBER MD Package) pmemd tool <https://ambermd.org/AmberTools.php>`_ module.
@@ -29,15 +32,23 @@ class PmemdMDRun(BiobbObject):
         output_cprst_path (str) (Optional): Output constant pH restart file (AMBER rstout). File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/pmemd/sander.cprst>`_. Accepted formats: cprst (edam:format_3886), rst (edam:format_3886), rst7 (edam:format_3886).
         output_mdinfo_path (str) (Optional): Output MD info. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/pmemd/sander.mdinfo>`_. Accepted formats: mdinfo (edam:format_2330).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
-            * **mdin** (*dict*) - ({}) pmemd MD run options specification. (Used if *input_mdin_path* is None)
+            * **mdin** (*dict*) - ({}) pmemd MD run options specification. (Used if *input_mdin_path* is None) Options of other namelist groups are set with a group prefix, e.g. {"ewald.skinnb": 2.0}.
             * **binary_path** (*str*) - ("pmemd") pmemd binary path to be used.
+            * **prmtop_cache_path** (*str*) - (None) Folder where the %FLAG section offsets of input_top_path are stored and reused while the topology does not change, so the next blocks reading it do not scan it again.
             * **simulation_type** (*str*) - ("minimization") Default options for the mdin file. Each creates a different mdin file. Values: `minimization <https://biobb-amber.readthedocs.io/en/latest/_static/mdin/minimization.mdin>`_ (Runs an energy minimization), `min_vacuo <https://biobb-amber.readthedocs.io/en/latest/_static/mdin/min_vacuo.mdin>`_ (Runs an energy minimization in vacuo), `NVT <https://biobb-amber.readthedocs.io/en/latest/_static/mdin/NVT.mdin>`_ (Runs an NVT equilibration), `npt <https://biobb-amber.readthedocs.io/en/latest/_static/mdin/NPT.mdin>`_ (Runs an NPT equilibration), `free <https://biobb-amber.readthedocs.io/en/latest/_static/mdin/free.mdin>`_ (Runs a MD simulation).
+            * **convergence** (*dict*) - ({}) Stop the run once converged. Maximum absolute slope (units of the term per ps) of a linear fit over the last convergence_window ps, keyed by process_mdout term, e.g. {"DENSITY": 0.0001, "ETOT": 1.0}. The output log (or output_mdinfo_path if set) is read while the engine runs, and once all the criteria are met the engine is terminated, keeping the restart file written last. Not available with containers.
+            * **convergence_window** (*float*) - (20.0) Length in ps of the time window fitted by the convergence criteria.
+            * **convergence_interval** (*float*) - (30.0) Seconds between two checks of the convergence criteria.
+            * **segments** (*int*) - (1) [1~1000|1] Number of restart-chained segments the nstlim steps of the MD run are split into. Each segment restarts from the restart file of the previous one (irest=1, ntx=5) and their logs and trajectories are joined at the end. Segments are kept in a <output_rst_path stem>_segments folder until the whole run is completed, so launching again after a preemption skips the completed ones. Not available with containers.
+            * **replicas** (*list*) - ([]) MD run options specific to each replica of a multi-group run, one dictionary per replica, e.g. [{"temp0": 300.0}, {"temp0": 310.0}]. If set, a single MPI launch of *binary_path* (e.g. "pmemd.MPI") runs one group per replica from a generated groupfile (-ng/-groupfile). Replica 1 writes the output paths and replica N the <stem>.<NNN><suffix> files next to them. The <stem>.<NNN><suffix> files next to input_crd_path and input_cpin_path (e.g. the restarts of a previous multi-group run) are used by their replica if they exist. Requires *mpi_bin*.
+            * **remd_type** (*str*) - (None) Exchange the replicas of a multi-group run (-rem). The exchange log is written next to the output log as <stem>.remlog, and the number of exchanges is set by numexchg in *mdin*. Values: temperature (Temperature REMD, set temp0 in each replica), hamiltonian (Hamiltonian REMD), ph (pH REMD, set solvph in each replica), redox (Redox potential REMD, set solve in each replica).
             * **mpi_bin** (*str*) - (None) Path to the MPI runner. Usually "mpirun" or "srun".
             * **mpi_np** (*int*) - (0) [0~1000|1] Number of MPI processes. Usually an integer bigger than 1.
             * **mpi_flags** (*str*) - (None) Path to the MPI hostlist file.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
 
     Examples:
         This is a use example of how to use the building block from Python::
@@ -97,8 +108,21 @@ class PmemdMDRun(BiobbObject):
         self.properties = properties
         self.simulation_type = properties.get('simulation_type', "minimization")
         self.binary_path = properties.get('binary_path', "pmemd")
+        self.prmtop_cache_path = properties.get("prmtop_cache_path", None)
         self.mdin = {k: str(v) for k, v in properties.get('mdin', dict()).items()}
 
+        # Properties for the convergence monitor
+        self.convergence = properties.get('convergence', dict())
+        self.convergence_window = properties.get('convergence_window', 20.0)
+        self.convergence_interval = properties.get('convergence_interval', 30.0)
+
+        # Properties for segmented runs
+        self.segments = properties.get('segments', 1)
+
+        # Properties for multi-group runs
+        self.replicas = [{k: str(v) for k, v in replica.items()} for replica in properties.get('replicas', list())]
+        self.remd_type = properties.get('remd_type')
+
         # Properties for MPI
         self.mpi_bin = properties.get('mpi_bin')
         self.mpi_np = properties.get('mpi_np')
@@ -128,151 +152,128 @@ class PmemdMDRun(BiobbObject):
 
     def create_mdin(self, path: Optional[str] = None) -> str:
         """Creates an AMBER MD configuration file (mdin) using the properties file settings"""
-        mdin_list = []
-        mdin_firstPart = []
-        mdin_middlePart = []
-        mdin_lastPart = []
-
-        self.output_mdin_path = path
-
-        if self.io_dict['in']['input_mdin_path']:
-            # MDIN parameters read from an input mdin file
-            mdin_firstPart.append("Mdin read from input file: " + self.io_dict['in']['input_mdin_path'])
-            mdin_firstPart.append("and modified by the biobb_amber module from the BioBB library ")
-            with open(self.io_dict['in']['input_mdin_path']) as input_params:
-                firstPart = True
-                secondPart = False
-                for line in input_params:
-                    if '=' in line and not secondPart:
-                        firstPart = False
-                        mdin_middlePart.append(line.rstrip())
-                    else:
-                        if (firstPart):
-                            mdin_firstPart.append(line.rstrip())
-                        elif (secondPart):
-                            mdin_lastPart.append(line.rstrip())
-                        else:
-                            secondPart = True
-                            mdin_lastPart.append(line.rstrip())
-
-            for line in mdin_middlePart:
-                if ('!' in line or '#' in line) and not ('!@' in line or '!:' in line):
-                    # Parsing lines with comments (#,!), e.g. :
-                    # ntc=2, ntf=2, ! SHAKE, constrain lenghts of the bonds having H
-                    params = re.split('!|#', line)
-                    for param in params[0].split(','):
-                        if param.strip():
-                            mdin_list.append("  " + param.strip() + " ! " + params[1])
-                elif ('@' in line or ':' in line):
-                    # Parsing masks, e.g. :
-                    # restraintmask = ":1-40@P,O5',C5',C4',C3',O3'", restraint_wt = 0.5
-                    mylist = re.findall(r'(?:[^,"]|"(?:\\.|[^"])*")+', line)
-                    [mdin_list.append("  " + i.lstrip()) for i in mylist]  # type: ignore
-                else:
-                    for param in line.split(','):
-                        if param.strip():
-                            if not param.strip().startswith('!'):
-                                mdin_list.append("  " + param.strip())
+        self.output_mdin_path = write_mdin(str(path), self.simulation_type, self.mdin, self.io_dict['in']['input_mdin_path'])
+        return self.output_mdin_path
 
-        else:
-            # MDIN parameters added by the biobb_amber module
-            mdin_list.append("This mdin file has been created by the biobb_amber module from the BioBB library ")
-
-            sim_type = self.properties.get('simulation_type', 'minimization')
-            # sim_type = self.mdin.get('simulation_type', 'minimization')
-            minimization = (sim_type == 'minimization')
-            min_vacuo = (sim_type == 'min_vacuo')
-            heat = (sim_type == 'heat')
-            nvt = (sim_type == 'nvt')
-            npt = (sim_type == 'npt')
-            free = (sim_type == 'free')
-            md = (nvt or npt or free or heat)
-
-            mdin_list.append("Type of mdin: " + sim_type)
-            mdin_list.append("&cntrl")
-
-            # Pre-configured simulation type parameters
-            if minimization:
-                mdin_list.append("  imin = 1 ! BioBB simulation_type minimization")
-            if min_vacuo:
-                mdin_list.append("  imin = 1 ! BioBB simulation_type min_vacuo")
-                mdin_list.append("  ncyc = 250 ! BioBB simulation_type min_vacuo")
-                mdin_list.append("  ntb = 0 ! BioBB simulation_type min_vacuo")
-                mdin_list.append("  igb = 0 ! BioBB simulation_type min_vacuo")
-                mdin_list.append("  cut = 12 ! BioBB simulation_type min_vacuo")
-            if md:
-                mdin_list.append("  imin = 0 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  cut = 10.0 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ntr = 0 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ntc = 2 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ntf = 2 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ntt = 3 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ig = -1 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ioutfm = 1 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  iwrap = 1 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  nstlim = 5000 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  dt = 0.002 ! BioBB simulation_type nvt|npt|free|heat")
-            if npt:
-                mdin_list.append("  irest = 1 ! BioBB simulation_type npt")
-                mdin_list.append("  gamma_ln = 5.0 ! BioBB simulation_type npt")
-                mdin_list.append("  pres0 = 1.0 ! BioBB simulation_type npt")
-                mdin_list.append("  ntp = 1 ! BioBB simulation_type npt")
-                mdin_list.append("  taup = 2.0 ! BioBB simulation_type npt")
-                mdin_list.append("  ntx = 5 ! BioBB simulation_type npt")
-            if nvt:
-                mdin_list.append("  irest = 1 ! BioBB simulation_type nvt")
-                mdin_list.append("  gamma_ln = 5.0 ! BioBB simulation_type nvt")
-                mdin_list.append("  ntb = 1 ! BioBB simulation_type nvt")
-                mdin_list.append("  ntx = 5 ! BioBB simulation_type nvt")
-            if heat:
-                mdin_list.append("  tempi = 0.0 ! BioBB simulation_type heat")
-                mdin_list.append("  temp0 = 300.0 ! BioBB simulation_type heat")
-                mdin_list.append("  irest = 0 ! BioBB simulation_type heat")
-                mdin_list.append("  ntb = 1 ! BioBB simulation_type heat")  # periodic boundaries
-                mdin_list.append("  gamma_ln = 1.0 ! BioBB simulation_type heat")
-                # mdin_list.append("  nmropt = 1 ! BioBB simulation_type heat")
-
-                # mdin_lastPart.append("/")
-                # mdin_lastPart.append("&wt")
-                # mdin_lastPart.append(" TYPE = 'TEMP0' ! BioBB simulation_type heat")
-                # mdin_lastPart.append(" ISTEP1 = 1 ! BioBB simulation_type heat")
-                # mdin_lastPart.append(" ISTEP2 = 4000 ! BioBB simulation_type heat")
-                # mdin_lastPart.append(" VALUE1 = 10.0 ! BioBB simulation_type heat")
-                # mdin_lastPart.append(" VALUE2 = 300.0 ! BioBB simulation_type heat")
-                # mdin_lastPart.append("/")
-                # mdin_lastPart.append("&wt")
-                # mdin_lastPart.append(" TYPE = 'END' ! BioBB simulation_type heat")
-                # mdin_lastPart.append("/")
-
-        # Adding the rest of parameters in the config file to the mdin file
-        # if the parameter has already been added replace the value
-        parameter_keys = [parameter.split('=')[0].strip() for parameter in mdin_list]
-        for k, v in self.mdin.items():
-            config_parameter_key = str(k).strip()
-            if config_parameter_key in parameter_keys:
-                mdin_list[parameter_keys.index(config_parameter_key)] = '  ' + config_parameter_key + ' = ' + str(v) + ' ! BioBB property'
-            else:
-                mdin_list.append('  ' + config_parameter_key + ' = '+str(v) + ' ! BioBB property')
-
-        # Writing MD configuration file (mdin)
-        with open(str(self.output_mdin_path), 'w') as mdin:
-            # Start of file keyword(s)
-            if mdin_firstPart:
-                for line in mdin_firstPart:
-                    mdin.write(line + '\n')
-
-            # MD config parameters
-            for line in mdin_list:
-                mdin.write(line + '\n')
-
-            # End of file keyword(s)
-            if mdin_lastPart:
-                for line in mdin_lastPart:
-                    mdin.write(line + '\n')
-            else:
-                mdin.write("&end\n")
-
-        return str(self.output_mdin_path)
+    def create_cmd(self, mdin_path: str, paths: dict, pid_path: Optional[str] = None) -> list[str]:
+        """Creates the pmemd command line for the mdin file and the input/output paths (keyed as in io_dict)"""
+        return engine_cmd(self.binary_path, mdin_path, paths, self.mpi_bin, self.mpi_np, self.mpi_flags, pid_path)
+
+    def run_engine(self, monitor: Optional[ConvergenceMonitor], log_path: str, rst_path: str) -> bool:
+        """Runs the command line, watched by the convergence monitor if any. Returns True if the run was stopped on convergence,
+        the return code being set from the rst_path restart file completeness as the engine may have been stopped while writing it"""
+        if monitor:
+            monitor.start(log_path)
+
+        # Run Biobb block
+        self.run_biobb()
+
+        if monitor:
+            monitor.stop()
+            if monitor.converged_time is not None:
+                fu.log('Run stopped on convergence at %s ps' % monitor.converged_time, self.out_log, self.global_log)
+                self.return_code = stopped_run_return_code(rst_path, self.natom, self.out_log, self.global_log)
+                return True
+        return False
+
+    def run_groupfile(self, tmp_folder: str) -> None:
+        """Runs one group per replica in a single MPI launch (-ng/-groupfile), exchanging them if remd_type is set"""
+        if not self.mpi_bin:
+            fu.log('replicas property needs an MPI runner (mpi_bin) and binary (e.g. pmemd.MPI), exiting', self.out_log, self.global_log)
+            raise SystemExit(self.__class__.__name__ + ': replicas property needs mpi_bin')
+        if self.remd_type and self.remd_type not in REMD_TYPES:
+            fu.log('remd_type %s is not one of %s, exiting' % (self.remd_type, ', '.join(REMD_TYPES)), self.out_log, self.global_log)
+            raise SystemExit(self.__class__.__name__ + ': Unknown remd_type %s' % self.remd_type)
+        if self.convergence or self.segments > 1:
+            fu.log('WARNING: convergence and segments properties are not available with replicas, running the whole simulation', self.out_log, self.global_log)
+
+        mdin = self.mdin
+        arguments = []
+        for replica, paths in enumerate(replica_inputs(self.io_dict['in'], len(self.replicas)), start=1):
+            self.mdin = dict(mdin, **self.replicas[replica - 1])
+            mdin_path = self.create_mdin(path=str(Path(tmp_folder).joinpath("pmemd.%03d.mdin" % replica)))
+            paths.update({key: replica_path(path, replica) for key, path in self.io_dict['out'].items()})
+            arguments.append(engine_arguments(mdin_path, paths))
+        self.mdin = mdin
+
+        groupfile_path = write_groupfile(Path(tmp_folder).joinpath("pmemd.groupfile"), arguments)
+        fu.log('Running %d replicas from groupfile %s' % (len(self.replicas), groupfile_path), self.out_log)
+        self.cmd = multigroup_cmd(self.mpi_bin, self.mpi_np, self.mpi_flags, self.binary_path, len(self.replicas), groupfile_path,
+                                  self.remd_type, remlog_path(self.io_dict['out']['output_log_path']))
+
+        # Run Biobb block
+        self.run_biobb()
+
+    def run_segments(self, monitor: Optional[ConvergenceMonitor], pid_path: Optional[str]) -> None:
+        """Runs the nstlim steps as restart-chained segments in a <output_rst_path stem>_segments folder, skipping the segments completed by a previous (preempted) launch, and joins their outputs"""
+        out = self.io_dict['out']
+        nstlim = read_mdin(self.output_mdin_path).get('nstlim')
+        if not nstlim or not nstlim.isdigit():
+            fu.log('WARNING: segments property needs a MD run with nstlim steps, running the whole simulation', self.out_log, self.global_log)
+            self.cmd = self.create_cmd(self.output_mdin_path, {**self.io_dict['in'], **out}, pid_path)
+            self.run_engine(monitor, out['output_mdinfo_path'] or out['output_log_path'], out['output_rst_path'])
+            return
+        nstlim = int(nstlim)
+        segments = min(self.segments, nstlim)
+
+        # The segments folder is kept between launches unless the run plan changes
+        segment_dir = Path(out['output_rst_path']).parent.joinpath(Path(out['output_rst_path']).stem + '_segments')
+        plan_path = segment_dir.joinpath('segments.json')
+        plan = {'nstlim': nstlim, 'segments': segments}
+        if plan_path.exists() and json.loads(plan_path.read_text()) != plan:
+            fu.log('Removing the segments of a different run from %s' % segment_dir, self.out_log)
+            shutil.rmtree(segment_dir)
+        segment_dir.mkdir(exist_ok=True)
+        plan_path.write_text(json.dumps(plan))
+
+        mdin = self.mdin
+        paths = {**self.io_dict['in'], **out}
+        segment_paths: list[dict] = []
+        for i in range(segments):
+            prefix = str(segment_dir.joinpath('segment_%03d' % (i + 1)))
+            steps = nstlim // segments + (nstlim % segments if i == segments - 1 else 0)
+            if segment_paths:
+                previous = segment_paths[-1]
+                paths['input_crd_path'] = previous['output_rst_path']
+                if previous['output_cprst_path']:
+                    paths['input_cpin_path'] = previous['output_cprst_path']
+            segment = {'output_log_path': prefix + '.log',
+                       'output_traj_path': prefix + Path(out['output_traj_path']).suffix,
+                       'output_rst_path': prefix + Path(out['output_rst_path']).suffix,
+                       'output_cpout_path': prefix + '.cpout' if out['output_cpout_path'] else None,
+                       'output_cprst_path': prefix + '.cprst' if self.io_dict['in']['input_cpin_path'] else None,
+                       'output_mdinfo_path': out['output_mdinfo_path']}
+            paths.update(segment)
+            segment_paths.append(segment)
+
+            if Path(segment['output_rst_path']).exists() and is_completed_log(segment['output_log_path']):
+                fu.log('Segment %d/%d already completed, skipping it' % (i + 1, segments), self.out_log)
+                continue
+
+            self.mdin = dict(mdin, nstlim=str(steps))
+            if i:
+                self.mdin.update(irest='1', ntx='5')
+            self.cmd = self.create_cmd(self.create_mdin(path=prefix + '.mdin'), paths, pid_path)
+            fu.log('Running segment %d/%d (%d steps)' % (i + 1, segments, steps), self.out_log)
+            converged = self.run_engine(monitor, out['output_mdinfo_path'] or segment['output_log_path'], segment['output_rst_path'])
+            if self.return_code:
+                fu.log('Segment %d/%d failed, completed segments are kept in %s' % (i + 1, segments, segment_dir), self.out_log, self.global_log)
+                self.mdin = mdin
+                return
+            if converged:
+                break
+        self.mdin = mdin
+
+        # Join the outputs of the segments
+        fu.log('Joining the outputs of %d segments' % len(segment_paths), self.out_log)
+        concatenate_files([segment['output_log_path'] for segment in segment_paths], out['output_log_path'])
+        concatenate_trajectories([segment['output_traj_path'] for segment in segment_paths], out['output_traj_path'])
+        shutil.copy(segment_paths[-1]['output_rst_path'], out['output_rst_path'])
+        if out['output_cpout_path']:
+            concatenate_files([segment['output_cpout_path'] for segment in segment_paths], out['output_cpout_path'])
+        if out['output_cprst_path'] and segment_paths[-1]['output_cprst_path']:
+            shutil.copy(segment_paths[-1]['output_cprst_path'], out['output_cprst_path'])
+        self.tmp_files.append(str(segment_dir))
 
     @launchlogger
     def launch(self):
@@ -284,6 +285,12 @@ class PmemdMDRun(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+
+        # Topology and coordinates consistency, read from the lazy prmtop index without running parmed
+        prmtop = check_coordinates(self.io_dict['in']['input_top_path'], self.io_dict['in']['input_crd_path'], self.out_log, self.global_log, self.prmtop_cache_path)
+        self.natom = prmtop.natom if prmtop else None
+        if prmtop and self.io_dict['in'].get('input_cpin_path') and not prmtop.is_cph:
+            fu.log('WARNING: input_cpin_path set but no constant pH titratable residues (%s) found in %s' % (', '.join(CPH_RESIDUES), self.io_dict['in']['input_top_path']), self.out_log, self.global_log)
         self.stage_files()
 
         # Creating temporary folder
@@ -296,50 +303,25 @@ class PmemdMDRun(BiobbObject):
         #    self.output_mdin_path = self.create_mdin(path=str(Path(tmp_folder).joinpath("pmemd.mdin")))
         self.output_mdin_path = self.create_mdin(path=str(Path(tmp_folder).joinpath("pmemd.mdin")))
 
-        # Command line
-        # pmemd -O -i mdin/min.mdin -p $1.cpH.prmtop -c ph$i/$1.inpcrd -r ph$i/$1.min.rst7 -o ph$i/$1.min.o
-        self.cmd = [self.binary_path,
-                    '-O',
-                    '-i', self.output_mdin_path,
-                    '-p', self.io_dict['in']['input_top_path'],
-                    '-c', self.io_dict['in']['input_crd_path'],
-                    '-r', self.io_dict['out']['output_rst_path'],
-                    '-o', self.io_dict['out']['output_log_path'],
-                    '-x', self.io_dict['out']['output_traj_path']
-                    ]
-
-        if self.io_dict['in']['input_ref_path']:
-            self.cmd.append('-ref')
-            self.cmd.append(self.io_dict['in']['input_ref_path'])
-
-        if self.io_dict['in']['input_cpin_path']:
-            self.cmd.append('-cpin')
-            self.cmd.append(self.io_dict['in']['input_cpin_path'])
-
-        if self.io_dict['out']['output_mdinfo_path']:
-            self.cmd.append('-inf')
-            self.cmd.append(self.io_dict['out']['output_mdinfo_path'])
-
-        if self.io_dict['out']['output_cpout_path']:
-            self.cmd.append('-cpout')
-            self.cmd.append(self.io_dict['out']['output_cpout_path'])
-
-        if self.io_dict['out']['output_cprst_path']:
-            self.cmd.append('-cprestrt')
-            self.cmd.append(self.io_dict['out']['output_cprst_path'])
-
-        # general mpi properties
-        if self.mpi_bin:
-            mpi_cmd = [self.mpi_bin]
-            if self.mpi_np:
-                mpi_cmd.append('-n')
-                mpi_cmd.append(str(self.mpi_np))
-            if self.mpi_flags:
-                mpi_cmd.extend(self.mpi_flags)
-            self.cmd = mpi_cmd + self.cmd
-
-        # Run Biobb block
-        self.run_biobb()
+        # Convergence monitor
+        monitor = None
+        pid_path = None
+        if self.convergence and self.container_path:
+            fu.log('WARNING: convergence property is not available with containers, running the whole simulation', self.out_log, self.global_log)
+        elif self.convergence:
+            pid_path = str(Path(tmp_folder).joinpath("engine.pid"))
+            monitor = ConvergenceMonitor(self.io_dict['out']['output_mdinfo_path'] or self.io_dict['out']['output_log_path'],
+                                         self.convergence, self.convergence_window, self.convergence_interval, pid_path, self.out_log)
+
+        if self.segments > 1 and self.container_path:
+            fu.log('WARNING: segments property is not available with containers, running the whole simulation', self.out_log, self.global_log)
+        if self.replicas:
+            self.run_groupfile(tmp_folder)
+        elif self.segments > 1 and not self.container_path:
+            self.run_segments(monitor, pid_path)
+        else:
+            self.cmd = self.create_cmd(self.output_mdin_path, {**self.io_dict['in'], **self.io_dict['out']}, pid_path)
+            self.run_engine(monitor, self.io_dict['out']['output_mdinfo_path'] or self.io_dict['out']['output_log_path'], self.io_dict['out']['output_rst_path'])
 
         # Copy files to host
         self.copy_to_host()
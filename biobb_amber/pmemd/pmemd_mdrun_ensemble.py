@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+"""Module containing the PmemdMDRunEnsemble class and the command line interface."""
+from typing import Optional
+import os
+import random
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from biobb_common.command_wrapper import cmd_wrapper
+from biobb_common.tools import file_utils as fu
+from biobb_common.tools.file_utils import launchlogger
+from biobb_amber.pmemd.common import check_input_path, check_output_path, engine_arguments, engine_cmd, multigroup_cmd, read_mdin, write_groupfile, write_mdin
+from biobb_amber.staging import StagingBiobbObject
+
+
+class PmemdMDRunEnsemble(StagingBiobbObject):
+    """
+    | biobb_amber PmemdMDRunEnsemble
+    | Wrapper of the `AmberTools (AMBER MD Package) pmemd tool <https://ambermd.org/AmberTools.php>`_ module.
+    | Runs an ensemble of independent molecular dynamics replicas of the same topology using pmemd (or sander) tool from the AMBER MD package.
+
+    Args:
+        input_top_path (str): Input topology file (AMBER ParmTop), shared by all the replicas. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/pmemd/cln025.prmtop>`_. Accepted formats: top (edam:format_3881), parmtop (edam:format_3881), prmtop (edam:format_3881).
+        input_crd_path (str): Input coordinates file (AMBER crd) shared by all the replicas, or zip file with one coordinates file per replica (assigned in name order). File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/pmemd/cln025.inpcrd>`_. Accepted formats: crd (edam:format_3878), mdcrd (edam:format_3878), inpcrd (edam:format_3878), rst (edam:format_3886), rst7 (edam:format_3886), netcdf (edam:format_3650), nc (edam:format_3650), ncrst (edam:format_3886), zip (edam:format_3987).
+        output_zip_path (str): Output zip file with a replica_<number> folder per replica holding its mdin, log, trajectory, restart, mdinfo and, for constant pH runs, cpout and cprst files. File type: output. Accepted formats: zip (edam:format_3987).
+        input_mdin_path (str) (Optional): Input configuration file (MD run options) (AMBER mdin) used as template for all the replicas. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/pmemd/npt.mdin>`_. Accepted formats: mdin (edam:format_2330), in (edam:format_2330), txt (edam:format_2330).
+        input_cpin_path (str) (Optional): Input constant pH file (AMBER cpin), shared by all the replicas. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/pmemd/cln025.cpin>`_. Accepted formats: cpin (edam:format_2330).
+        input_ref_path (str) (Optional): Input reference coordinates for position restraints, shared by all the replicas. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/pmemd/sander.rst>`_. Accepted formats: crd (edam:format_3878), mdcrd (edam:format_3878), inpcrd (edam:format_3878), rst (edam:format_3886), rst7 (edam:format_3886), netcdf (edam:format_3650), nc (edam:format_3650), ncrst (edam:format_3886).
+        properties (dict - Python dictionary object containing the tool parameters, not input/output files):
+            * **mdin** (*dict*) - ({}) pmemd MD run options specification shared by all the replicas. (Used if *input_mdin_path* is None) Options of other namelist groups are set with a group prefix, e.g. {"ewald.skinnb": 2.0}.
+            * **replicas** (*list*) - ([]) MD run options specific to each replica, one dictionary per replica, e.g. [{"solvph": 6.5}, {"solvph": 7.0}]. They override the shared options.
+            * **num_replicas** (*int*) - (0) [0~10000|1] Number of replicas. 0 uses the length of *replicas*, or the number of coordinates files if *input_crd_path* is a zip file.
+            * **seed** (*int*) - (None) Random seed (ig) of the first replica, the following replicas use consecutive seeds. If None, each replica gets a different random seed. Seeds set in *mdin* or *replicas* are kept.
+            * **binary_path** (*str*) - ("pmemd") pmemd binary path to be used. Any engine accepting the sander command line (e.g. "sander", "pmemd.cuda", or "pmemd.MPI" with *mpi_bin*) can be used.
+            * **simulation_type** (*str*) - ("minimization") Default options for the mdin file. Each creates a different mdin file. Values: `minimization <https://biobb-amber.readthedocs.io/en/latest/_static/mdin/minimization.mdin>`_ (Runs an energy minimization), `min_vacuo <https://biobb-amber.readthedocs.io/en/latest/_static/mdin/min_vacuo.mdin>`_ (Runs an energy minimization in vacuo), `NVT <https://biobb-amber.readthedocs.io/en/latest/_static/mdin/NVT.mdin>`_ (Runs an NVT equilibration), `npt <https://biobb-amber.readthedocs.io/en/latest/_static/mdin/NPT.mdin>`_ (Runs an NPT equilibration), `free <https://biobb-amber.readthedocs.io/en/latest/_static/mdin/free.mdin>`_ (Runs a MD simulation).
+            * **num_workers** (*int*) - (0) [0~1000|1] Number of replicas running at the same time on the local worker pool. 0 uses all the CPU cores of the node. Not used with *mpi_bin*.
+            * **mpi_bin** (*str*) - (None) Path to the MPI runner. Usually "mpirun" or "srun". If set, all the replicas are run by a single MPI launch of *binary_path* with one group per replica (-ng/-groupfile).
+            * **mpi_np** (*int*) - (0) [0~1000|1] Number of MPI processes, a multiple of the number of replicas. 0 runs one process per replica.
+            * **mpi_flags** (*str*) - (None) Path to the MPI hostlist file.
+            * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
+            * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
+            * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
+
+    Examples:
+        This is a use example of how to use the building block from Python::
+
+            from biobb_amber.pmemd.pmemd_mdrun_ensemble import pmemd_mdrun_ensemble
+            prop = {
+                'simulation_type' : 'free',
+                'mdin' : {
+                    'nstlim' : 500000
+                },
+                'num_replicas' : 64,
+                'num_workers' : 8,
+                'binary_path' : 'pmemd.cuda'
+            }
+            pmemd_mdrun_ensemble(input_top_path='/path/to/topology.top',
+                                 input_crd_path='/path/to/coordinates.crd',
+                                 output_zip_path='/path/to/newReplicas.zip',
+                                 properties=prop)
+
+    Info:
+        * wrapped_software:
+            * name: AMBER pmemd
+            * version: >20
+            * license: other
+            * multinode: mpi
+        * ontology:
+            * name: EDAM
+            * schema: http://edamontology.org/EDAM.owl
+
+    """
+
+    def __init__(self, input_top_path: str, input_crd_path: str, output_zip_path: str,
+                 input_mdin_path: Optional[str] = None, input_cpin_path: Optional[str] = None, input_ref_path: Optional[str] = None,
+                 properties: Optional[dict] = None, **kwargs) -> None:
+
+        properties = properties or {}
+
+        # Call parent class constructor
+        super().__init__(properties)
+        self.locals_var_dict = locals().copy()
+
+        # Input/Output files
+        self.io_dict = {
+            'in': {'input_top_path': input_top_path,
+                   'input_crd_path': input_crd_path,
+                   'input_mdin_path': input_mdin_path,
+                   'input_ref_path': input_ref_path,
+                   'input_cpin_path': input_cpin_path},
+            'out': {'output_zip_path': output_zip_path}
+        }
+
+        # Properties specific for BB
+        self.properties = properties
+        self.simulation_type = properties.get('simulation_type', "minimization")
+        self.binary_path = properties.get('binary_path', "pmemd")
+        self.mdin = {k: str(v) for k, v in properties.get('mdin', dict()).items()}
+        self.replicas = [{k: str(v) for k, v in replica.items()} for replica in properties.get('replicas', list())]
+        self.num_replicas = properties.get('num_replicas', 0)
+        self.seed = properties.get('seed')
+        self.num_workers = properties.get('num_workers', 0)
+
+        # Properties for MPI
+        self.mpi_bin = properties.get('mpi_bin')
+        self.mpi_np = properties.get('mpi_np')
+        self.mpi_flags = properties.get('mpi_flags')
+
+        # Check the properties
+        self.check_properties(properties)
+        self.check_arguments()
+
+    def check_data_params(self, out_log, err_log):
+        """ Checks input/output paths correctness """
+
+        # Check input(s)
+        self.io_dict["in"]["input_top_path"] = check_input_path(self.io_dict["in"]["input_top_path"], "input_top_path", False, out_log, self.__class__.__name__)
+        if not str(self.io_dict["in"]["input_crd_path"]).endswith('.zip'):
+            self.io_dict["in"]["input_crd_path"] = check_input_path(self.io_dict["in"]["input_crd_path"], "input_crd_path", False, out_log, self.__class__.__name__)
+        self.io_dict["in"]["input_mdin_path"] = check_input_path(self.io_dict["in"]["input_mdin_path"], "input_mdin_path", True, out_log, self.__class__.__name__)
+        self.io_dict["in"]["input_cpin_path"] = check_input_path(self.io_dict["in"]["input_cpin_path"], "input_cpin_path", True, out_log, self.__class__.__name__)
+        self.io_dict["in"]["input_ref_path"] = check_input_path(self.io_dict["in"]["input_ref_path"], "input_ref_path", True, out_log, self.__class__.__name__)
+
+        # Check output(s)
+        self.io_dict["out"]["output_zip_path"] = check_output_path(self.io_dict["out"]["output_zip_path"], "output_zip_path", False, out_log, self.__class__.__name__)
+
+    def engine_path(self, path: str) -> str:
+        """Path of a file of the sandbox as seen by the engine"""
+        if self.container_path:
+            return str(Path(self.container_volume_path).joinpath(Path(path).relative_to(self.stage_io_dict['unique_dir'])))
+        return str(Path(self.stage_io_dict['unique_dir']).joinpath(path))
+
+    def run_command(self, cmd: list[str]) -> int:
+        """Runs a replica command line in the sandbox, returns its exit code"""
+        return cmd_wrapper.CmdWrapper(cmd=cmd, shell_path=self.shell_path, out_log=self.out_log, err_log=self.err_log,
+                                      global_log=self.global_log, env=self.env_vars_dict, timeout=self.timeout,
+                                      disable_logs=self.disable_logs).launch()
+
+    @launchlogger
+    def launch(self):
+        """Launches the execution of the PmemdMDRunEnsemble module."""
+
+        # check input/output paths and parameters
+        self.check_data_params(self.out_log, self.err_log)
+
+        # Setup Biobb
+        if self.check_restart():
+            return 0
+        self.stage_files()
+        unique_dir = Path(self.stage_io_dict['unique_dir'])
+
+        # Starting structures: a shared one or one per replica
+        crd_paths = []
+        if self.io_dict['in']['input_crd_path'].endswith('.zip'):
+            crd_folder = unique_dir.joinpath('input_crds')
+            crd_paths = sorted(path for path in fu.unzip_list(self.io_dict['in']['input_crd_path'], str(crd_folder), self.out_log) if Path(path).is_file())
+
+        num_replicas = self.num_replicas or len(self.replicas) or len(crd_paths)
+        if not num_replicas:
+            fu.log('No replicas defined: set num_replicas, replicas or a zip file of coordinates', self.out_log, self.global_log)
+            raise SystemExit(self.__class__.__name__ + ': No replicas defined')
+        if self.replicas and len(self.replicas) != num_replicas:
+            fu.log('%d replicas defined in replicas property but %d replicas requested' % (len(self.replicas), num_replicas), self.out_log, self.global_log)
+            raise SystemExit(self.__class__.__name__ + ': replicas and num_replicas do not match')
+        if crd_paths and len(crd_paths) != num_replicas:
+            fu.log('%d coordinates files found in %s but %d replicas requested' % (len(crd_paths), self.io_dict['in']['input_crd_path'], num_replicas), self.out_log, self.global_log)
+            raise SystemExit(self.__class__.__name__ + ': input_crd_path and num_replicas do not match')
+
+        if self.seed is not None:
+            seeds = [int(self.seed) + i for i in range(num_replicas)]
+        else:
+            seeds = random.SystemRandom().sample(range(1, 2**31 - 1), num_replicas)
+
+        # Seeds already set in the input mdin file are kept
+        seed_in_mdin = 'ig' in self.mdin or bool(self.io_dict['in']['input_mdin_path'] and read_mdin(self.io_dict['in']['input_mdin_path']).get('ig'))
+
+        # Generating all the mdins up front, shared inputs are staged once
+        shared_paths = {key: (path if self.container_path else self.engine_path(path)) if path else None for key, path in self.stage_io_dict['in'].items()}
+        replica_dirs = []
+        runs = []
+        width = max(3, len(str(num_replicas)))
+        for i in range(num_replicas):
+            replica_dir = unique_dir.joinpath('replica_%0*d' % (width, i + 1))
+            replica_dir.mkdir()
+            replica_dirs.append(replica_dir)
+
+            mdin = dict(self.mdin) if seed_in_mdin else dict(self.mdin, ig=str(seeds[i]))
+            mdin.update(self.replicas[i] if self.replicas else {})
+            mdin_path = write_mdin(replica_dir.joinpath('md.mdin'), self.simulation_type, mdin, self.io_dict['in']['input_mdin_path'])
+            netcdf = read_mdin(mdin_path).get('ioutfm') == '1'
+
+            paths = dict(shared_paths)
+            if crd_paths:
+                paths['input_crd_path'] = self.engine_path(crd_paths[i])
+            for key, name in (('output_log_path', 'md.log'), ('output_traj_path', 'md.nc' if netcdf else 'md.x'), ('output_rst_path', 'md.rst7'),
+                              ('output_mdinfo_path', 'md.mdinfo'), ('output_cpout_path', 'md.cpout'), ('output_cprst_path', 'md.cprst')):
+                paths[key] = self.engine_path(str(replica_dir.joinpath(name)))
+            if not self.io_dict['in']['input_cpin_path']:
+                paths['output_cpout_path'] = paths['output_cprst_path'] = None
+            runs.append((self.engine_path(mdin_path), paths))
+
+        if self.mpi_bin:
+            # A single MPI launch running one group per replica
+            groupfile_path = write_groupfile(unique_dir.joinpath('ensemble.groupfile'), [engine_arguments(*run) for run in runs])
+            self.cmd = multigroup_cmd(self.mpi_bin, self.mpi_np, self.mpi_flags, self.binary_path, num_replicas, self.engine_path(groupfile_path))
+            self.run_biobb()
+        elif self.container_path:
+            fu.log('Running %d replicas one after another in the container' % num_replicas, self.out_log)
+            for run in runs:
+                self.cmd = engine_cmd(self.binary_path, *run)
+                self.run_biobb()
+                if self.return_code:
+                    break
+        else:
+            num_workers = min(self.num_workers or os.cpu_count() or 1, num_replicas)
+            fu.log('Running %d replicas with %d workers' % (num_replicas, num_workers), self.out_log)
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                return_codes = list(executor.map(self.run_command, [engine_cmd(self.binary_path, *run) for run in runs]))
+            self.return_code = next((code for code in return_codes if code), 0)
+            if self.return_code:
+                fu.log('Replicas %s failed' % ', '.join(str(i + 1) for i, code in enumerate(return_codes) if code), self.out_log, self.global_log)
+
+        # Gathering the outputs of the replicas in a zip file keeping the folder structure
+        with zipfile.ZipFile(self.io_dict['out']['output_zip_path'], 'w') as zip_file:
+            for replica_dir in replica_dirs:
+                for path in sorted(replica_dir.iterdir()):
+                    zip_file.write(path, arcname=str(path.relative_to(unique_dir)))
+        fu.log('Replica outputs gathered in %s' % self.io_dict['out']['output_zip_path'], self.out_log)
+
+        # remove temporary folder(s)
+        self.tmp_files.extend([str(replica_dir) for replica_dir in replica_dirs])
+        self.tmp_files.extend([str(unique_dir.joinpath('input_crds')), str(unique_dir.joinpath('ensemble.groupfile'))])
+        self.remove_tmp_files()
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+
+def pmemd_mdrun_ensemble(input_top_path: str, input_crd_path: str, output_zip_path: str,
+                         input_mdin_path: Optional[str] = None, input_cpin_path: Optional[str] = None,
+                         input_ref_path: Optional[str] = None,
+                         properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`PmemdMDRunEnsemble <pmemd.pmemd_mdrun_ensemble.PmemdMDRunEnsemble>`pmemd.pmemd_mdrun_ensemble.PmemdMDRunEnsemble class and
+    execute :meth:`launch() <pmemd.pmemd_mdrun_ensemble.PmemdMDRunEnsemble.launch>` method"""
+    return PmemdMDRunEnsemble(**dict(locals())).launch()
+
+
+pmemd_mdrun_ensemble.__doc__ = PmemdMDRunEnsemble.__doc__
+
+main = PmemdMDRunEnsemble.get_main(pmemd_mdrun_ensemble, "Running an ensemble of independent molecular dynamics replicas using pmemd tool from the AMBER MD package.")
+
+if __name__ == '__main__':
+    main()
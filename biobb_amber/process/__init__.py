@@ -1,5 +1,6 @@
 from . import process_minout
 from . import process_mdout
+from . import process_mdout_batch
 
 name = "process"
-__all__ = ["process_minout", "process_mdout"]
+__all__ = ["process_minout", "process_mdout", "process_mdout_batch"]
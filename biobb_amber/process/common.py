@@ -1,8 +1,18 @@
 """Common functions for package biobb_amber.process"""
 
+import bisect
+import glob
+import importlib.util
+import json
+import mmap
+import os
+import re
+import signal
+import threading
 from pathlib import Path, PurePath
-from typing import Optional, Union
+from typing import Iterable, Iterator, Optional, Union
 
+import numpy as np
 from biobb_common.tools import file_utils as fu
 
 
@@ -47,14 +57,19 @@ def check_output_path(path, argument, optional, out_log, classname):
             classname + ": Format %s in  %s file is not compatible"
             % (file_extension[1:], argument)
         )
+    if file_extension == ".parquet" and not importlib.util.find_spec("pyarrow"):
+        fu.log(classname + ": pyarrow is needed to write %s parquet files, exiting" % argument, out_log)
+        raise SystemExit(classname + ": pyarrow is needed to write %s parquet files" % argument)
     return path
 
 
 def is_valid_file(ext, argument):
     """Checks if file format is compatible"""
     formats = {
-        "input_log_path": ["log", "out", "txt", "o"],
-        "output_dat_path": ["dat", "txt", "csv"],
+        "input_log_path": ["log", "out", "txt", "o", "mdinfo"],
+        "input_logs_path": ["log", "out", "txt", "o", "mdinfo", "zip"],
+        "output_dat_path": ["dat", "txt", "csv", "npz", "parquet"],
+        "output_stats_path": ["dat", "txt", "csv", "json"],
     }
     return ext in formats[argument]
 
@@ -85,3 +100,572 @@ def _from_string_to_list(input_data: Optional[Union[str, list[str]]]) -> list[st
     processed_items = [item.strip() for item in items if item.strip()]
 
     return processed_items
+
+
+# Label printed in the sander/pmemd MD output file for each process_mdout term
+MDOUT_TERMS = {
+    "VOLUME": "VOLUME",
+    "TSOLVENT": "T_solvent",
+    "TSOLUTE": "T_solute",
+    "TEMP": "TEMP(K)",
+    "PRES": "PRESS",
+    "ETOT": "Etot",
+    "ESCF": "ESCF",
+    "EPTOT": "EPtot",
+    "EKTOT": "EKtot",
+    "EKCMT": "EKCMT",
+    "DENSITY": "Density",
+}
+
+# "LABEL = value" pairs of an energy record, e.g. " 1-4 NB =       296.3760"
+_KEY_VALUE = re.compile(r"(\S+(?: \S+)?)\s+=\s+(\S+)")
+
+
+def _mdout_records(fp, labels: list[str], offset: int = 0) -> Iterator[tuple[str, list[str], int, int]]:
+    """
+    Streams the energy records of a binary file object positioned at byte offset.
+
+    Yields:
+        tuple: The TIME(PS) string, the list of raw value strings of labels ("-" if not printed) and
+        the byte offsets where the NSTEP line of the record starts and where its closing dashed line ends.
+    """
+    record: Optional[dict] = None
+    start = offset
+    skip = False
+    for raw in fp:
+        line = raw.decode("latin-1")
+        if "A V E R A G E S" in line or "F L U C T U A T I O N S" in line:
+            skip = True
+        elif line.lstrip().startswith("NSTEP ="):
+            record = dict(_KEY_VALUE.findall(line))
+            start = offset
+        elif record is not None:
+            if line.lstrip().startswith("---"):
+                if not skip:
+                    yield record["TIME(PS)"], [record.get(label, "-") for label in labels], start, offset + len(raw)
+                record = None
+                skip = False
+            else:
+                record.update(_KEY_VALUE.findall(line))
+        offset += len(raw)
+
+
+def parse_mdout(path: Union[str, Path], terms: list[str]) -> Iterator[tuple[str, list[str]]]:
+    """
+    Streams the energy records of an AMBER (sander/pmemd) MD output file in a single pass.
+
+    Each NSTEP record is parsed as soon as its closing dashed line is read, so memory use does
+    not depend on the size of the log. The AVERAGES and RMS FLUCTUATIONS records are skipped.
+
+    Parameters:
+        path (str): Path to the MD output (log) file.
+        terms (list): process_mdout terms to extract (see MDOUT_TERMS).
+
+    Yields:
+        tuple: The TIME(PS) string and the list of raw value strings of the requested terms ("-" if not printed).
+    """
+    labels = [MDOUT_TERMS.get(term, term) for term in terms]
+    with open(path, "rb") as fp:
+        for index, values, _, _ in _mdout_records(fp, labels):
+            yield index, values
+
+
+def read_mdout(path: Union[str, Path], terms: list[str]) -> list[tuple[str, list[str]]]:
+    """Returns all the energy records of an AMBER MD output file (picklable parse_mdout for process pools)"""
+    return list(parse_mdout(path, terms))
+
+
+def expand_log_paths(input_logs_path: Union[str, list[str]]) -> list[str]:
+    """
+    Expands a list of log paths or a glob pattern into a sorted list of paths.
+
+    Parameters:
+        input_logs_path (str, list): A path, a glob pattern (e.g. "replica_*/mdout") or a list of paths.
+
+    Returns:
+        list: The log paths. A path without glob wildcards is returned as is, even if it does not exist.
+    """
+    if isinstance(input_logs_path, (list, tuple)):
+        return [str(path) for path in input_logs_path]
+    if any(char in str(input_logs_path) for char in "*?["):
+        return sorted(glob.glob(str(input_logs_path)))
+    return [str(input_logs_path)]
+
+
+def follow_mdout(path: Union[str, Path], terms: list[str], state_path: Union[str, Path]) -> tuple[list[tuple[str, list[str]]], bool]:
+    """
+    Parses only the energy records appended to an AMBER MD output (log or mdinfo) file since the previous call.
+
+    The byte offset after the last complete record is kept in the state_path JSON sidecar file, so
+    each call reads only the new bytes of a growing log. Records still being written are left for
+    the next call. If the file was truncated or rewritten in place (as mdinfo is), it is read again
+    from the start and only records with a TIME(PS) greater than the last one returned are kept.
+
+    Parameters:
+        path (str): Path to the MD output (log or mdinfo) file.
+        terms (list): process_mdout terms to extract (see MDOUT_TERMS).
+        state_path (str): Path to the JSON sidecar file holding the parser state.
+
+    Returns:
+        tuple: The list of new (index, values) records and True if the state was (re)started from scratch.
+    """
+    log = str(Path(path).resolve())
+    state = None
+    if Path(state_path).exists():
+        with open(state_path) as fp:
+            state = json.load(fp)
+    fresh = state is None or state.get("log") != log or state.get("terms") != list(terms)
+    if fresh:
+        state = {"log": log, "terms": list(terms), "offset": 0, "anchor": 0, "anchor_line": "", "index": None}
+
+    labels = [MDOUT_TERMS.get(term, term) for term in terms]
+    records = []
+    with open(path, "rb") as fp:
+        if state["offset"]:
+            # The NSTEP line of the last record read must still be in place, otherwise start over
+            fp.seek(state["anchor"])
+            if state["offset"] > Path(path).stat().st_size or fp.readline().decode("latin-1") != state["anchor_line"]:
+                state["offset"] = 0
+        fp.seek(state["offset"])
+        for index, values, start, end in _mdout_records(fp, labels, state["offset"]):
+            state["offset"] = end
+            state["anchor"] = start
+            if state["index"] is None or float(index) > float(state["index"]):
+                records.append((index, values))
+                state["index"] = index
+        if state["offset"]:
+            fp.seek(state["anchor"])
+            state["anchor_line"] = fp.readline().decode("latin-1")
+
+    with open(state_path, "w") as fp:
+        json.dump(state, fp)
+    return records, fresh
+
+
+# Label printed in the sander/pmemd minimization output file for each process_minout term
+MINOUT_TERMS = {
+    "BOND": "BOND",
+    "ANGLE": "ANGLE",
+    "DIHEDRAL": "DIHED",
+    "VDWAALS": "VDWAALS",
+    "EEL": "EEL",
+    "HBOND": "HBOND",
+    "VDW14": "1-4 VDW",
+    "EEL14": "1-4 EEL",
+    "RESTRAINT": "RESTRAINT",
+}
+
+# Columns of the fixed "NSTEP ENERGY RMS GMAX NAME NUMBER" header of a minimization record
+MINOUT_HEADER_TERMS = ("NSTEP", "ENERGY", "RMS", "GMAX", "NAME", "NUMBER")
+
+_MINOUT_HEADER = re.compile(rb"NSTEP +ENERGY +RMS +GMAX +NAME +NUMBER[ \t]*\r?\n" + rb"\s*(\S+)" * len(MINOUT_HEADER_TERMS))
+_KEY_VALUE_BYTES = re.compile(_KEY_VALUE.pattern.encode())
+
+
+def parse_minout(path: Union[str, Path], terms: list[str]) -> Iterator[tuple[str, list[str]]]:
+    """
+    Scans the energy records of an AMBER (sander/pmemd) minimization output file.
+
+    The log is memory mapped and the regular expressions run directly over the mapped buffer, using
+    pos/endpos bounds instead of splitting it into lines. The repeated record printed after
+    FINAL RESULTS is not included, as in process_minout.perl.
+
+    Parameters:
+        path (str): Path to the minimization output (log) file.
+        terms (list): process_minout terms to extract (see MINOUT_HEADER_TERMS and MINOUT_TERMS).
+
+    Yields:
+        tuple: The NSTEP string and the list of raw value strings of the requested terms ("-" if not printed).
+    """
+    if not Path(path).stat().st_size:
+        return
+    labels = [MINOUT_TERMS.get(term, term).encode() for term in terms]
+    with open(path, "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        endpos = buf.find(b"FINAL RESULTS")
+        if endpos == -1:
+            endpos = len(buf)
+        headers = list(_MINOUT_HEADER.finditer(buf, 0, endpos))
+        for header, next_header in zip(headers, headers[1:] + [None]):
+            record = dict(zip((term.encode() for term in MINOUT_HEADER_TERMS), header.groups()))
+            record.update(_KEY_VALUE_BYTES.findall(buf, header.end(), next_header.start() if next_header else endpos))
+            yield header.group(1).decode(), [record.get(label, b"-").decode() for label in labels]
+
+
+def write_dat(records: Iterable[tuple[str, list[str]]], terms: list[str], output_dat_path: Union[str, Path], separator: str = " ", append: bool = False) -> None:
+    """
+    Writes parsed energy records to a dat file using the process_mdout/process_minout layout.
+
+    A single term is written as two columns (index and value) without header, several terms
+    are written with a "# TIME" header and a float index column.
+
+    Parameters:
+        records (iterable): (index, values) tuples as yielded by the parsers of this module.
+        terms (list): Names of the terms, in the same order as the values.
+        output_dat_path (str): Path to the output dat file.
+        separator (str): Separator between index and value in the single term layout.
+        append (bool): Append the records to an existing dat file, without writing the header again.
+    """
+    with open(output_dat_path, "a" if append else "w") as fp_out:
+        if len(terms) == 1:
+            fp_out.writelines(index + separator + values[0] + "\n" for index, values in records)
+        else:
+            if not append:
+                fp_out.write("# TIME " + "".join(term + " " for term in terms) + "\n")
+            fp_out.writelines(
+                str(float(index)) + " " + "".join(value + " " for value in values) + "\n"
+                for index, values in records
+            )
+
+
+def read_summaries(folder: Union[str, Path], terms: list[str]) -> list[tuple[str, list[str]]]:
+    """
+    Merges the summary.<TERM> files written by process_mdout.perl / process_minout.perl.
+
+    Parameters:
+        folder (str): Folder containing the summary files.
+        terms (list): Terms to read.
+
+    Returns:
+        list: (index, values) tuples sorted by index, "-" where a term has no value.
+    """
+    ene_dict: dict[float, dict[str, str]] = {}
+    for term in terms:
+        with open(str(folder) + "/summary." + term) as fp:
+            for line in fp:
+                x = line.split()
+                if x:
+                    ene_dict.setdefault(float(x[0]), {})[term] = x[1] if len(x) > 1 else "-"
+    return [(str(key), [ene_dict[key].get(term, "-") for term in terms]) for key in sorted(ene_dict)]
+
+
+def is_array_file(path: Union[str, Path]) -> bool:
+    """Checks if the output path requests a columnar (NumPy npz or parquet) file"""
+    return PurePath(path).suffix in (".npz", ".parquet")
+
+
+def records_to_arrays(records: Iterable[tuple[str, list[str]]], terms: list[str], index_name: str = "TIME") -> dict[str, np.ndarray]:
+    """
+    Converts parsed energy records to one NumPy array per column.
+
+    Numeric terms become float64 arrays with NaN where the term was not printed, non numeric
+    terms (e.g. the NAME of the minimization GMAX atom) are kept as string arrays.
+
+    Parameters:
+        records (iterable): (index, values) tuples as yielded by the parsers of this module.
+        terms (list): Names of the terms, in the same order as the values.
+        index_name (str): Name of the index column.
+
+    Returns:
+        dict: Arrays keyed by index_name followed by the term names.
+    """
+    index: list[str] = []
+    columns: list[list[str]] = [[] for _ in terms]
+    for key, values in records:
+        index.append(key)
+        for column, value in zip(columns, values):
+            column.append("nan" if value == "-" else value)
+
+    arrays = {index_name: np.array(index, dtype=np.float64)}
+    for term, column in zip(terms, columns):
+        try:
+            arrays[term] = np.array(column, dtype=np.float64)
+        except ValueError:
+            arrays[term] = np.array(column, dtype=str)
+    return arrays
+
+
+def write_arrays(arrays: dict[str, np.ndarray], output_path: Union[str, Path]) -> None:
+    """
+    Writes column arrays to an uncompressed NumPy npz file or, if pyarrow is installed, to a parquet file.
+
+    Parameters:
+        arrays (dict): Arrays keyed by column name.
+        output_path (str): Path to the output file, the format is taken from its extension (npz or parquet).
+    """
+    if PurePath(output_path).suffix == ".parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.table(arrays), str(output_path))
+    else:
+        np.savez(str(output_path), **arrays)
+
+
+def read_arrays(input_path: Union[str, Path]) -> dict[str, np.ndarray]:
+    """
+    Reads the column arrays of a NumPy npz or parquet file written by write_arrays.
+
+    Parameters:
+        input_path (str): Path to the npz or parquet file.
+
+    Returns:
+        dict: Arrays keyed by column name.
+    """
+    if PurePath(input_path).suffix == ".parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(str(input_path))
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+    with np.load(str(input_path)) as data:
+        return {name: data[name] for name in data.files}
+
+
+def read_dat(input_dat_path: Union[str, Path], terms: list[str], index_name: str = "TIME") -> dict[str, np.ndarray]:
+    """
+    Reads a dat file written by write_dat (or by the perl tools) back into column arrays.
+
+    Parameters:
+        input_dat_path (str): Path to the dat file.
+        terms (list): Names of the terms, in the same order as the value columns.
+        index_name (str): Name of the index column.
+
+    Returns:
+        dict: Float64 arrays keyed by index_name followed by the term names, NaN where the value is "-".
+    """
+    data = np.genfromtxt(str(input_dat_path), comments="#", missing_values="-", ndmin=2)
+    return {name: data[:, i] if data.size else np.array([]) for i, name in enumerate([index_name] + terms)}
+
+
+def append_columns(arrays: dict[str, np.ndarray], columns_path: Union[str, Path], fresh: bool = False) -> dict[str, np.ndarray]:
+    """
+    Appends column arrays to a raw float64 file with one row per record, so a growing series is stored at the
+    cost of the new records only, and returns all the columns stored in it (memory mapped, nothing is parsed).
+
+    Parameters:
+        arrays (dict): Column arrays of the new records, as returned by records_to_arrays.
+        columns_path (str): Path to the raw float64 file.
+        fresh (bool): Replace the previous rows instead of appending.
+
+    Returns:
+        dict: Float64 arrays of all the rows keyed by column name, NaN where a value is not numeric.
+    """
+    names = list(arrays)
+    rows = np.empty((len(arrays[names[0]]), len(names)))
+    for i, name in enumerate(names):
+        try:
+            rows[:, i] = arrays[name].astype(np.float64)
+        except ValueError:
+            rows[:, i] = [float(value) if _is_float(value) else np.nan for value in arrays[name]]
+    with open(columns_path, "wb" if fresh else "ab") as fp:
+        rows.tofile(fp)
+    if not os.path.getsize(columns_path):
+        return {name: np.zeros(0) for name in names}
+    data = np.memmap(columns_path, dtype=np.float64, mode="r").reshape(-1, len(names))
+    return {name: data[:, i] for i, name in enumerate(names)}
+
+
+def _is_float(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def autocorrelation_time(values: np.ndarray, window: float = 5.0) -> float:
+    """
+    Integrated autocorrelation time of a time series, in samples (1 for uncorrelated samples).
+
+    The normalized autocorrelation function is computed with a FFT and summed up to the first lag M
+    with M >= window * tau(M) (Sokal's automatic windowing).
+
+    Parameters:
+        values (np.ndarray): The time series.
+        window (float): Window factor of the automatic windowing.
+
+    Returns:
+        float: The integrated autocorrelation time, NaN if there are less than two samples.
+    """
+    n = len(values)
+    if n < 2:
+        return np.nan
+    deviations = values - values.mean()
+    spectrum = np.fft.rfft(deviations, n=2 * n)
+    acf = np.fft.irfft(spectrum * np.conjugate(spectrum))[:n]
+    if acf[0] <= 0:
+        return 1.0
+    taus = 2 * np.cumsum(acf / acf[0]) - 1
+    cut = np.flatnonzero(np.arange(n) >= window * taus)
+    return float(max(taus[cut[0]] if cut.size else taus[-1], 1.0))
+
+
+def block_standard_error(values: np.ndarray, blocks: int = 10) -> float:
+    """
+    Standard error of the mean of a time series estimated from the means of consecutive blocks.
+
+    Parameters:
+        values (np.ndarray): The time series, leading samples not filling a block are discarded.
+        blocks (int): Number of blocks.
+
+    Returns:
+        float: The block averaged standard error, NaN if there are less than two samples per block.
+    """
+    size = len(values) // blocks if blocks > 1 else 0
+    if size < 2:
+        return np.nan
+    means = values[len(values) - blocks * size:].reshape(blocks, size).mean(axis=1)
+    return float(means.std(ddof=1) / np.sqrt(blocks))
+
+
+def equilibration_index(values: np.ndarray, candidates: int = 50) -> int:
+    """
+    Automatic equilibration cut-off of a time series.
+
+    Returns the first production sample t0, chosen among evenly spaced candidates in the first half of
+    the series as the one maximizing the number of uncorrelated samples (N - t0) / tau(t0) of values[t0:].
+
+    Parameters:
+        values (np.ndarray): The time series.
+        candidates (int): Number of cut-offs tried.
+
+    Returns:
+        int: Index of the first equilibrated sample.
+    """
+    n = len(values)
+    if n < 4:
+        return 0
+    starts = np.unique(np.linspace(0, n // 2, min(candidates, n // 2 + 1)).astype(int))
+    effective = [(n - start) / autocorrelation_time(values[start:]) for start in starts]
+    return int(starts[int(np.argmax(effective))])
+
+
+def compute_statistics(arrays: dict[str, np.ndarray], terms: list[str], index_name: str = "TIME", blocks: int = 10) -> dict[str, dict[str, float]]:
+    """
+    Statistical reduction of the parsed energy terms.
+
+    For each numeric term the equilibration cut-off is detected first, and the mean, standard deviation,
+    block averaged standard error and integrated autocorrelation time are computed over the production
+    (equilibrated) samples. Samples not printed in the log (NaN) are ignored.
+
+    Parameters:
+        arrays (dict): Column arrays as returned by records_to_arrays.
+        terms (list): Terms to reduce.
+        index_name (str): Name of the index column.
+        blocks (int): Number of blocks of the standard error estimate.
+
+    Returns:
+        dict: For each term a dict with the MEAN, STD, SEM, TAU (in samples), EQUILIBRATION (index value
+        of the first production sample), SAMPLES (production samples) and EFFECTIVE_SAMPLES (SAMPLES / TAU).
+    """
+    statistics = {}
+    for term in terms:
+        if arrays[term].dtype.kind != "f":
+            continue
+        present = ~np.isnan(arrays[term])
+        values, index = arrays[term][present], arrays[index_name][present]
+        start = equilibration_index(values)
+        production = values[start:]
+        tau = autocorrelation_time(production)
+        statistics[term] = {
+            "MEAN": float(production.mean()) if production.size else np.nan,
+            "STD": float(production.std(ddof=1)) if production.size > 1 else np.nan,
+            "SEM": block_standard_error(production, blocks),
+            "TAU": tau,
+            "EQUILIBRATION": float(index[start]) if index.size else np.nan,
+            "SAMPLES": int(production.size),
+            "EFFECTIVE_SAMPLES": float(production.size / tau) if production.size > 1 else np.nan,
+        }
+    return statistics
+
+
+def write_statistics(statistics: dict[str, dict[str, float]], output_stats_path: Union[str, Path]) -> None:
+    """
+    Writes the statistics of compute_statistics to a JSON file or to a dat table with one row per term.
+
+    Parameters:
+        statistics (dict): Statistics keyed by term.
+        output_stats_path (str): Path to the output file, JSON if its extension is json.
+    """
+    if PurePath(output_stats_path).suffix == ".json":
+        # NaN is not valid JSON, terms without samples are written as null
+        statistics = {term: {key: None if np.isnan(value) else value for key, value in values.items()} for term, values in statistics.items()}
+        with open(output_stats_path, "w") as fp_out:
+            json.dump(statistics, fp_out, indent=4)
+        return
+    columns = ["MEAN", "STD", "SEM", "TAU", "EQUILIBRATION", "SAMPLES", "EFFECTIVE_SAMPLES"]
+    with open(output_stats_path, "w") as fp_out:
+        fp_out.write("# TERM " + "".join(column + " " for column in columns) + "\n")
+        for term, values in statistics.items():
+            fp_out.write(term + " " + "".join("%.6g " % values[column] for column in columns) + "\n")
+
+
+class ConvergenceMonitor:
+    """
+    Watches the log (or mdinfo) file of a running sander/pmemd engine and terminates it once converged.
+
+    Every interval seconds the new energy records are read with follow_mdout, and for each criteria term
+    the slope of a linear fit over the last window picoseconds is computed. When all the absolute slopes are
+    below their thresholds, SIGTERM is sent to the engine whose PID is read from pid_path, so the restart
+    file written last (every ntwr steps) is kept. As the engine may be stopped while writing it, the blocks
+    check the restart file afterwards (see pmemd.common.stopped_run_return_code).
+
+    Parameters:
+        log_path (str): Path to the MD output (log or mdinfo) file written by the engine.
+        criteria (dict): Maximum absolute slope (units of the term per ps) keyed by process_mdout term (e.g. {"DENSITY": 1e-4}).
+        window (float): Length in ps of the fitted time window, it must be covered by the data before stopping.
+        interval (float): Seconds between two checks of the log file.
+        pid_path (str): File where the PID of the engine is written when it is launched.
+        out_log (logger): Log object.
+    """
+
+    def __init__(self, log_path: Union[str, Path], criteria: dict[str, float], window: float, interval: float, pid_path: Union[str, Path], out_log=None) -> None:
+        self.log_path = log_path
+        self.terms = list(criteria)
+        self.thresholds = np.array([float(criteria[term]) for term in self.terms])
+        self.window = float(window)
+        self.interval = float(interval)
+        self.pid_path = pid_path
+        self.out_log = out_log
+        self.state_path = str(pid_path) + ".state"
+        self.times: list[float] = []
+        self.values: list[list[float]] = []
+        self.converged_time: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, log_path: Optional[Union[str, Path]] = None) -> None:
+        """Starts watching the log file in a background thread. A new log_path (e.g. of the next segment of a run) keeps the history read so far"""
+        if log_path:
+            self.log_path = log_path
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the background thread once the engine has finished"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for path in (self.pid_path, self.state_path):
+            if Path(path).exists():
+                Path(path).unlink()
+
+    def slopes(self) -> Optional[np.ndarray]:
+        """Slopes of the criteria terms over the last window, None if the data does not cover the window yet"""
+        times = np.array(self.times)
+        if times.size < 3 or times[-1] - times[0] < self.window:
+            return None
+        last = times >= times[-1] - self.window
+        values = np.array(self.values)[last]
+        if np.isnan(values).any():
+            return None
+        return np.polyfit(times[last], values, 1)[0]
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            if not Path(self.log_path).exists():
+                continue
+            records, _ = follow_mdout(self.log_path, self.terms, self.state_path)
+            for index, values in records:
+                self.times.append(float(index))
+                self.values.append([np.nan if value == "-" else float(value) for value in values])
+            # Only the samples of the last window, and the one just before it, are needed
+            first = max(bisect.bisect_right(self.times, self.times[-1] - self.window) - 1, 0) if self.times else 0
+            del self.times[:first]
+            del self.values[:first]
+            slopes = self.slopes()
+            if slopes is None or (np.abs(slopes) > self.thresholds).any():
+                continue
+            self.converged_time = self.times[-1]
+            fu.log("Convergence criteria met at %s ps (slopes: %s), stopping the run" % (self.converged_time, ", ".join("%s %.3g" % pair for pair in zip(self.terms, slopes))), self.out_log)
+            if Path(self.pid_path).exists():
+                os.kill(int(Path(self.pid_path).read_text().split()[0]), signal.SIGTERM)
+            return
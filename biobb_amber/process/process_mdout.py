@@ -7,32 +7,48 @@ import shutil
 from pathlib import Path, PurePath
 from typing import Optional
 
-from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
 
 from biobb_amber.process.common import (
     _from_string_to_list,
+    append_columns,
     check_input_path,
     check_output_path,
+    compute_statistics,
+    follow_mdout,
+    is_array_file,
+    parse_mdout,
+    read_dat,
+    read_summaries,
+    records_to_arrays,
+    write_arrays,
+    write_dat,
+    write_statistics,
 )
+from biobb_amber.staging import StagingBiobbObject
 
 
-class ProcessMDOut(BiobbObject):
+class ProcessMDOut(StagingBiobbObject):
     """
     | biobb_amber.process.process_mdout ProcessMDOut
     | Wrapper of the `AmberTools (AMBER MD Package) process_mdout tool <https://ambermd.org/AmberTools.php>`_ module.
-    | Parses the AMBER (sander) md output file (log) and dumps statistics that can then be plotted. Using the process_mdout.pl tool from the AmberTools MD package.
+    | Parses the AMBER (sander) md output file (log) and dumps statistics that can then be plotted. Using a native streaming parser or the process_mdout.pl tool from the AmberTools MD package.
 
     Args:
-        input_log_path (str): AMBER (sander) MD output (log) file. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/process/sander.heat.log>`_. Accepted formats: log (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
-        output_dat_path (str): Dat output file containing data from the specified terms along the minimization process. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/process/sander.md.temp.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330), csv (edam:format_3752).
+        input_log_path (str): AMBER (sander) MD output (log) file. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/process/sander.heat.log>`_. Accepted formats: log (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330), mdinfo (edam:format_2330).
+        output_dat_path (str): Dat output file containing data from the specified terms along the minimization process. A npz (NumPy) or parquet (requires pyarrow) extension writes one column array per term plus the TIME index instead of text. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/process/sander.md.temp.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330), csv (edam:format_3752), npz (edam:format_4003), parquet (edam:format_2333).
+        output_stats_path (str) (Optional): Statistics of each term over the equilibrated part of the data: mean, standard deviation, block averaged standard error, integrated autocorrelation time (in samples), automatically detected equilibration time and number of (effective) samples. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/process/sander.md.stats.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330), csv (edam:format_3752), json (edam:format_3464).
         properties (dic - Python dictionary object containing the tool parameters, not input/output files):
             * **terms** (*list*) - (["ETOT"]) Statistics descriptors. Values: VOLUME, TSOLVENT, TSOLUTE, TEMP, PRES, ETOT, ESCF, EPTOT, EKTOT, EKCMT, DENSITY.
+            * **native** (*bool*) - (True) Parse the log file in a single pass with the built-in streaming parser instead of running process_mdout.perl. Binary and container properties are ignored when enabled.
+            * **follow** (*bool*) - (False) Monitor a running simulation: parse only the energy records appended to the log (or mdinfo) file since the previous call and add them to the output file. The byte offset reached is kept in a "<output_dat_path>.state" sidecar file and the values of the terms, for output_stats_path, in a "<output_dat_path>.columns" one. Requires native and a dat, txt or csv output: npz and parquet outputs cannot be appended to and are written from a full parse of the log.
+            * **stats_blocks** (*int*) - (10) [2~1000|1] Number of blocks used to compute the block averaged standard error of output_stats_path.
             * **binary_path** (*str*) - ("process_mdout.perl") Path to the process_mdout.perl executable binary.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
             * **container_path** (*str*) - (None) Container path definition.
             * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
             * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
@@ -49,6 +65,7 @@ class ProcessMDOut(BiobbObject):
             }
             process_mdout(input_log_path='/path/to/ambermd.log',
                           output_dat_path='/path/to/newFeature.dat',
+                          output_stats_path='/path/to/newStats.dat',
                           properties=prop)
 
     Info:
@@ -62,7 +79,7 @@ class ProcessMDOut(BiobbObject):
 
     """
 
-    def __init__(self, input_log_path: str, output_dat_path: str, properties, **kwargs):
+    def __init__(self, input_log_path: str, output_dat_path: str, output_stats_path: Optional[str] = None, properties: Optional[dict] = None, **kwargs):
         properties = properties or {}
 
         # Call parent class constructor
@@ -72,12 +89,15 @@ class ProcessMDOut(BiobbObject):
         # Input/Output files
         self.io_dict = {
             "in": {"input_log_path": input_log_path},
-            "out": {"output_dat_path": output_dat_path},
+            "out": {"output_dat_path": output_dat_path, "output_stats_path": output_stats_path},
         }
 
         # Properties specific for BB
         self.properties = properties
         self.terms = _from_string_to_list(properties.get("terms", ["ETOT"]))
+        self.native = properties.get("native", True)
+        self.follow = properties.get("follow", False)
+        self.stats_blocks = properties.get("stats_blocks", 10)
         self.binary_path = properties.get("binary_path", "process_mdout.perl")
 
         # Check the properties
@@ -104,6 +124,31 @@ class ProcessMDOut(BiobbObject):
             out_log,
             self.__class__.__name__,
         )
+        self.io_dict["out"]["output_stats_path"] = check_output_path(
+            self.io_dict["out"]["output_stats_path"],
+            "output_stats_path",
+            True,
+            out_log,
+            self.__class__.__name__,
+        )
+
+    def reduce_terms(self, arrays):
+        """Computes the statistics of the terms in the *arrays* columns and dumps them to output_stats_path"""
+        fu.log("Computing statistics of %d samples" % len(arrays["TIME"]), self.out_log)
+        write_statistics(compute_statistics(arrays, self.terms, "TIME", self.stats_blocks), self.io_dict["out"]["output_stats_path"])
+
+    def write_records(self, records):
+        """Writes the parsed *records* (a list or a stream of them) to output_dat_path and, if requested, their statistics
+        to output_stats_path. A dat output is written while the records are parsed and read back for the statistics"""
+        output_dat_path = self.io_dict["out"]["output_dat_path"]
+        if is_array_file(output_dat_path):
+            arrays = records_to_arrays(records, self.terms, "TIME")
+            write_arrays(arrays, output_dat_path)
+        else:
+            write_dat(records, self.terms, output_dat_path)
+            arrays = read_dat(output_dat_path, self.terms, "TIME") if self.io_dict["out"]["output_stats_path"] else None
+        if self.io_dict["out"]["output_stats_path"]:
+            self.reduce_terms(arrays)
 
     @launchlogger
     def launch(self):
@@ -115,6 +160,37 @@ class ProcessMDOut(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+
+        if self.native and self.follow and is_array_file(self.io_dict["out"]["output_dat_path"]):
+            fu.log("WARNING: follow is only supported with dat, txt and csv outputs, parsing the whole %s" % self.io_dict["in"]["input_log_path"], self.out_log, self.global_log)
+        elif self.native and self.follow:
+            # Only the bytes appended since the previous call are parsed, the offset is kept in a sidecar file
+            output_dat_path = self.io_dict["out"]["output_dat_path"]
+            state_path = str(output_dat_path) + ".state"
+            # Raw float64 rows of all the records followed, appended on each call, for the statistics
+            columns_path = str(output_dat_path) + ".columns"
+            if not Path(output_dat_path).exists() and Path(state_path).exists():
+                Path(state_path).unlink()
+            records, fresh = follow_mdout(self.io_dict["in"]["input_log_path"], self.terms, state_path)
+            fu.log("Following %s: %d new energy records" % (self.io_dict["in"]["input_log_path"], len(records)), self.out_log)
+            write_dat(records, self.terms, output_dat_path, append=not fresh)
+            if not fresh and not Path(columns_path).exists():
+                # Records followed before the columns file existed, read once from the dat file
+                arrays = append_columns(read_dat(output_dat_path, self.terms, "TIME"), columns_path, fresh=True)
+            else:
+                arrays = append_columns(records_to_arrays(records, self.terms, "TIME"), columns_path, fresh)
+            if self.io_dict["out"]["output_stats_path"]:
+                self.reduce_terms(arrays)
+            self.check_arguments(output_files_created=True, raise_exception=False)
+            return self.return_code
+
+        if self.native:
+            # Single pass over the log, no sandbox, temporary folder or summary.* files needed
+            fu.log("Parsing %s with the native mdout parser" % self.io_dict["in"]["input_log_path"], self.out_log)
+            self.write_records(parse_mdout(self.io_dict["in"]["input_log_path"], self.terms))
+            self.check_arguments(output_files_created=True, raise_exception=False)
+            return self.return_code
+
         self.stage_files()
 
         # is_docker = self.container_path and os.path.basename(str(self.container_path)).lower() == 'docker'
@@ -146,46 +222,18 @@ class ProcessMDOut(BiobbObject):
         # Copy files to host
         self.copy_to_host()
 
-        if len(self.terms) == 1:
-            if self.container_path:
-                shutil.copy(
-                    PurePath(self.stage_io_dict["unique_dir"]).joinpath(
-                        "summary." + self.terms[0]
-                    ),
-                    self.io_dict["out"]["output_dat_path"],
-                )
-            else:
-                shutil.copy(
-                    PurePath(str(tmp_folder)).joinpath("summary." + self.terms[0]),
-                    self.io_dict["out"]["output_dat_path"],
-                )
+        if self.container_path:
+            tmp = self.stage_io_dict["unique_dir"]
         else:
-            if self.container_path:
-                tmp = self.stage_io_dict["unique_dir"]
-            else:
-                tmp = tmp_folder
-
-            ene_dict = {}
-            for term in self.terms:
-                with open(str(tmp) + "/summary." + term) as fp:
-                    for line in fp:
-                        x = line.split()
-                        if x:
-                            if len(x) > 1:
-                                ene_dict.setdefault(float(x[0]), {})[term] = x[1]
-                            else:
-                                ene_dict.setdefault(float(x[0]), {})[term] = "-"
-
-            with open(self.io_dict["out"]["output_dat_path"], "w") as fp_out:
-                fp_out.write("# TIME ")
-                for term in self.terms:
-                    fp_out.write(term + " ")
-                fp_out.write("\n")
-                for key in sorted(ene_dict.keys()):
-                    fp_out.write(str(key) + " ")
-                    for term in self.terms:
-                        fp_out.write(ene_dict[key][term] + " ")
-                    fp_out.write("\n")
+            tmp = tmp_folder
+
+        output_dat_path = self.io_dict["out"]["output_dat_path"]
+        if len(self.terms) == 1 and not is_array_file(output_dat_path):
+            shutil.copy(PurePath(str(tmp)).joinpath("summary." + self.terms[0]), output_dat_path)
+            if self.io_dict["out"]["output_stats_path"]:
+                self.reduce_terms(records_to_arrays(read_summaries(tmp, self.terms), self.terms, "TIME"))
+        else:
+            self.write_records(read_summaries(tmp, self.terms))
 
         # remove temporary folder(s)
         self.tmp_files.extend([
@@ -202,6 +250,7 @@ class ProcessMDOut(BiobbObject):
 def process_mdout(
     input_log_path: str,
     output_dat_path: str,
+    output_stats_path: Optional[str] = None,
     properties: Optional[dict] = None,
     **kwargs,
 ) -> int:
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""Module containing the ProcessMDOutBatch class and the command line interface."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from biobb_common.generic.biobb_object import BiobbObject
+from biobb_common.tools import file_utils as fu
+from biobb_common.tools.file_utils import launchlogger
+
+from biobb_amber.process.common import (
+    _from_string_to_list,
+    check_input_path,
+    check_output_path,
+    expand_log_paths,
+    is_array_file,
+    read_mdout,
+    records_to_arrays,
+    write_arrays,
+)
+
+
+class ProcessMDOutBatch(BiobbObject):
+    """
+    | biobb_amber.process.process_mdout_batch ProcessMDOutBatch
+    | Parses a batch of AMBER (sander/pmemd) md output files (logs) in parallel.
+    | Parses several AMBER (sander/pmemd) md output files (logs) on a pool of worker processes with the native streaming parser of ProcessMDOut, and dumps the statistics of all of them in a single table keyed by log and time.
+
+    Args:
+        input_logs_path (str): AMBER (sander/pmemd) MD output (log) files: a glob pattern (e.g. "replica_*/md.log"), a list of paths (Python API only) or a zip file containing the logs. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/process/sander.heat.batch.zip>`_. Accepted formats: log (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330), mdinfo (edam:format_2330), zip (edam:format_3987).
+        output_dat_path (str): Dat output file with the LOG (path relative to the common folder of the logs) and TIME columns followed by the specified terms. A npz (NumPy) or parquet (requires pyarrow) extension writes one column array per column instead of text. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/process/sander.md.batch.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330), csv (edam:format_3752), npz (edam:format_4003), parquet (edam:format_2333).
+        properties (dic - Python dictionary object containing the tool parameters, not input/output files):
+            * **terms** (*list*) - (["ETOT"]) Statistics descriptors. Values: VOLUME, TSOLVENT, TSOLUTE, TEMP, PRES, ETOT, ESCF, EPTOT, EKTOT, EKCMT, DENSITY.
+            * **num_workers** (*int*) - (0) [0~1000|1] Number of worker processes parsing the logs. 0 uses all the CPU cores of the node.
+            * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
+            * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
+            * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+
+    Examples:
+        This is a use example of how to use the building block from Python::
+
+            from biobb_amber.process.process_mdout_batch import process_mdout_batch
+            prop = {
+                'terms' : ['TEMP','VOLUME','DENSITY'],
+                'num_workers' : 16
+            }
+            process_mdout_batch(input_logs_path='/path/to/replica_*/ambermd.log',
+                                output_dat_path='/path/to/newFeature.npz',
+                                properties=prop)
+
+    Info:
+        * ontology:
+            * name: EDAM
+            * schema: http://edamontology.org/EDAM.owl
+
+    """
+
+    def __init__(self, input_logs_path: Union[str, list[str]], output_dat_path: str, properties: Optional[dict] = None, **kwargs):
+        properties = properties or {}
+
+        # Call parent class constructor
+        super().__init__(properties)
+        self.locals_var_dict = locals().copy()
+
+        # Input/Output files
+        self.io_dict = {
+            "in": {"input_logs_path": expand_log_paths(input_logs_path)},
+            "out": {"output_dat_path": output_dat_path},
+        }
+        # The generic argument checks expect a single path
+        if self.io_dict["in"]["input_logs_path"]:
+            self.locals_var_dict["input_logs_path"] = self.io_dict["in"]["input_logs_path"][0]
+
+        # Properties specific for BB
+        self.properties = properties
+        self.terms = _from_string_to_list(properties.get("terms", ["ETOT"]))
+        self.num_workers = properties.get("num_workers", 0)
+
+        # Check the properties
+        self.check_properties(properties)
+        # A pattern matching no log is reported by check_data_params
+        self.check_arguments(raise_exception=bool(self.io_dict["in"]["input_logs_path"]))
+
+    def check_data_params(self, out_log, err_log):
+        """Checks input/output paths correctness"""
+
+        # Check input(s)
+        if not self.io_dict["in"]["input_logs_path"]:
+            fu.log(self.__class__.__name__ + ": No log file matches input_logs_path %s, exiting" % self.locals_var_dict["input_logs_path"], out_log)
+            raise SystemExit(self.__class__.__name__ + ": No log file matches input_logs_path %s" % self.locals_var_dict["input_logs_path"])
+        self.io_dict["in"]["input_logs_path"] = [
+            check_input_path(
+                path,
+                "input_logs_path",
+                False,
+                out_log,
+                self.__class__.__name__,
+            ) for path in self.io_dict["in"]["input_logs_path"]
+        ]
+
+        # Check output(s)
+        self.io_dict["out"]["output_dat_path"] = check_output_path(
+            self.io_dict["out"]["output_dat_path"],
+            "output_dat_path",
+            False,
+            out_log,
+            self.__class__.__name__,
+        )
+
+    @launchlogger
+    def launch(self):
+        """Launches the execution of the ProcessMDOutBatch module."""
+
+        # check input/output paths and parameters
+        self.check_data_params(self.out_log, self.err_log)
+
+        # Setup Biobb
+        if self.check_restart():
+            return 0
+
+        log_paths = self.io_dict["in"]["input_logs_path"]
+        if len(log_paths) == 1 and log_paths[0].endswith(".zip"):
+            tmp_folder = fu.create_unique_dir()
+            fu.log("Creating %s temporary folder" % tmp_folder, self.out_log)
+            log_paths = sorted(path for path in fu.unzip_list(log_paths[0], tmp_folder, self.out_log) if Path(path).is_file())
+            self.tmp_files.append(tmp_folder)
+
+        # Logs are labelled by their path relative to the deepest folder containing all of them
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in log_paths])
+        labels = [os.path.relpath(os.path.abspath(path), root) for path in log_paths]
+
+        num_workers = min(self.num_workers or os.cpu_count() or 1, len(log_paths))
+        fu.log("Parsing %d log files with %d worker processes" % (len(log_paths), num_workers), self.out_log)
+        if num_workers > 1:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                chunksize = max(1, len(log_paths) // (4 * num_workers))
+                results = list(executor.map(partial(read_mdout, terms=self.terms), log_paths, chunksize=chunksize))
+        else:
+            results = [read_mdout(path, self.terms) for path in log_paths]
+
+        output_dat_path = self.io_dict["out"]["output_dat_path"]
+        if is_array_file(output_dat_path):
+            arrays = {"LOG": np.array([label for label, records in zip(labels, results) for _ in records], dtype=str)}
+            arrays.update(records_to_arrays([record for records in results for record in records], self.terms, "TIME"))
+            write_arrays(arrays, output_dat_path)
+        else:
+            with open(output_dat_path, "w") as fp_out:
+                fp_out.write("# LOG TIME " + "".join(term + " " for term in self.terms) + "\n")
+                for label, records in zip(labels, results):
+                    fp_out.writelines(
+                        label + " " + str(float(index)) + " " + "".join(value + " " for value in values) + "\n"
+                        for index, values in records
+                    )
+
+        # remove temporary folder(s)
+        self.remove_tmp_files()
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+
+def process_mdout_batch(
+    input_logs_path: Union[str, list[str]],
+    output_dat_path: str,
+    properties: Optional[dict] = None,
+    **kwargs,
+) -> int:
+    """Create :class:`ProcessMDOutBatch <process.process_mdout_batch.ProcessMDOutBatch>`process.process_mdout_batch.ProcessMDOutBatch class and
+    execute :meth:`launch() <process.process_mdout_batch.ProcessMDOutBatch.launch>` method"""
+    return ProcessMDOutBatch(**dict(locals())).launch()
+
+
+process_mdout_batch.__doc__ = ProcessMDOutBatch.__doc__
+
+main = ProcessMDOutBatch.get_main(process_mdout_batch, "Parses a batch of AMBER (sander/pmemd) MD output files (logs) in parallel and dumps their statistics in a single table keyed by log and time.")
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,6 @@ import shutil
 from pathlib import Path, PurePath
 from typing import Optional
 
-from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
 
@@ -15,24 +14,33 @@ from biobb_amber.process.common import (
     _from_string_to_list,
     check_input_path,
     check_output_path,
+    is_array_file,
+    parse_minout,
+    read_summaries,
+    records_to_arrays,
+    write_arrays,
+    write_dat,
 )
+from biobb_amber.staging import StagingBiobbObject
 
 
-class ProcessMinOut(BiobbObject):
+class ProcessMinOut(StagingBiobbObject):
     """
     | biobb_amber.process.process_minout ProcessMinOut
     | Wrapper of the `AmberTools (AMBER MD Package) process_minout tool <https://ambermd.org/AmberTools.php>`_ module.
-    | Parses the AMBER (sander) minimization output file (log) and dumps statistics that can then be plotted. Using the process_minout.pl tool from the AmberTools MD package.
+    | Parses the AMBER (sander) minimization output file (log) and dumps statistics that can then be plotted. Using a native memory-mapped parser or the process_minout.pl tool from the AmberTools MD package.
 
     Args:
-        input_log_path (str): AMBER (sander) Minimization output (log) file. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/process/sander.min.log>`_. Accepted formats: log (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
-        output_dat_path (str): Dat output file containing data from the specified terms along the minimization process. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/process/sander.min.energy.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330), csv (edam:format_3752).
+        input_log_path (str): AMBER (sander) Minimization output (log) file. File type: input. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/data/process/sander.min.log>`_. Accepted formats: log (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330), mdinfo (edam:format_2330).
+        output_dat_path (str): Dat output file containing data from the specified terms along the minimization process. A npz (NumPy) or parquet (requires pyarrow) extension writes one column array per term plus the NSTEP index instead of text. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/process/sander.min.energy.dat>`_. Accepted formats: dat (edam:format_1637), txt (edam:format_2330), csv (edam:format_3752), npz (edam:format_4003), parquet (edam:format_2333).
         properties (dic - Python dictionary object containing the tool parameters, not input/output files):
             * **terms** (*list*) - (["ENERGY"]) Statistics descriptors. Values: ANGLE, BOND, DIHEDRAL, EEL, EEL14, ENERGY, GMAX, HBOND, NAME, NSTEP, NUMBER, RESTRAINT, RMS, VDW14, VDWAALS.
+            * **native** (*bool*) - (True) Scan the memory-mapped log file with the built-in parser instead of running process_minout.perl. Binary and container properties are ignored when enabled.
             * **binary_path** (*str*) - ("process_minout.perl") Path to the process_minout.perl executable binary.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
             * **container_path** (*str*) - (None) Container path definition.
             * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
             * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
@@ -78,6 +86,7 @@ class ProcessMinOut(BiobbObject):
         # Properties specific for BB
         self.properties = properties
         self.terms = _from_string_to_list(properties.get("terms", ["ENERGY"]))
+        self.native = properties.get("native", True)
         self.binary_path = properties.get("binary_path", "process_minout.perl")
 
         # Check the properties
@@ -115,6 +124,18 @@ class ProcessMinOut(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+
+        if self.native:
+            # Regex scan of the memory-mapped log, no sandbox, temporary folder or summary.* files needed
+            fu.log("Parsing %s with the native minout parser" % self.io_dict["in"]["input_log_path"], self.out_log)
+            records = parse_minout(self.io_dict["in"]["input_log_path"], self.terms)
+            if is_array_file(self.io_dict["out"]["output_dat_path"]):
+                write_arrays(records_to_arrays(records, self.terms, "NSTEP"), self.io_dict["out"]["output_dat_path"])
+            else:
+                write_dat(records, self.terms, self.io_dict["out"]["output_dat_path"], separator="  ")
+            self.check_arguments(output_files_created=True, raise_exception=False)
+            return self.return_code
+
         self.stage_files()
 
         # is_docker = self.container_path and os.path.basename(str(self.container_path)).lower() == 'docker'
@@ -146,46 +167,18 @@ class ProcessMinOut(BiobbObject):
         # Copy files to host
         self.copy_to_host()
 
-        if len(self.terms) == 1:
-            if self.container_path:
-                shutil.copy(
-                    PurePath(self.stage_io_dict["unique_dir"]).joinpath(
-                        "summary." + self.terms[0]
-                    ),
-                    self.io_dict["out"]["output_dat_path"],
-                )
-            else:
-                shutil.copy(
-                    PurePath(str(tmp_folder)).joinpath("summary." + self.terms[0]),
-                    self.io_dict["out"]["output_dat_path"],
-                )
+        if self.container_path:
+            tmp = self.stage_io_dict["unique_dir"]
         else:
-            if self.container_path:
-                tmp = self.stage_io_dict["unique_dir"]
-            else:
-                tmp = tmp_folder
-
-            ene_dict = {}
-            for term in self.terms:
-                with open(str(tmp) + "/summary." + term) as fp:
-                    for line in fp:
-                        x = line.split()
-                        if x:
-                            if len(x) > 1:
-                                ene_dict.setdefault(float(x[0]), {})[term] = x[1]
-                            else:
-                                ene_dict.setdefault(float(x[0]), {})[term] = "-"
-
-            with open(self.io_dict["out"]["output_dat_path"], "w") as fp_out:
-                fp_out.write("# TIME ")
-                for term in self.terms:
-                    fp_out.write(term + " ")
-                fp_out.write("\n")
-                for key in sorted(ene_dict.keys()):
-                    fp_out.write(str(key) + " ")
-                    for term in self.terms:
-                        fp_out.write(ene_dict[key][term] + " ")
-                    fp_out.write("\n")
+            tmp = tmp_folder
+
+        output_dat_path = self.io_dict["out"]["output_dat_path"]
+        if is_array_file(output_dat_path):
+            write_arrays(records_to_arrays(read_summaries(tmp, self.terms), self.terms, "NSTEP"), output_dat_path)
+        elif len(self.terms) == 1:
+            shutil.copy(PurePath(str(tmp)).joinpath("summary." + self.terms[0]), output_dat_path)
+        else:
+            write_dat(read_summaries(tmp, self.terms), self.terms, output_dat_path)
 
         # remove temporary folder(s)
         self.tmp_files.extend([
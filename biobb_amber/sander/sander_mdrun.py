@@ -3,15 +3,17 @@
 """Module containing the SanderMDRun class and the command line interface."""
 from typing import Optional
 import shutil
-import re
 from pathlib import Path, PurePath
-from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools import file_utils as fu
 from biobb_common.tools.file_utils import launchlogger
 from biobb_amber.sander.common import check_input_path, check_output_path
+from biobb_amber.pmemd.common import REMD_TYPES, engine_arguments, engine_cmd, multigroup_cmd, remlog_path, replica_inputs, replica_path, stopped_run_return_code, write_groupfile, write_mdin
+from biobb_amber.process.common import ConvergenceMonitor
+from biobb_amber.leap.prmtop import CPH_RESIDUES, check_coordinates
+from biobb_amber.staging import StagingBiobbObject, stage_file
 
 
-class SanderMDRun(BiobbObject):
+class SanderMDRun(StagingBiobbObject):
     """
     | biobb_amber SanderMDRun
     | Wrapper of the `AmberTools (AMBER MD Package) sander tool <https://ambermd.org/AmberTools.php>`_ module.
@@ -30,16 +32,23 @@ class SanderMDRun(BiobbObject):
         output_cprst_path (str) (Optional): Output constant pH restart file (AMBER rstout). File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/sander/sander.cprst>`_. Accepted formats: cprst (edam:format_3886), rst (edam:format_3886), rst7 (edam:format_3886).
         output_mdinfo_path (str) (Optional): Output MD info. File type: output. `Sample file <https://github.com/bioexcel/biobb_amber/raw/master/biobb_amber/test/reference/sander/sander.mdinfo>`_. Accepted formats: mdinfo (edam:format_2330).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
-            * **mdin** (*dict*) - ({}) Sander MD run options specification. (Used if *input_mdin_path* is None)
+            * **mdin** (*dict*) - ({}) Sander MD run options specification. (Used if *input_mdin_path* is None) Options of other namelist groups are set with a group prefix, e.g. {"ewald.skinnb": 2.0}.
             * **simulation_type** (*str*) - ("minimization") Default options for the mdin file. Each creates a different mdin file. Values: `minimization <https://biobb-amber.readthedocs.io/en/latest/_static/mdins/min.mdin>`_ (Runs an energy minimization), `min_vacuo <https://biobb-amber.readthedocs.io/en/latest/_static/mdins/min_vacuo.mdin>`_ (Runs an energy minimization in vacuo), `NVT <https://biobb-amber.readthedocs.io/en/latest/_static/mdins/nvt.mdin>`_ (Runs an NVT equilibration), `npt <https://biobb-amber.readthedocs.io/en/latest/_static/mdins/npt.mdin>`_ (Runs an NPT equilibration), `free <https://biobb-amber.readthedocs.io/en/latest/_static/mdins/free.mdin>`_ (Runs a MD simulation), `heat <https://biobb-amber.readthedocs.io/en/latest/_static/mdins/heat.mdin>`_ (Heats the MD system).
             * **binary_path** (*str*) - ("sander") sander binary path to be used.
+            * **prmtop_cache_path** (*str*) - (None) Folder where the %FLAG section offsets of input_top_path are stored and reused while the topology does not change, so the next blocks reading it do not scan it again.
             * **direct_mdin** (*bool*) - (False) Use input_mdin_path as it is, skip file parsing.
+            * **convergence** (*dict*) - ({}) Stop the run once converged. Maximum absolute slope (units of the term per ps) of a linear fit over the last convergence_window ps, keyed by process_mdout term, e.g. {"DENSITY": 0.0001, "ETOT": 1.0}. The output log (or output_mdinfo_path if set) is read while the engine runs, and once all the criteria are met the engine is terminated, keeping the restart file written last. Not available with containers.
+            * **convergence_window** (*float*) - (20.0) Length in ps of the time window fitted by the convergence criteria.
+            * **convergence_interval** (*float*) - (30.0) Seconds between two checks of the convergence criteria.
+            * **replicas** (*list*) - ([]) MD run options specific to each replica of a multi-group run, one dictionary per replica, e.g. [{"temp0": 300.0}, {"temp0": 310.0}]. If set, a single MPI launch of *binary_path* (e.g. "sander.MPI") runs one group per replica from a generated groupfile (-ng/-groupfile). Replica 1 writes the output paths and replica N the <stem>.<NNN><suffix> files next to them. The <stem>.<NNN><suffix> files next to input_crd_path and input_cpin_path (e.g. the restarts of a previous multi-group run) are used by their replica if they exist. Requires *mpi_bin*.
+            * **remd_type** (*str*) - (None) Exchange the replicas of a multi-group run (-rem). The exchange log is written next to the output log as <stem>.remlog, and the number of exchanges is set by numexchg in *mdin*. Values: temperature (Temperature REMD, set temp0 in each replica), hamiltonian (Hamiltonian REMD), ph (pH REMD, set solvph in each replica), redox (Redox potential REMD, set solve in each replica).
             * **mpi_bin** (*str*) - (None) Path to the MPI runner. Usually "mpirun" or "srun".
             * **mpi_np** (*int*) - (0) [0~1000|1] Number of MPI processes. Usually an integer bigger than 1.
             * **mpi_flags** (*str*) - (None) Path to the MPI hostlist file.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+            * **staging** (*str*) - ("copy") [WF property] Strategy used to stage the input files in the sandbox and the output files back, falling back to a copy when source and destination are on different filesystems or the filesystem does not support it. Values: copy (Copy the files), hardlink (Hard link the files, the inputs are not modified by the block), reflink (Copy-on-write clone of the files on filesystems supporting it like Btrfs or XFS), symlink (Symbolic link to the input files and move the output files back to the host), move (Hard link the input files and move the output files back to the host).
             * **container_path** (*str*) - (None) Container path definition.
             * **container_image** (*str*) - ('afandiadib/ambertools:serial') Container image definition.
             * **container_volume_path** (*str*) - ('/tmp') Container volume path definition.
@@ -105,12 +114,19 @@ class SanderMDRun(BiobbObject):
         self.properties = properties
         self.simulation_type = properties.get('simulation_type', "minimization")
         self.binary_path = properties.get('binary_path', "sander")
+        self.prmtop_cache_path = properties.get("prmtop_cache_path", None)
 
         self.direct_mdin = properties.get('direct_mdin', False)
         self.mdin = {k: str(v) for k, v in properties.get('mdin', dict()).items()}
 
-        if 'restraintmask' in self.mdin and self.mdin['restraintmask'][0] != '"' and self.mdin['restraintmask'][-1] != '"':
-            self.mdin['restraintmask'] = "\"" + self.mdin['restraintmask'] + "\""
+        # Properties for the convergence monitor
+        self.convergence = properties.get('convergence', dict())
+        self.convergence_window = properties.get('convergence_window', 20.0)
+        self.convergence_interval = properties.get('convergence_interval', 30.0)
+
+        # Properties for multi-group runs
+        self.replicas = [{k: str(v) for k, v in replica.items()} for replica in properties.get('replicas', list())]
+        self.remd_type = properties.get('remd_type')
 
         # Properties for MPI
         self.mpi_bin = properties.get('mpi_bin')
@@ -141,157 +157,63 @@ class SanderMDRun(BiobbObject):
 
     def create_mdin(self, path: Optional[str] = None) -> str:
         """Creates an AMBER MD configuration file (mdin) using the properties file settings"""
-        mdin_list = []
-        mdin_firstPart = []
-        mdin_middlePart = []
-        mdin_lastPart = []
-
-        self.output_mdin_path = path
-
-        if self.io_dict['in']['input_mdin_path']:
-            # MDIN parameters read from an input mdin file
-            if (not self.direct_mdin):
-                mdin_firstPart.append("Mdin read from input file: " + self.stage_io_dict['in']['input_mdin_path'])
-                mdin_firstPart.append("and modified by the biobb_amber module from the BioBB library ")
-                with open(self.stage_io_dict['in']['input_mdin_path']) as input_params:
-                    firstPart = True
-                    secondPart = False
-                    for line in input_params:
-                        if '=' in line and not secondPart:
-                            firstPart = False
-                            mdin_middlePart.append(line.rstrip())
-                        else:
-                            if (firstPart):
-                                mdin_firstPart.append(line.rstrip())
-                            elif (secondPart):
-                                mdin_lastPart.append(line.rstrip())
-                            else:
-                                secondPart = True
-                                mdin_lastPart.append(line.rstrip())
-
-                for line in mdin_middlePart:
-                    if ('!' in line or '#' in line) and not ('!@' in line or '!:' in line):
-                        # Parsing lines with comments (#,!), e.g. :
-                        # ntc=2, ntf=2, ! SHAKE, constrain lenghts of the bonds having H
-                        params = re.split('!|#', line)
-                        for param in params[0].split(','):
-                            if param.strip():
-                                mdin_list.append("  " + param.strip() + " ! " + params[1])
-                    elif ('@' in line or ':' in line):
-                        # Parsing masks, e.g. :
-                        # restraintmask = ":1-40@P,O5',C5',C4',C3',O3'", restraint_wt = 0.5
-                        mylist = re.findall(r'(?:[^,"]|"(?:\\.|[^"])*")+', line)
-                        [mdin_list.append("  " + i.lstrip()) for i in mylist]  # type: ignore
-                    else:
-                        for param in line.split(','):
-                            if param.strip():
-                                if not param.strip().startswith('!'):
-                                    mdin_list.append("  " + param.strip())
-
-        else:
-            # MDIN parameters added by the biobb_amber module
-            mdin_list.append("This mdin file has been created by the biobb_amber module from the BioBB library ")
-
-            sim_type = self.properties.get('simulation_type', 'minimization')
-            # sim_type = self.mdin.get('simulation_type', 'minimization')
-            minimization = (sim_type == 'minimization')
-            min_vacuo = (sim_type == 'min_vacuo')
-            heat = (sim_type == 'heat')
-            nvt = (sim_type == 'nvt')
-            npt = (sim_type == 'npt')
-            free = (sim_type == 'free')
-            md = (nvt or npt or free or heat)
-
-            mdin_list.append("Type of mdin: " + sim_type)
-            mdin_list.append("&cntrl")
-
-            # Pre-configured simulation type parameters
-            if minimization:
-                mdin_list.append("  imin = 1 ! BioBB simulation_type minimization")
-            if min_vacuo:
-                mdin_list.append("  imin = 1 ! BioBB simulation_type min_vacuo")
-                mdin_list.append("  ncyc = 250 ! BioBB simulation_type min_vacuo")
-                mdin_list.append("  ntb = 0 ! BioBB simulation_type min_vacuo")
-                mdin_list.append("  igb = 0 ! BioBB simulation_type min_vacuo")
-                mdin_list.append("  cut = 12 ! BioBB simulation_type min_vacuo")
-            if md:
-                mdin_list.append("  imin = 0 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  cut = 10.0 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ntr = 0 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ntc = 2 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ntf = 2 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ntt = 3 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ig = -1 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  ioutfm = 1 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  iwrap = 1 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  nstlim = 5000 ! BioBB simulation_type nvt|npt|free|heat")
-                mdin_list.append("  dt = 0.002 ! BioBB simulation_type nvt|npt|free|heat")
-            if npt:
-                mdin_list.append("  irest = 1 ! BioBB simulation_type npt")
-                mdin_list.append("  gamma_ln = 5.0 ! BioBB simulation_type npt")
-                mdin_list.append("  pres0 = 1.0 ! BioBB simulation_type npt")
-                mdin_list.append("  ntp = 1 ! BioBB simulation_type npt")
-                mdin_list.append("  taup = 2.0 ! BioBB simulation_type npt")
-                mdin_list.append("  ntx = 5 ! BioBB simulation_type npt")
-            if nvt:
-                mdin_list.append("  irest = 1 ! BioBB simulation_type nvt")
-                mdin_list.append("  gamma_ln = 5.0 ! BioBB simulation_type nvt")
-                mdin_list.append("  ntb = 1 ! BioBB simulation_type nvt")
-                mdin_list.append("  ntx = 5 ! BioBB simulation_type nvt")
-            if heat:
-                mdin_list.append("  tempi = 0.0 ! BioBB simulation_type heat")
-                mdin_list.append("  temp0 = 300.0 ! BioBB simulation_type heat")
-                mdin_list.append("  irest = 0 ! BioBB simulation_type heat")
-                mdin_list.append("  ntb = 1 ! BioBB simulation_type heat")  # periodic boundaries
-                mdin_list.append("  gamma_ln = 1.0 ! BioBB simulation_type heat")
-                # mdin_list.append("  nmropt = 1 ! BioBB simulation_type heat")
-
-                # mdin_lastPart.append("/")
-                # mdin_lastPart.append("&wt")
-                # mdin_lastPart.append(" TYPE = 'TEMP0' ! BioBB simulation_type heat")
-                # mdin_lastPart.append(" ISTEP1 = 1 ! BioBB simulation_type heat")
-                # mdin_lastPart.append(" ISTEP2 = 4000 ! BioBB simulation_type heat")
-                # mdin_lastPart.append(" VALUE1 = 10.0 ! BioBB simulation_type heat")
-                # mdin_lastPart.append(" VALUE2 = 300.0 ! BioBB simulation_type heat")
-                # mdin_lastPart.append("/")
-                # mdin_lastPart.append("&wt")
-                # mdin_lastPart.append(" TYPE = 'END' ! BioBB simulation_type heat")
-                # mdin_lastPart.append("/")
-
-        if (not self.direct_mdin):
-
-            # Adding the rest of parameters in the config file to the mdin file
-            # if the parameter has already been added replace the value
-            parameter_keys = [parameter.split('=')[0].strip() for parameter in mdin_list]
-            for k, v in self.mdin.items():
-                config_parameter_key = str(k).strip()
-                if config_parameter_key in parameter_keys:
-                    mdin_list[parameter_keys.index(config_parameter_key)] = '  ' + config_parameter_key + ' = ' + str(v) + ' ! BioBB property'
-                else:
-                    mdin_list.append('  ' + config_parameter_key + ' = '+str(v) + ' ! BioBB property')
-
-            # Writing MD configuration file (mdin)
-            with open(str(self.output_mdin_path), 'w') as mdin:
-                # Start of file keyword(s)
-                if mdin_firstPart:
-                    for line in mdin_firstPart:
-                        mdin.write(line + '\n')
-
-                # MD config parameters
-                for line in mdin_list:
-                    mdin.write(line + '\n')
-
-                # End of file keyword(s)
-                if mdin_lastPart:
-                    for line in mdin_lastPart:
-                        mdin.write(line + '\n')
-                else:
-                    mdin.write("&end\n")
+        if self.io_dict['in']['input_mdin_path'] and self.direct_mdin:
+            # Copying the input mdin file to the final file name
+            shutil.copy2(self.io_dict['in']['input_mdin_path'], str(path))
+            self.output_mdin_path = str(path)
         else:
-            # Copying generated output file to the final (user-given) file name
-            shutil.copy2(self.io_dict['in']['input_mdin_path'], str(self.output_mdin_path))
+            input_mdin_path = self.stage_io_dict['in']['input_mdin_path'] if self.io_dict['in']['input_mdin_path'] else None
+            self.output_mdin_path = write_mdin(str(path), self.simulation_type, self.mdin, input_mdin_path)
+        return self.output_mdin_path
+
+    def engine_path(self, name: str) -> str:
+        """Path of a file of the sandbox as seen by sander"""
+        return str(PurePath(self.stage_io_dict['in']['input_top_path']).with_name(name))
+
+    def run_groupfile(self) -> None:
+        """Runs one group per replica in a single MPI launch (-ng/-groupfile), exchanging them if remd_type is set"""
+        if not self.mpi_bin:
+            fu.log('replicas property needs an MPI runner (mpi_bin) and binary (e.g. sander.MPI), exiting', self.out_log, self.global_log)
+            raise SystemExit(self.__class__.__name__ + ': replicas property needs mpi_bin')
+        if self.remd_type and self.remd_type not in REMD_TYPES:
+            fu.log('remd_type %s is not one of %s, exiting' % (self.remd_type, ', '.join(REMD_TYPES)), self.out_log, self.global_log)
+            raise SystemExit(self.__class__.__name__ + ': Unknown remd_type %s' % self.remd_type)
+        if self.convergence:
+            fu.log('WARNING: convergence property is not available with replicas, running the whole simulation', self.out_log, self.global_log)
+
+        unique_dir = Path(self.stage_io_dict['unique_dir'])
+        mdin = self.mdin
+        arguments = []
+        for replica, host_paths in enumerate(replica_inputs(self.io_dict['in'], len(self.replicas)), start=1):
+            paths = dict(self.stage_io_dict['in'])
+            for key in ('input_crd_path', 'input_cpin_path'):
+                # Replica specific inputs are staged too
+                if host_paths[key] != self.io_dict['in'][key]:
+                    stage_file(host_paths[key], str(unique_dir.joinpath(PurePath(host_paths[key]).name)), self.input_staging(), self.out_log)
+                    paths[key] = self.engine_path(PurePath(host_paths[key]).name)
+            self.mdin = dict(mdin, **self.replicas[replica - 1])
+            mdin_path = self.create_mdin(path=str(unique_dir.joinpath("sander.%03d.mdin" % replica)))
+            paths.update({key: replica_path(path, replica) for key, path in self.stage_io_dict['out'].items()})
+            arguments.append(engine_arguments(self.engine_path(PurePath(mdin_path).name), paths))
+        self.mdin = mdin
+
+        groupfile_path = write_groupfile(unique_dir.joinpath("sander.groupfile"), arguments)
+        fu.log('Running %d replicas from groupfile %s' % (len(self.replicas), groupfile_path), self.out_log)
+        self.cmd = multigroup_cmd(self.mpi_bin, self.mpi_np, self.mpi_flags, self.binary_path, len(self.replicas), self.engine_path(PurePath(groupfile_path).name),
+                                  self.remd_type, remlog_path(self.stage_io_dict['out']['output_log_path']))
+
+        # Run Biobb block
+        self.run_biobb()
 
-        return str(self.output_mdin_path)
+        # Copy the files of the other replicas and the exchange log to host (replica 1 is copied by copy_to_host)
+        host_paths = [(replica_path(path, replica), replica_path(self.io_dict['out'][key], replica))
+                      for key, path in self.stage_io_dict['out'].items() for replica in range(2, len(self.replicas) + 1)]
+        if self.remd_type:
+            host_paths.append((remlog_path(self.stage_io_dict['out']['output_log_path']), remlog_path(self.io_dict['out']['output_log_path'])))
+        for stage_path, host_path in host_paths:
+            sandbox_file_path = unique_dir.joinpath(PurePath(str(stage_path)).name)
+            if sandbox_file_path.exists() and not (Path(str(host_path)).exists() and sandbox_file_path.samefile(str(host_path))):
+                stage_file(str(sandbox_file_path), str(host_path), self.output_staging(), self.out_log)
 
     @launchlogger
     def launch(self):
@@ -303,6 +225,12 @@ class SanderMDRun(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+
+        # Topology and coordinates consistency, read from the lazy prmtop index without running parmed
+        prmtop = check_coordinates(self.io_dict['in']['input_top_path'], self.io_dict['in']['input_crd_path'], self.out_log, self.global_log, self.prmtop_cache_path)
+        natom = prmtop.natom if prmtop else None
+        if prmtop and self.io_dict['in'].get('input_cpin_path') and not prmtop.is_cph:
+            fu.log('WARNING: input_cpin_path set but no constant pH titratable residues (%s) found in %s' % (', '.join(CPH_RESIDUES), self.io_dict['in']['input_top_path']), self.out_log, self.global_log)
         self.stage_files()
 
         # Creating temporary folder
@@ -327,50 +255,35 @@ class SanderMDRun(BiobbObject):
             fu.log('Creating %s temporary folder' % tmp_folder, self.out_log)
             self.output_mdin_path = self.create_mdin(path=str(Path(tmp_folder).joinpath("sander.mdin")))
 
-        # Command line
-        # sander -O -i mdin/min.mdin -p $1.cpH.prmtop -c ph$i/$1.inpcrd -r ph$i/$1.min.rst7 -o ph$i/$1.min.o
-        self.cmd = [self.binary_path,
-                    '-O',
-                    '-i', self.output_mdin_path,
-                    '-p', self.stage_io_dict['in']['input_top_path'],
-                    '-c', self.stage_io_dict['in']['input_crd_path'],
-                    '-r', self.stage_io_dict['out']['output_rst_path'],
-                    '-o', self.stage_io_dict['out']['output_log_path'],
-                    '-x', self.stage_io_dict['out']['output_traj_path']
-                    ]
-
-        if self.io_dict['in']['input_ref_path']:
-            self.cmd.append('-ref')
-            self.cmd.append(self.stage_io_dict['in']['input_ref_path'])
-
-        if self.io_dict['in']['input_cpin_path']:
-            self.cmd.append('-cpin')
-            self.cmd.append(self.stage_io_dict['in']['input_cpin_path'])
-
-        if self.io_dict['out']['output_mdinfo_path']:
-            self.cmd.append('-inf')
-            self.cmd.append(self.stage_io_dict['out']['output_mdinfo_path'])
-
-        if self.io_dict['out']['output_cpout_path']:
-            self.cmd.append('-cpout')
-            self.cmd.append(self.stage_io_dict['out']['output_cpout_path'])
-
-        if self.io_dict['out']['output_cprst_path']:
-            self.cmd.append('-cprestrt')
-            self.cmd.append(self.stage_io_dict['out']['output_cprst_path'])
-
-        # general mpi properties
-        if self.mpi_bin:
-            mpi_cmd = [self.mpi_bin]
-            if self.mpi_np:
-                mpi_cmd.append('-n')
-                mpi_cmd.append(str(self.mpi_np))
-            if self.mpi_flags:
-                mpi_cmd.extend(self.mpi_flags)
-            self.cmd = mpi_cmd + self.cmd
-
-        # Run Biobb block
-        self.run_biobb()
+        if self.replicas:
+            self.run_groupfile()
+        else:
+            # Convergence monitor: the shell records the engine PID before replacing itself with it
+            monitor = None
+            pid_path = None
+            if self.convergence and self.container_path:
+                fu.log('WARNING: convergence property is not available with containers, running the whole simulation', self.out_log, self.global_log)
+            elif self.convergence:
+                pid_path = str(Path(tmp_folder).joinpath("engine.pid"))
+                monitor = ConvergenceMonitor(self.stage_io_dict['out']['output_mdinfo_path'] or self.stage_io_dict['out']['output_log_path'],
+                                             self.convergence, self.convergence_window, self.convergence_interval, pid_path, self.out_log)
+
+            # Command line, shared with pmemd
+            # sander -O -i mdin/min.mdin -p $1.cpH.prmtop -c ph$i/$1.inpcrd -r ph$i/$1.min.rst7 -o ph$i/$1.min.o
+            self.cmd = engine_cmd(self.binary_path, self.output_mdin_path, {**self.stage_io_dict['in'], **self.stage_io_dict['out']},
+                                  self.mpi_bin, self.mpi_np, self.mpi_flags, pid_path)
+            if monitor:
+                monitor.start()
+
+            # Run Biobb block
+            self.run_biobb()
+
+            if monitor:
+                monitor.stop()
+                if monitor.converged_time is not None:
+                    fu.log('Run stopped on convergence at %s ps' % monitor.converged_time, self.out_log, self.global_log)
+                    # The engine may have been stopped while writing the restart file
+                    self.return_code = stopped_run_return_code(self.stage_io_dict['out']['output_rst_path'], natom, self.out_log, self.global_log)
 
         # Copy files to host
         self.copy_to_host()
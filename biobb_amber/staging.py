@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+"""Module containing the staging strategies used to move the files in and out of the sandbox of the biobb_amber building blocks."""
+
+import errno
+import os
+import shutil
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from biobb_common.generic.biobb_object import BiobbObject
+from biobb_common.tools import file_utils as fu
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+STAGING_STRATEGIES = ("copy", "hardlink", "reflink", "symlink", "move")
+
+# Linux ioctl request cloning a whole file (copy-on-write) on Btrfs, XFS, OCFS2...
+FICLONE = 0x40049409
+
+# Link/clone errors meaning "not possible here", not "something is broken"
+_FALLBACK_ERRNOS = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EACCES,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.EMLINK,
+    errno.EOPNOTSUPP,
+    getattr(errno, "ENOTSUP", errno.EOPNOTSUPP),
+    getattr(errno, "ENOSYS", errno.EOPNOTSUPP),
+}
+
+
+def reflink(source: str, target: str) -> None:
+    """Clone *source* into *target* sharing the data blocks until one of them is modified (copy-on-write).
+    Raises OSError when the filesystem (or the platform) does not support it."""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported in this platform", str(source))
+    with open(source, "rb") as fp_in, open(target, "wb") as fp_out:
+        try:
+            fcntl.ioctl(fp_out.fileno(), FICLONE, fp_in.fileno())
+        except OSError:
+            fp_out.close()
+            os.remove(target)
+            raise
+    shutil.copystat(source, target)
+
+
+def copy_bytes(source: BinaryIO, target: BinaryIO, size: int, chunk_size: int = 1 << 20) -> None:
+    """Copies *size* bytes from the current position of the *source* file object to the *target* one."""
+    while size > 0:
+        chunk = source.read(min(chunk_size, size))
+        if not chunk:
+            break
+        target.write(chunk)
+        size -= len(chunk)
+
+
+def stage_file(source: str, target: str, strategy: str = "copy", out_log=None) -> str:
+    """Places the *source* file in the *target* path using the *strategy* staging method (copy, hardlink, reflink,
+    symlink or move). Links and clones fall back to a plain copy when source and target are on different filesystems
+    or the filesystem does not support them. Returns the strategy finally used."""
+    if os.path.exists(target) and os.path.samefile(source, target):
+        return strategy
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        if strategy == "hardlink":
+            os.link(source, target)
+        elif strategy == "reflink":
+            reflink(source, target)
+        elif strategy == "symlink":
+            os.symlink(os.path.abspath(source), target)
+        elif strategy == "move":
+            # shutil.move already copies and removes the source across filesystems
+            shutil.move(str(source), str(target))
+        else:
+            strategy = "copy"
+            shutil.copy2(source, target)
+        return strategy
+    except OSError as err:
+        if strategy == "copy" or err.errno not in _FALLBACK_ERRNOS:
+            raise
+        fu.log("%s of %s not possible (%s), copying it" % (strategy.capitalize(), source, err.strerror), out_log)
+    if os.path.lexists(target):
+        os.remove(target)
+    shutil.copy2(source, target)
+    return "copy"
+
+
+class StagingBiobbObject(BiobbObject):
+    """
+    | biobb_amber StagingBiobbObject
+    | Base class of the biobb_amber building blocks adding the **staging** property to BiobbObject.
+    | Stages the input files in the sandbox and the output files back to the host with the selected strategy (copy, hardlink, reflink, symlink or move) instead of always copying them, falling back to a copy when the strategy is not possible.
+    """
+
+    def __init__(self, properties: Optional[dict] = None, **kwargs) -> None:
+        properties = properties or {}
+        super().__init__(properties, **kwargs)
+        self.staging = properties.get("staging", "copy")
+        if self.staging not in STAGING_STRATEGIES:
+            fu.log("WARNING: unknown staging strategy %s, using copy instead" % self.staging, self.out_log, self.global_log)
+            self.staging = "copy"
+
+    def input_staging(self) -> str:
+        """Strategy used to stage the input files: inputs are never moved out of the host and symbolic links
+        pointing outside the sandbox are not visible from the containers, so both use hard links instead."""
+        if self.staging == "move" or (self.staging == "symlink" and self.container_path):
+            return "hardlink"
+        return self.staging
+
+    def output_staging(self) -> str:
+        """Strategy used to stage the output files back: the sandbox is removed, so symbolic links become moves."""
+        if self.staging == "symlink":
+            return "move"
+        return self.staging
+
+    def stage_files(self):
+        """Stage the input/output files in a temporal unique directory aka sandbox."""
+        if self.disable_sandbox or self.staging == "copy":
+            return super().stage_files()
+        # Create a unique directory for the sandbox
+        unique_dir = str(Path(fu.create_unique_dir(path=str(self.sandbox_path), prefix="sandbox_", out_log=self.out_log)).resolve())
+        self.stage_io_dict = {"in": {}, "out": {}, "unique_dir": unique_dir}
+
+        # Only remove unique_dir if using sandbox
+        self.tmp_files.append(unique_dir)
+
+        strategy = self.input_staging()
+        for io in ["in", "out"]:
+            for file_ref, file_path in self.io_dict.get(io, {}).items():
+                if not file_path:
+                    # Skip optional files not set
+                    continue
+                file_path = Path(file_path)
+                # Assign INTERNAL PATH to IN/OUT files
+                if file_path.exists() or io == "out":
+                    if io == "in":
+                        fu.log(f"{strategy.capitalize()} to stage: {file_path} --> {unique_dir.split('/')[-1]}", self.out_log)
+                        doc = self.doc_arguments_dict.get(file_ref)
+                        if doc and doc['type'] == 'dir' and file_path.suffix != '.zip':
+                            shutil.copytree(file_path, os.path.join(unique_dir, file_path.name))
+                        else:
+                            stage_file(str(file_path), os.path.join(unique_dir, file_path.name), strategy, self.out_log)
+                    # Container
+                    if self.container_path:
+                        self.stage_io_dict[io][file_ref] = os.path.join(self.container_volume_path, file_path.name)
+                    # Local
+                    else:
+                        self.stage_io_dict[io][file_ref] = os.path.join(unique_dir, file_path.name)
+                        if self.chdir_sandbox:
+                            self.stage_io_dict[io][file_ref] = file_path.name
+                elif io == "in":
+                    self.stage_io_dict[io][file_ref] = file_path.name
+
+    def copy_to_host(self):
+        """Stage the output files from the sandbox back to the host system."""
+        if self.staging == "copy":
+            return super().copy_to_host()
+        strategy = self.output_staging()
+        for file_ref, file_path in self.stage_io_dict["out"].items():
+            dest_path = Path(self.io_dict["out"][file_ref])
+            if self.doc_arguments_dict.get(file_ref, {}).get('type') == 'dir':
+                sandbox_dir_path = Path(self.stage_io_dict["unique_dir"]).joinpath(file_path)
+                fu.log(f"Copy directory to host: {sandbox_dir_path} --> {dest_path}", self.out_log, self.global_log)
+                fu.copytree_new_files_only(sandbox_dir_path, dest_path)
+            else:
+                if not file_path:
+                    continue
+                sandbox_file_path = Path(self.stage_io_dict["unique_dir"]).joinpath(Path(file_path).name)
+                if not sandbox_file_path.exists():
+                    continue
+                if not dest_path.exists() or not sandbox_file_path.samefile(dest_path):
+                    stage_file(str(sandbox_file_path), str(dest_path), strategy, self.out_log)
@@ -0,0 +1,95 @@
+# type: ignore
+import os
+import shutil
+from pathlib import Path
+from biobb_common.tools import test_fixtures as fx
+from biobb_amber.cache import evict, source_files
+from biobb_amber.parmed import parmed_hmassrepartition as module
+from biobb_amber.parmed.parmed_hmassrepartition import ParmedHMassRepartition
+
+
+class TestCache():
+    def setup_class(self):
+        fx.test_setup(self, 'cache')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def block(self, cache=True, input_top_path=None, **properties):
+        if cache:
+            properties.setdefault('cache_path', str(Path(self.properties['path']).joinpath('cache')))
+        return ParmedHMassRepartition(input_top_path=input_top_path or self.paths['input_top_path'], output_top_path=self.paths['output_top_path'],
+                                      properties=dict(self.properties, **properties))
+
+    def count_executions(self, monkeypatch):
+        executions = []
+        hmass_repartition = module.hmass_repartition
+        monkeypatch.setattr(module, 'hmass_repartition', lambda *args: executions.append(args) or hmass_repartition(*args))
+        return executions
+
+    def test_cache_key(self):
+        key = self.block().compute_cache_key()
+        assert key == self.block().compute_cache_key()
+        # Properties not changing the outputs are not part of the key
+        assert key == self.block(sandbox_path=self.properties['path'], remove_tmp=False, staging='hardlink').compute_cache_key()
+        assert key != self.block(hydrogen_mass=2.5).compute_cache_key()
+        input_top_path = Path(self.properties['path']).joinpath('input.prmtop')
+        shutil.copyfile(self.paths['input_top_path'], input_top_path)
+        assert key == self.block(input_top_path=str(input_top_path)).compute_cache_key()
+        with open(input_top_path, 'a') as top:
+            top.write('\n')
+        assert key != self.block(input_top_path=str(input_top_path)).compute_cache_key()
+        extra = Path(self.properties['path']).joinpath('leaprc.extra')
+        extra.write_text('source leaprc.protein.ff14SB\n')
+        assert self.block().compute_cache_key([str(extra)]) != key
+
+    def test_cache_source_files(self):
+        # The shared helpers used by the block are part of its code
+        files = [Path(path).relative_to(Path(module.__file__).parents[1]).as_posix() for path in source_files(module)]
+        assert files == ['cache.py', 'leap/prmtop.py', 'parmed/common.py', 'parmed/parmed_hmassrepartition.py', 'staging.py']
+
+    def test_cache_restore_store(self, monkeypatch):
+        executions = self.count_executions(monkeypatch)
+        cache_path = Path(self.properties['path']).joinpath('restore')
+        self.block(cache_path=str(cache_path)).launch()
+        assert len(executions) == 1
+        entry = cache_path.joinpath(self.block(cache_path=str(cache_path)).compute_cache_key())
+        assert fx.equal(self.paths['output_top_path'], self.paths['ref_output_top_path'])
+        assert entry.joinpath('output_top_path').read_bytes() == Path(self.paths['output_top_path']).read_bytes()
+        assert not [path for path in cache_path.iterdir() if path.name.startswith('.')]
+
+        os.remove(self.paths['output_top_path'])
+        self.block(cache_path=str(cache_path)).launch()
+        assert len(executions) == 1
+        assert fx.equal(self.paths['output_top_path'], self.paths['ref_output_top_path'])
+
+        self.block(cache_path=str(cache_path), hydrogen_mass=2.5).launch()
+        assert len(executions) == 2
+        assert len(list(cache_path.iterdir())) == 2
+
+    def test_cache_disabled(self, monkeypatch):
+        executions = self.count_executions(monkeypatch)
+        self.block(cache=False).launch()
+        self.block(cache=False).launch()
+        assert len(executions) == 2
+        assert fx.equal(self.paths['output_top_path'], self.paths['ref_output_top_path'])
+
+    def test_cache_evict(self):
+        cache_path = Path(self.properties['path']).joinpath('evict')
+        for i, name in enumerate(('old', 'recent', 'new')):
+            entry = cache_path.joinpath(name)
+            entry.mkdir(parents=True)
+            entry.joinpath('output_top_path').write_bytes(b'x' * 1000)
+            os.utime(entry, (i, i))
+        evict(str(cache_path), 2000)
+        assert sorted(path.name for path in cache_path.iterdir()) == ['new', 'recent']
+        evict(str(cache_path), 0, keep='new')
+        assert [path.name for path in cache_path.iterdir()] == ['new']
+
+    def test_cache_size_minimum(self):
+        cache_path = str(Path(self.properties['path']).joinpath('minimum'))
+        block = self.block(cache_path=cache_path, cache_size=0)
+        assert block.cache_size == 1
+        block.launch()
+        assert self.block(cache_path=cache_path).restore_cache()
@@ -0,0 +1,65 @@
+# type: ignore
+import hashlib
+from pathlib import Path
+import pytest
+from biobb_common.tools import test_fixtures as fx
+from biobb_amber.pmemd.common import _MDIN_CACHE, Mdin, read_mdin
+
+
+class TestMdin():
+    def setup_class(self):
+        fx.test_setup(self, 'mdin')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_mdin_disang_group(self):
+        path = Path(self.properties['path']).joinpath('disang.mdin')
+        path.write_text("Restrained MD\n"
+                        " &cntrl\n  imin=0, nstlim=500, nmropt=1, ! restraints\n  restraintmask=':1-10', /\n"
+                        " &wt type='END' /\n"
+                        "DISANG=dist.RST\n"
+                        "LISTOUT=POUT\n")
+        mdin = read_mdin(path).update({'ewald.skinnb': '2.0', 'dt': 0.002})
+        assert [namelist.name for namelist in mdin.namelists()] == ['cntrl', 'ewald', 'wt']
+        assert str(mdin).endswith("&wt\n  type = 'END'\n/\nDISANG=dist.RST\nLISTOUT=POUT\n")
+        assert read_mdin(mdin.write(path)).get('skinnb', group='ewald') == '2.0'
+        assert read_mdin(path).get('dt') == '0.002'
+
+    def test_mdin_parser(self):
+        mdin = Mdin.parse("Title line\n"
+                          "&cntrl\n  imin = 1, maxcyc=500, ! minimization\n  restraintmask = ':1-3 & !@H=',\n"
+                          "  ntwprt=0 ntpr = 10, iwt(1) = 1, 2 &end\n"
+                          "&ewald skinnb=2.0 /\n")
+        assert mdin.blocks[0] == 'Title line'
+        cntrl = mdin.group('cntrl')
+        assert list(cntrl.options) == ['imin', 'maxcyc', 'restraintmask', 'ntwprt', 'ntpr', 'iwt(1)']
+        assert cntrl.get('MAXCYC') == '500'
+        assert cntrl.options['imin'][2] == 'minimization'
+        assert cntrl.get('restraintmask') == "':1-3 & !@H='"
+        assert cntrl.get('iwt(1)') == '1, 2'
+        assert mdin.get('skinnb', group='ewald') == '2.0'
+        assert mdin.get('cut', '8.0') == '8.0'
+
+    def test_mdin_serializer(self):
+        mdin = Mdin(['Title'])
+        mdin.update({'imin': 1, 'restraintmask': ':1-3', 'ntr': '1', 'pres0': '1.0d0', 'wt.type': 'END'}, 'BioBB property')
+        assert str(mdin) == ("Title\n&cntrl\n  imin = 1 ! BioBB property\n  restraintmask = \":1-3\" ! BioBB property\n"
+                             "  ntr = 1 ! BioBB property\n  pres0 = 1.0d0 ! BioBB property\n/\n"
+                             "&wt\n  type = \"END\" ! BioBB property\n/\n")
+        assert str(Mdin.parse(str(mdin))) == str(mdin)
+        with pytest.raises(ValueError):
+            mdin.update({'bad name': 1})
+
+    def test_mdin_cache(self):
+        path = Path(self.properties['path']).joinpath('cached.mdin')
+        path.write_text("&cntrl\n  imin = 1\n/\n")
+        first = read_mdin(path)
+        first.update({'imin': 0})
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        assert digest in _MDIN_CACHE
+        assert read_mdin(path).get('imin') == '1'
+        path.write_text("&cntrl\n  imin = 0\n/\n")
+        assert read_mdin(path).get('imin') == '0'
+        assert list(_MDIN_CACHE)[-1] == hashlib.sha256(path.read_bytes()).hexdigest()
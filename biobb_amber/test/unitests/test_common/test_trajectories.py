@@ -0,0 +1,89 @@
+# type: ignore
+import struct
+from pathlib import Path
+from biobb_common.tools import test_fixtures as fx
+from biobb_amber.pmemd.common import concatenate_trajectories, is_completed_log, netcdf_record_layout, restart_atom_count, stopped_run_return_code
+
+
+def nc_name(name):
+    data = name.encode()
+    return struct.pack('>i', len(data)) + data + b'\0' * ((-len(data)) % 4)
+
+
+def write_netcdf(path, frames, n_atoms=2):
+    """ Writes a minimal AMBER NetCDF classic trajectory with a time and a coordinates record variable """
+    dims = [('frame', 0), ('atom', n_atoms), ('spatial', 3)]
+    variables = [('time', [0], 4), ('coordinates', [0, 1, 2], n_atoms * 3 * 4)]
+
+    def header(begins):
+        data = b'CDF\x01' + struct.pack('>I', len(frames))
+        data += struct.pack('>ii', 10, len(dims)) + b''.join(nc_name(name) + struct.pack('>i', size) for name, size in dims)
+        data += struct.pack('>ii', 0, 0)
+        data += struct.pack('>ii', 11, len(variables))
+        for (name, dimids, vsize), begin in zip(variables, begins):
+            data += nc_name(name) + struct.pack('>i', len(dimids)) + b''.join(struct.pack('>i', dimid) for dimid in dimids)
+            data += struct.pack('>ii', 0, 0) + struct.pack('>iii', 5, vsize, begin)
+        return data
+
+    size = len(header([0, 0]))
+    data = header([size, size + 4])
+    for time, coordinates in frames:
+        data += struct.pack('>f', time) + struct.pack('>%df' % (n_atoms * 3), *coordinates)
+    Path(path).write_bytes(data)
+
+
+class TestTrajectories():
+    def setup_class(self):
+        fx.test_setup(self, 'trajectories')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_is_completed_log(self):
+        path = Path(self.properties['path']).joinpath('sander.log')
+        assert not is_completed_log(path)
+        path.write_text('  NSTEP =      500   TIME(PS) =       1.000\n')
+        assert not is_completed_log(path)
+        with open(path, 'a') as fp:
+            fp.write('x' * 10000 + '\n|           Run   done at 12:00:00.000  on 01/01/2024\n')
+        assert is_completed_log(path)
+
+    def test_concatenate_netcdf(self):
+        folder = Path(self.properties['path'])
+        first = [(float(i), [float(i)] * 6) for i in range(3)]
+        second = [(float(i), [float(i)] * 6) for i in range(3, 5)]
+        write_netcdf(folder.joinpath('first.nc'), first)
+        write_netcdf(folder.joinpath('second.nc'), second)
+        write_netcdf(folder.joinpath('reference.nc'), first + second)
+        concatenate_trajectories([str(folder.joinpath('first.nc')), str(folder.joinpath('second.nc'))], folder.joinpath('joined.nc'))
+        assert netcdf_record_layout(folder.joinpath('joined.nc')) == (5, netcdf_record_layout(folder.joinpath('first.nc'))[1], 28)
+        assert folder.joinpath('joined.nc').read_bytes() == folder.joinpath('reference.nc').read_bytes()
+
+    def test_concatenate_mdcrd(self):
+        folder = Path(self.properties['path'])
+        folder.joinpath('first.x').write_text('TITLE\n   1.000   2.000\n')
+        folder.joinpath('second.x').write_text('TITLE\n   3.000   4.000\n')
+        concatenate_trajectories([str(folder.joinpath('first.x')), str(folder.joinpath('second.x'))], folder.joinpath('joined.x'))
+        assert folder.joinpath('joined.x').read_text() == 'TITLE\n   1.000   2.000\n   3.000   4.000\n'
+
+    def test_restart_atom_count(self):
+        folder = Path(self.properties['path'])
+        netcdf = Path(self.data_dir).joinpath('pmemd', 'sander.rst')
+        ascii = Path(self.data_dir).joinpath('pmemd', 'cln025.inpcrd')
+        assert restart_atom_count(netcdf) == 15755
+        assert restart_atom_count(ascii) == 15755
+        # Restart files truncated by stopping the engine while it writes them
+        folder.joinpath('truncated.ncrst').write_bytes(netcdf.read_bytes()[:-100])
+        folder.joinpath('truncated.rst').write_text(''.join(ascii.read_text().splitlines(keepends=True)[:-2]))
+        assert restart_atom_count(folder.joinpath('truncated.ncrst')) is None
+        assert restart_atom_count(folder.joinpath('truncated.rst')) is None
+        assert restart_atom_count(folder.joinpath('missing.rst')) is None
+
+    def test_stopped_run_return_code(self):
+        folder = Path(self.properties['path'])
+        netcdf = Path(self.data_dir).joinpath('pmemd', 'sander.rst')
+        folder.joinpath('truncated.ncrst').write_bytes(netcdf.read_bytes()[:-100])
+        assert stopped_run_return_code(str(netcdf), 15755) == 0
+        assert stopped_run_return_code(str(netcdf), 100) == 1
+        assert stopped_run_return_code(str(folder.joinpath('truncated.ncrst')), 15755) == 1
@@ -0,0 +1,42 @@
+# type: ignore
+from pathlib import Path
+import numpy as np
+from biobb_common.tools import test_fixtures as fx
+from biobb_amber.cphstats.common import CpoutArchive, CpoutReader, TitratableResidues
+from biobb_amber.cphstats.cphstats_archive import cphstats_archive
+from biobb_amber.cphstats.cphstats_run import cphstats_run
+
+
+class TestCphstatsArchive():
+    def setup_class(self):
+        fx.test_setup(self, 'cphstats_archive')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_cphstats_archive(self):
+        cphstats_archive(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_archive_path'])
+        assert fx.equal(self.paths['output_archive_path'], self.paths['ref_output_archive_path'])
+
+    def test_cphstats_archive_read(self):
+        cphstats_archive(properties=self.properties, **self.paths)
+        n_residues = len(TitratableResidues.read(self.paths['input_cpin_path']).names)
+        states, solvent = CpoutReader(self.paths['input_cpout_path'], n_residues).read()
+        archive = CpoutArchive(self.paths['output_archive_path'])
+        assert len(archive) == len(states)
+        n_frames = len(states)
+        for start, stop in ((0, None), (0, 1), (5, 17), (n_frames // 3, 2 * n_frames // 3), (n_frames - 3, None), (10, 10), (n_frames - 1, n_frames + 10)):
+            assert np.array_equal(archive.states(start, stop), states[start:stop])
+            assert np.array_equal(archive.solvent(start, stop), solvent[start:stop])
+            for residue in range(n_residues):
+                assert np.array_equal(archive.column(residue, start, stop), states[start:stop, residue])
+
+    def test_cphstats_run_archive(self):
+        cphstats_archive(properties=self.properties, **self.paths)
+        output_dat_path = str(Path(self.properties['path']).joinpath('archive.dat'))
+        cphstats_run(input_cpin_path=self.paths['input_cpin_path'], input_cpout_path=self.paths['output_archive_path'], output_dat_path=output_dat_path,
+                     properties={'path': self.properties['path']})
+        assert fx.not_empty(output_dat_path)
+        assert fx.equal(output_dat_path, str(Path(self.paths['ref_output_archive_path']).with_name('cphstats.pH.dat')))
@@ -0,0 +1,75 @@
+# type: ignore
+import re
+import zipfile
+import numpy as np
+from biobb_common.tools import test_fixtures as fx
+from biobb_amber.cphstats import common
+from biobb_amber.cphstats.cphstats_remd import cphstats_remd
+from biobb_amber.cphstats.common import CpoutReader, TitratableResidues, replica_ensembles
+
+
+def remd_fractions(cpin_path, cpouts_path):
+    """ Fractions protonated of each pH ensemble, counted record by record from the replica cpout files (the first record of each file is the initial state) """
+    residues = TitratableResidues.read(cpin_path)
+    protonated, frames = {}, {}
+    with zipfile.ZipFile(cpouts_path) as archive:
+        for name in archive.namelist():
+            states = [0] * len(residues.names)
+            for i, record in enumerate(archive.read(name).decode().strip().split('\n\n')):
+                for line in record.splitlines():
+                    if line.startswith('Solvent pH:'):
+                        ph = float(line.split()[-1])
+                    elif line.startswith('Residue'):
+                        states[int(line.split()[1])] = int(line.split()[3])
+                if i:
+                    frames[ph] = frames.get(ph, 0) + 1
+                    protonated[ph] = protonated.get(ph, 0) + residues.protonated_table[range(len(states)), states]
+    return {ph: protonated[ph] / frames[ph] for ph in frames}
+
+
+def read_fractions(dat_path):
+    """ Frac Prot of each residue at each pH of a cphstats calcpka output """
+    fractions = {}
+    with open(dat_path) as dat:
+        for line in dat:
+            if line.startswith('Solvent pH is'):
+                ph = float(line.split()[-1])
+                fractions[ph] = []
+            elif 'Frac Prot' in line:
+                fractions[ph].append(float(re.search(r'Frac Prot +(\S+)', line).group(1)))
+    return {ph: np.array(values) for ph, values in fractions.items()}
+
+
+class TestCphstatsRemd():
+    def setup_class(self):
+        fx.test_setup(self, 'cphstats_remd')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_cphstats_remd(self):
+        cphstats_remd(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_pka_path'])
+        assert fx.equal(self.paths['output_pka_path'], self.paths['ref_output_pka_path'])
+        assert fx.not_empty(self.paths['output_dat_path'])
+        assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+        # Fractions protonated checked against the ones counted directly from the cpout records
+        expected = remd_fractions(self.paths['input_cpin_path'], self.paths['input_cpouts_path'])
+        fractions = read_fractions(self.paths['output_dat_path'])
+        assert sorted(fractions) == sorted(expected)
+        for ph, values in fractions.items():
+            assert np.allclose(values, expected[ph], atol=5e-4)
+
+    def test_replica_ensembles_blocks(self, monkeypatch):
+        with zipfile.ZipFile(self.paths['input_cpouts_path']) as archive:
+            archive.extract('rep1.cpout')
+        ensembles = replica_ensembles(self.paths['input_cpin_path'], 'rep1.cpout')
+        # Segments split across the blocks of the reader
+        monkeypatch.setattr(common, 'open_titration', lambda path, n_residues: CpoutReader(path, n_residues, block_size=1000))
+        blocks = replica_ensembles(self.paths['input_cpin_path'], 'rep1.cpout')
+        assert sorted(blocks) == sorted(ensembles)
+        for ph, (statistics, segments) in ensembles.items():
+            assert blocks[ph][0].to_dict() == statistics.to_dict()
+            assert [segment[:2] for segment in blocks[ph][1]] == [segment[:2] for segment in segments]
+            assert all((a[2] == b[2]).all() and (a[3] == b[3]).all() for a, b in zip(blocks[ph][1], segments))
@@ -1,4 +1,7 @@
 # type: ignore
+import re
+from pathlib import Path
+import numpy as np
 from biobb_common.tools import test_fixtures as fx
 from biobb_amber.cphstats.cphstats_run import cphstats_run
 
@@ -15,3 +18,101 @@ class TestCphstatsRun():
         cphstats_run(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_dat_path'])
         assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+
+
+class TestCphstatsRunPopulation():
+    def setup_class(self):
+        fx.test_setup(self, 'cphstats_run_population')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_cphstats_run_population(self):
+        cphstats_run(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_dat_path'])
+        assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+        assert fx.not_empty(self.paths['output_population_path'])
+        assert fx.equal(self.paths['output_population_path'], self.paths['ref_output_population_path'])
+
+
+def read_table(path):
+    """ Rows of numbers of a time series file, without the header """
+    return np.loadtxt(path, comments='#', ndmin=2)
+
+
+class TestCphstatsRunSeries():
+    def setup_class(self):
+        fx.test_setup(self, 'cphstats_run_series')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_cphstats_run_series(self):
+        cphstats_run(properties=self.properties, **self.paths)
+        assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+        # Values checked against the fractions protonated and populations of the cphstats references
+        fractions = np.array([float(value) for value in re.findall(r'Frac Prot (\S+)', Path(self.paths['ref_output_dat_path']).read_text())])
+        populations = {(int(number), state): float(value) for number, states in re.findall(r'Residue: \S+ (\d+) +(.*)', Path(self.paths['ref_output_population_path']).read_text())
+                       for state, value in enumerate(re.findall(r'(\S+) \(\d+\)', states))}
+        cumulative = read_table(self.paths['output_cumulative_path'])
+        assert len(cumulative) == 25
+        assert cumulative[-1, 0] == 5.0
+        assert np.allclose(cumulative[-1, 1:], fractions, atol=5e-4)
+        running_avg = read_table(self.paths['output_running_avg_path'])
+        assert np.allclose(running_avg[-1, 1:], fractions, atol=5e-4)
+        chunk = read_table(self.paths['output_chunk_path'])
+        assert chunk[:, 0].tolist() == [1.0, 2.0, 3.0, 4.0, 5.0]
+        assert np.allclose(chunk[:, 1:].mean(axis=0), fractions, atol=5e-4)
+        conditional = dict(re.findall(r'P\((\S+)\) = (\S+)', Path(self.paths['output_conditional_path']).read_text()))
+        assert float(conditional['3:P']) == populations[(3, 1)]
+        assert float(conditional['7:0']) == populations[(7, 0)]
+        assert float(conditional['7:1']) == populations[(7, 1)]
+        assert float(conditional['3:P,49:P']) <= min(populations[(3, 1)], populations[(49, 1)])
+        chunk_conditional = read_table(self.paths['output_chunk_conditional_path'])
+        assert len(chunk_conditional) == 25
+        assert np.allclose(chunk_conditional[:, 1:].mean(axis=0), [float(value) for value in conditional.values()])
+
+
+class TestCphstatsRunIncremental():
+    def setup_class(self):
+        fx.test_setup(self, 'cphstats_run_incremental')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_cphstats_run_incremental(self):
+        # The cpout file grows while the simulation runs: first half, cut in the middle of a record, then the rest
+        data = Path(self.paths['input_cpout_path']).read_bytes()
+        cpout_path = Path(self.properties['path']).joinpath('growing.cpout')
+        cpout_path.write_bytes(data[:len(data) // 2])
+        paths = dict(self.paths, input_cpout_path=str(cpout_path))
+        cphstats_run(properties=self.properties, **paths)
+        assert fx.not_empty(self.paths['output_dat_path'])
+        assert fx.not_empty(self.paths['output_dat_path'] + '.state')
+        with open(cpout_path, 'ab') as cpout:
+            cpout.write(data[len(data) // 2:])
+        cphstats_run(properties=self.properties, **paths)
+        assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+        # Adding the same, unchanged, cpout file again must not add any frame
+        cphstats_run(properties=self.properties, **paths)
+        assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+
+    def test_cphstats_run_incremental_series(self):
+        # Chunk, cumulative, running average and conditional series kept in the sidecar state match a one-shot run
+        data = Path(self.paths['input_cpout_path']).read_bytes()
+        folder = Path(self.properties['path'])
+        cpout_path = folder.joinpath('growing.series.cpout')
+        names = ('dat', 'chunk', 'cumulative', 'running_avg', 'conditional', 'chunk_conditional')
+        properties = dict(self.properties, interval=100, chunk_window=300, running_avg_window=500, conditional='3:P 7:0;1,49:P')
+        incremental = {'output_%s_path' % name: str(folder.joinpath('incremental.%s.dat' % name)) for name in names}
+        for cut in (len(data) // 3, 2 * len(data) // 3, len(data)):
+            cpout_path.write_bytes(data[:cut])
+            cphstats_run(input_cpin_path=self.paths['input_cpin_path'], input_cpout_path=str(cpout_path), properties=properties, **incremental)
+        one_shot = {'output_%s_path' % name: str(folder.joinpath('one_shot.%s.dat' % name)) for name in names}
+        cphstats_run(input_cpin_path=self.paths['input_cpin_path'], input_cpout_path=self.paths['input_cpout_path'], properties=dict(properties, incremental=False), **one_shot)
+        for name in names:
+            assert fx.not_empty(incremental['output_%s_path' % name])
+            assert Path(incremental['output_%s_path' % name]).read_text() == Path(one_shot['output_%s_path' % name]).read_text()
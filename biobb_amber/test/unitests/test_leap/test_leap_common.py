@@ -0,0 +1,196 @@
+# type: ignore
+import logging
+import math
+import os
+from pathlib import Path
+import pytest
+from biobb_amber.leap.common import (_LEAPRC_INDEX, _TLEAP_POOL, TleapSession, _directory_files, absolute_sandbox_paths, box_volume, clear_variables_command,
+                                     count_pdb_waters, find_leaprc_paths, loads_job_files, pdb_box_volume, run_tleap_session, salt_ions,
+                                     split_tleap_script, tleap_log_values)
+
+DATA = Path(__file__).resolve().parents[2].joinpath('data')
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path):
+    # Relative paths are resolved from the working directory, which a failed block test may have removed
+    os.chdir(tmp_path)
+    return tmp_path
+
+
+def test_split_tleap_script(tmp_path):
+    job_dir = str(tmp_path.joinpath('sandbox'))
+    lines = ["source leaprc.protein.ff14SB\n", "\n", "source leaprc.water.tip3p\n", "loadamberparams frcmod.ionsjc_tip3p\n",
+             "loadOff %s/ligand.lib\n" % job_dir, "loadamberparams frcmod.ions234lm_126_tip3p\n",
+             "mol = loadpdb %s/structure.pdb\n" % job_dir, "saveAmberParm mol top.prmtop crd.inpcrd\n", "quit\n"]
+    preload, commands = split_tleap_script(lines, [job_dir, None])
+    assert preload == ["source leaprc.protein.ff14SB", "source leaprc.water.tip3p", "loadamberparams frcmod.ionsjc_tip3p"]
+    # Shared files loaded after the job ones stay in the job commands
+    assert commands == ["loadOff %s/ligand.lib" % job_dir, "loadamberparams frcmod.ions234lm_126_tip3p",
+                        "mol = loadpdb %s/structure.pdb" % job_dir, "saveAmberParm mol top.prmtop crd.inpcrd"]
+    assert split_tleap_script(["quit"], [job_dir]) == ([], [])
+
+
+def test_loads_job_files(tmp_path):
+    job_dir = str(tmp_path.joinpath('sandbox'))
+    assert loads_job_files(["loadamberparams %s/ligand.frcmod" % job_dir], [job_dir])
+    assert loads_job_files(["source %s/leaprc.ligand" % job_dir], [job_dir])
+    assert not loads_job_files(["loadamberparams frcmod.ionsjc_tip3p", "mol = loadpdb %s/structure.pdb" % job_dir], [job_dir])
+    # Files in folders sharing the prefix of a job folder are not job files
+    assert not loads_job_files(["loadOff %s_other/ligand.lib" % job_dir], [job_dir])
+
+
+def test_clear_variables_command():
+    assert clear_variables_command(["mol = loadpdb structure.pdb", "  lig=loadmol2 ligand.mol2", "solvateOct mol TIP3PBOX 8.0",
+                                    "mol = combine { mol lig }"]) == ["clearVariables { lig mol }"]
+    assert clear_variables_command(["source leaprc.protein.ff14SB", "check mol"]) == []
+
+
+def test_absolute_sandbox_paths(tmp_path):
+    tmp_path.joinpath('structure.pdb').write_text('END\n')
+    io_dict = {'in': {'input_pdb_path': 'structure.pdb', 'input_lib_path': None, 'input_source_path': 'leaprc.ligand'},
+               'out': {'output_top_path': 'structure.top'}}
+    stage_io_dict = {'in': io_dict['in'], 'out': io_dict['out'], 'unique_dir': str(tmp_path)}
+    absolute_sandbox_paths(stage_io_dict)
+    assert stage_io_dict['in'] == {'input_pdb_path': str(tmp_path.joinpath('structure.pdb')), 'input_lib_path': None, 'input_source_path': 'leaprc.ligand'}
+    assert stage_io_dict['out'] == {'output_top_path': str(tmp_path.joinpath('structure.top'))}
+    # The io_dict shared without sandbox is not modified
+    assert io_dict['in']['input_pdb_path'] == 'structure.pdb'
+
+
+def test_tleap_session_timeout(tmp_path):
+    binary_path = tmp_path.joinpath('tleap')
+    binary_path.write_text('#!/bin/sh\nexec sleep 60\n')
+    binary_path.chmod(0o755)
+    session = TleapSession(str(binary_path), [])
+    assert session.run(["mol = loadpdb structure.pdb"], str(tmp_path.joinpath('leap.done')), timeout=0.2) == 1
+    assert not session.alive()
+    assert not os.path.exists(tmp_path.joinpath('leap.done'))
+
+
+def test_tleap_session_interrupted(tmp_path, monkeypatch):
+    binary_path = tmp_path.joinpath('tleap')
+    binary_path.write_text('#!/bin/sh\nexec cat > /dev/null\n')
+    binary_path.chmod(0o755)
+    tmp_path.joinpath('leap.in').write_text('source leaprc.protein.ff14SB\nmol = loadpdb structure.pdb\n')
+    sessions = []
+
+    def interrupted(session, *args, **kwargs):
+        sessions.append(session)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(TleapSession, 'run', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run_tleap_session(str(binary_path), str(tmp_path.joinpath('leap.in')), [str(tmp_path)])
+    # The session is closed instead of being left running or returned to the pool
+    assert not sessions[0].alive()
+    assert all(sessions[0] not in idle for idle in _TLEAP_POOL.values())
+
+
+def test_count_pdb_waters():
+    assert count_pdb_waters(str(DATA.joinpath('leap/structure.ions.input.pdb'))) == 14301
+
+
+def test_count_pdb_waters_tip4p(tmp_path):
+    atoms = [('N', 'ALA', 1), ('CA', 'ALA', 1)]
+    # TIP4P waters with their extra point, the residue numbers wrap around after 9999
+    for number in (9998, 9999, 0, 1):
+        atoms += [('O', 'TP4', number), ('H1', 'TP4', number), ('H2', 'TP4', number), ('EPW', 'TP4', number)]
+    atoms += [('NA', 'Na+', 2)]
+    lines = ['CRYST1   40.000   40.000   40.000  90.00  90.00  90.00 P 1           1']
+    for serial, (name, residue, number) in enumerate(atoms, start=1):
+        record = 'HETATM' if residue == 'Na+' else 'ATOM  '
+        lines.append('%s%5d %-4s %-3s %5d    %8.3f%8.3f%8.3f  1.00  0.00' % (record, serial, name, residue, number, 0.0, 0.0, 0.0))
+        if name == 'EPW':
+            lines.append('TER')
+    path = tmp_path.joinpath('tip4p.pdb')
+    # No newline at the end of the file
+    path.write_text('\n'.join(lines))
+    assert count_pdb_waters(str(path)) == 4
+
+    empty_path = tmp_path.joinpath('empty.pdb')
+    empty_path.write_text('')
+    assert count_pdb_waters(str(empty_path)) == 0
+
+
+def test_box_volume():
+    assert box_volume(40.0, 50.0, 60.0) == pytest.approx(120000.0)
+    # Truncated octahedron: 4 / (3 sqrt(3)) a^3
+    assert box_volume(60.0, 60.0, 60.0, 109.4712206, 109.4712206, 109.4712206) == pytest.approx(4 / (3 * math.sqrt(3)) * 60.0 ** 3)
+
+
+def test_pdb_box_volume(tmp_path):
+    assert pdb_box_volume(str(DATA.joinpath('leap/structure.ions.input.pdb'))) == pytest.approx(box_volume(86.194, 86.194, 86.194, 109.47, 109.47, 109.47))
+    path = tmp_path.joinpath('no_box.pdb')
+    path.write_text('ATOM      1  O   WAT     1       0.000   0.000   0.000  1.00  0.00\nCRYST1   10.000   10.000   10.000  90.00  90.00  90.00\n')
+    # Only the records before the atoms are read
+    assert pdb_box_volume(str(path)) is None
+
+
+def test_tleap_log_values(tmp_path):
+    path = tmp_path.joinpath('leap.log')
+    path.write_text("Total unperturbed charge:   0.000000\n"
+                    "Total unperturbed charge:  -10.000000\nTotal perturbed charge:  -10.000000\n"
+                    "  Solute vdw bounding box:              40.127 40.127 40.127\n"
+                    "  Volume: 166276.878 A^3 (oct)\n"
+                    "  Added 5204 residues.\n")
+    assert tleap_log_values(str(path)) == {'charge': -10.0, 'volume': 166276.878, 'waters': 5204}
+    path.write_text("Checking Unit.\n")
+    assert tleap_log_values(str(path)) == {}
+
+
+def test_salt_ions():
+    assert salt_ions('water_count', 150, 14301) == (39, 39)
+    assert salt_ions('volume', 150, 14301, volume=box_volume(60.0, 60.0, 60.0, 109.4712206, 109.4712206, 109.4712206)) == (15, 15)
+    # SLTCAP for a -10 solute: 39.0 pairs, 44 cations and 34 anions, or 34 pairs beyond the 10 counterions
+    assert salt_ions('sltcap', 150, 14301, charge=-10.0, neutralised=False) == (44, 34)
+    assert salt_ions('sltcap', 150, 14301, charge=-10.0) == (34, 34)
+    assert salt_ions('sltcap', 150, 14301, charge=10.0, neutralised=False) == (34, 44)
+    assert salt_ions('sltcap', 150, 14301, charge=0.0, neutralised=False) == (39, 39)
+    assert salt_ions('sltcap', 150, 0, charge=-10.0) == (0, 0)
+
+
+def test_salt_ions_fallback(caplog):
+    logger = logging.getLogger('test_salt_ions_fallback')
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        assert salt_ions('volume', 150, 14301, volume=None, out_log=logger) == (39, 39)
+        assert salt_ions('sltcap', 150, 14301, charge=None, out_log=logger) == (39, 39)
+    warnings = [record.getMessage() for record in caplog.records if record.getMessage().startswith('WARNING')]
+    assert warnings == ['WARNING: box volume not available, using the water_count ions method',
+                        'WARNING: net charge of the solute not available, using the water_count ions method']
+
+
+@pytest.fixture
+def amberhome(tmp_path, monkeypatch):
+    cmd_path = tmp_path.joinpath('amber', 'dat', 'leap', 'cmd')
+    cmd_path.joinpath('oldff').mkdir(parents=True)
+    for name in ('leaprc.protein.ff14SB', 'leaprc.water.tip3p', 'oldff/leaprc.ff99SB'):
+        cmd_path.joinpath(name).write_text('logFile leap.log\n')
+    # Directories not modified in the last second, so their listings are kept
+    for directory in (cmd_path, cmd_path.joinpath('oldff')):
+        os.utime(directory, ns=(0, 1_000_000_000))
+    monkeypatch.setenv('AMBERHOME', str(tmp_path.joinpath('amber')))
+    return cmd_path
+
+
+def test_find_leaprc_paths(amberhome, tmp_path):
+    leaprc_path = tmp_path.joinpath('leaprc.ligand')
+    leaprc_path.write_text('loadamberparams ligand.frcmod\n')
+    assert find_leaprc_paths(['protein.ff14SB', 'leaprc.water.tip3p', 'ff99SB', str(leaprc_path)]) == [
+        str(amberhome.joinpath('leaprc.protein.ff14SB')), str(amberhome.joinpath('leaprc.water.tip3p')),
+        str(amberhome.joinpath('oldff', 'leaprc.ff99SB')), str(leaprc_path)]
+    with pytest.raises(ValueError):
+        find_leaprc_paths(['protein.ff19SB'])
+
+
+def test_leaprc_listing_invalidation(amberhome):
+    assert _directory_files(str(amberhome)) == {'leaprc.protein.ff14SB', 'leaprc.water.tip3p'}
+    assert str(amberhome) in _LEAPRC_INDEX
+    with pytest.raises(ValueError):
+        find_leaprc_paths(['protein.ff19SB'])
+    # Adding a file changes the modification time of the directory, which is listed again
+    amberhome.joinpath('leaprc.protein.ff19SB').write_text('logFile leap.log\n')
+    assert find_leaprc_paths(['protein.ff19SB']) == [str(amberhome.joinpath('leaprc.protein.ff19SB'))]
+    # A listing of a directory just modified is not kept
+    assert _LEAPRC_INDEX[str(amberhome)][1] == {'leaprc.protein.ff14SB', 'leaprc.water.tip3p'}
+    assert _directory_files(str(amberhome.joinpath('missing'))) == frozenset()
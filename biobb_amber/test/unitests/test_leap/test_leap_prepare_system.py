@@ -0,0 +1,18 @@
+# type: ignore
+from biobb_common.tools import test_fixtures as fx
+from biobb_amber.leap.leap_prepare_system import leap_prepare_system
+
+
+class TestLeapPrepareSystem():
+    def setup_class(self):
+        fx.test_setup(self, 'leap_prepare_system')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_leap_prepare_system(self):
+        leap_prepare_system(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_pdb_path'])
+        assert fx.not_empty(self.paths['output_top_path'])
+        assert fx.not_empty(self.paths['output_crd_path'])
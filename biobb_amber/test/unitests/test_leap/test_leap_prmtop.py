@@ -0,0 +1,108 @@
+# type: ignore
+import shutil
+from pathlib import Path
+import numpy as np
+import pytest
+from biobb_amber.leap.prmtop import POINTERS, Prmtop, PrmtopIndex, check_coordinates
+
+DATA = Path(__file__).resolve().parents[2].joinpath('data')
+TOPOLOGIES = ['leap/structure.leap.top', 'leap/structure.solv.top', 'parmed/cln025.cpH.prmtop', 'pmemd/cln025.prmtop']
+
+
+@pytest.mark.parametrize('topology', TOPOLOGIES)
+def test_prmtop_round_trip(topology, tmp_path):
+    prmtop = Prmtop(DATA.joinpath(topology))
+    output_path = tmp_path.joinpath('round_trip.top')
+    prmtop.write({flag: prmtop.read(flag) for flag in prmtop.sections}, str(output_path))
+    assert output_path.read_bytes() == DATA.joinpath(topology).read_bytes()
+
+
+def test_prmtop_title_padding(tmp_path):
+    prmtop = Prmtop(DATA.joinpath('leap/structure.solv.top'))
+    output_path = tmp_path.joinpath('title.top')
+    prmtop.write({'TITLE': ['mole', 'cule']}, str(output_path))
+    lines = output_path.read_text().splitlines()
+    assert lines[3] == 'molecule'.ljust(80)
+    assert Prmtop(output_path).read('TITLE') == ['mole', 'cule']
+
+
+def test_prmtop_box_patch(tmp_path):
+    path = tmp_path.joinpath('structure.solv.top')
+    shutil.copy(DATA.joinpath('leap/structure.solv.top'), path)
+    original = path.read_bytes()
+    prmtop = Prmtop(path)
+    assert prmtop.natom == 8607
+    assert prmtop.pointer('IFBOX') == 2
+
+    sections = [prmtop.sections['POINTERS'], prmtop.sections['BOX_DIMENSIONS']]
+    pointers = prmtop.read('POINTERS')
+    pointers[POINTERS.index('IFBOX')] = 1
+    prmtop.write({'POINTERS': pointers, 'BOX_DIMENSIONS': [90.0, 45.5, 46.25, 47.125]})
+    # Same size sections are patched in place
+    patched = path.read_bytes()
+    assert len(patched) == len(original)
+    for start, end in ((0, sections[0].start), (sections[0].end, sections[1].start), (sections[1].end, len(original))):
+        assert patched[start:end] == original[start:end]
+    assert prmtop.pointer('IFBOX') == 1
+    assert prmtop.box_dimensions == [90.0, 45.5, 46.25, 47.125]
+    assert Prmtop(path).read('CHARGE') == Prmtop(DATA.joinpath('leap/structure.solv.top')).read('CHARGE')
+
+
+def test_prmtop_resize(tmp_path):
+    path = tmp_path.joinpath('structure.solv.top')
+    shutil.copy(DATA.joinpath('leap/structure.solv.top'), path)
+    prmtop = Prmtop(path)
+    radii = prmtop.read('RADIUS_SET')
+    prmtop.write({'BOX_DIMENSIONS': [90.0, 45.5, 46.25, 47.125, 1.0]})
+    assert prmtop.box_dimensions == [90.0, 45.5, 46.25, 47.125, 1.0]
+    assert prmtop.read('RADIUS_SET') == radii
+
+
+@pytest.mark.parametrize('topology', TOPOLOGIES)
+def test_prmtop_index(topology):
+    prmtop = Prmtop(DATA.joinpath(topology))
+    index = PrmtopIndex(DATA.joinpath(topology))
+    assert index.sections == prmtop.sections
+    for flag in prmtop.sections:
+        values = prmtop.read(flag)
+        if prmtop.sections[flag].format.kind == 'A':
+            assert index.section(flag).tolist() == values
+        else:
+            assert np.array_equal(index.section(flag), np.array(values))
+    assert index.natom == prmtop.natom
+
+
+def test_prmtop_index_metadata():
+    index = PrmtopIndex(DATA.joinpath('leap/structure.solv.top'))
+    assert index.n_waters == 2824
+    assert index.box_type == 'truncated_octahedron'
+    assert not index.is_cph
+    cph_index = PrmtopIndex(DATA.joinpath('parmed/cln025.cpH.prmtop'))
+    assert cph_index.is_cph
+    assert cph_index.box_type == 'truncated_octahedron'
+
+
+def test_prmtop_index_cache(tmp_path):
+    path = tmp_path.joinpath('structure.solv.top')
+    shutil.copy(DATA.joinpath('leap/structure.solv.top'), path)
+    # Not stored by default
+    PrmtopIndex(path)
+    assert [file.name for file in tmp_path.iterdir()] == ['structure.solv.top']
+
+    cache_path = tmp_path.joinpath('cache')
+    index = PrmtopIndex(path, cache_path=str(cache_path))
+    stored = list(cache_path.iterdir())
+    assert len(stored) == 1
+    assert PrmtopIndex(path, cache_path=str(cache_path)).load_index() == index.sections
+
+    # A modified topology is scanned again
+    index.write({'BOX_DIMENSIONS': [90.0, 45.5, 46.25, 47.125, 1.0]})
+    assert PrmtopIndex(path, cache_path=str(cache_path)).section('BOX_DIMENSIONS').tolist() == [90.0, 45.5, 46.25, 47.125, 1.0]
+
+
+def test_check_coordinates(tmp_path):
+    crd_path = tmp_path.joinpath('structure.crd')
+    crd_path.write_text('default_name\n  8607\n')
+    index = check_coordinates(str(DATA.joinpath('leap/structure.solv.top')), str(crd_path))
+    assert index.natom == 8607
+    assert check_coordinates(str(tmp_path.joinpath('missing.top')), str(crd_path)) is None
@@ -1,8 +1,31 @@
 # type: ignore
+from pathlib import Path
+import numpy as np
 from biobb_common.tools import test_fixtures as fx
+from biobb_amber.leap.prmtop import PrmtopIndex
+from biobb_amber.parmed.common import hmass_repartition
 from biobb_amber.parmed.parmed_hmassrepartition import parmed_hmassrepartition
 
 
+def parmed_masses(top_path, hydrogen_mass=3.024):
+    """ Masses repartitioned atom by atom like the hmassrepartition action of parmed (water included): the mass of each
+    hydrogen is taken from the first non hydrogen of its bond partners sorted by index """
+    index = PrmtopIndex(top_path)
+    mass = index.section("MASS").tolist()
+    atomic_number = index.section("ATOMIC_NUMBER").tolist()
+    partners = {}
+    for first, second, _ in index.section("BONDS_INC_HYDROGEN").reshape(-1, 3).tolist():
+        partners.setdefault(first // 3, set()).add(second // 3)
+        partners.setdefault(second // 3, set()).add(first // 3)
+    for atom, number in enumerate(atomic_number):
+        heavy = [partner for partner in sorted(partners.get(atom, ())) if atomic_number[partner] != 1]
+        if number != 1 or not heavy:
+            continue
+        mass[heavy[0]] -= hydrogen_mass - mass[atom]
+        mass[atom] = hydrogen_mass
+    return np.array(mass)
+
+
 class TestParmedHMassRepartition():
     def setup_class(self):
         fx.test_setup(self, 'parmed_hmassrepartition')
@@ -15,3 +38,37 @@ class TestParmedHMassRepartition():
         parmed_hmassrepartition(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_top_path'])
         assert fx.equal(self.paths['output_top_path'], self.paths['ref_output_top_path'])
+
+    def test_parmed_hmassrepartition_prmtop_cache(self):
+        prmtop_cache_path = Path(self.properties['path']).joinpath('prmtop_cache')
+        properties = dict(self.properties, prmtop_cache_path=str(prmtop_cache_path))
+        parmed_hmassrepartition(properties=properties, **self.paths)
+        assert fx.equal(self.paths['output_top_path'], self.paths['ref_output_top_path'])
+        # The section offsets of the input topology are stored for the next blocks reading it
+        index = PrmtopIndex(self.paths['input_top_path'], str(prmtop_cache_path))
+        assert [path.name for path in prmtop_cache_path.iterdir()] == [Path(index.index_path()).name]
+        assert index.load_index() == index.sections
+        parmed_hmassrepartition(properties=properties, **self.paths)
+        assert fx.equal(self.paths['output_top_path'], self.paths['ref_output_top_path'])
+
+    def test_parmed_hmassrepartition_bond_order(self):
+        # Hydrogen bonded to two heavy atoms, the one with the highest index listed first in BONDS_INC_HYDROGEN
+        index = PrmtopIndex(self.paths['input_top_path'])
+        atomic_number = index.section("ATOMIC_NUMBER")
+        bonds = index.section("BONDS_INC_HYDROGEN").reshape(-1, 3).copy()
+        pairs = [(first, second) if atomic_number[first // 3] == 1 else (second, first) for first, second, _ in bonds.tolist()]
+        last = len(pairs) - 1
+        hydrogen, heavy = pairs[last]
+        other = next(i for i, (_, partner) in enumerate(pairs) if partner > heavy)
+        bonds[other, :2] = (hydrogen, pairs[other][1])
+        top_path = str(Path(self.properties['path']).joinpath('bond_order.prmtop'))
+        index.write({"BONDS_INC_HYDROGEN": bonds.ravel().tolist()}, top_path)
+
+        output_top_path = str(Path(self.properties['path']).joinpath('bond_order.hmass.prmtop'))
+        hmass_repartition(top_path, output_top_path, exclude_water=False)
+        mass = PrmtopIndex(output_top_path).section("MASS")
+        assert np.allclose(mass, parmed_masses(top_path))
+        # The mass of the hydrogen is taken from its lowest index heavy atom
+        original = index.section("MASS")
+        assert mass[pairs[other][1] // 3] == original[pairs[other][1] // 3]
+        assert mass[heavy // 3] < original[heavy // 3]
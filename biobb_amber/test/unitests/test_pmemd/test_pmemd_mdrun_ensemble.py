@@ -0,0 +1,21 @@
+# type: ignore
+import zipfile
+from biobb_common.tools import test_fixtures as fx
+from biobb_amber.pmemd.pmemd_mdrun_ensemble import pmemd_mdrun_ensemble
+
+
+class TestPmemdMDRunEnsemble():
+    def setup_class(self):
+        fx.test_setup(self, 'pmemd_mdrun_ensemble')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_PmemdMDRunEnsemble(self):
+        pmemd_mdrun_ensemble(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_zip_path'])
+        names = zipfile.ZipFile(self.paths['output_zip_path']).namelist()
+        for replica in ('replica_001', 'replica_002'):
+            assert replica + '/md.log' in names
+            assert replica + '/md.rst7' in names
@@ -1,4 +1,5 @@
 # type: ignore
+import numpy as np
 from biobb_common.tools import test_fixtures as fx
 from biobb_amber.process.process_mdout import process_mdout
 
@@ -15,3 +16,79 @@ class TestProcessMDOut():
         process_mdout(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_dat_path'])
         assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+
+
+class TestProcessMDOutNpz():
+    def setup_class(self):
+        fx.test_setup(self, 'process_mdout_npz')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_process_mdout_npz(self):
+        process_mdout(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_dat_path'])
+        ref = np.genfromtxt(self.paths['ref_output_dat_path'], missing_values='-')
+        with np.load(self.paths['output_dat_path']) as data:
+            assert list(data.keys()) == ['TIME'] + self.properties['terms']
+            output = np.column_stack([data[key] for key in data.keys()])
+        assert np.allclose(output, ref, equal_nan=True)
+
+
+class TestProcessMDOutFollow():
+    def setup_class(self):
+        fx.test_setup(self, 'process_mdout_follow')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_process_mdout_follow(self):
+        process_mdout(properties=self.properties, **self.paths)
+        # A second poll of the unchanged log must not add any record
+        process_mdout(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_dat_path'])
+        assert fx.not_empty(self.paths['output_dat_path'] + '.state')
+        assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+
+
+class TestProcessMDOutStats():
+    def setup_class(self):
+        fx.test_setup(self, 'process_mdout_stats')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_process_mdout_stats(self):
+        process_mdout(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_dat_path'])
+        assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+        assert fx.not_empty(self.paths['output_stats_path'])
+        assert fx.equal(self.paths['output_stats_path'], self.paths['ref_output_stats_path'])
+
+
+class TestProcessMDOutFollowStats():
+    def setup_class(self):
+        fx.test_setup(self, 'process_mdout_follow_stats')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_process_mdout_follow_stats(self):
+        # Follow a log written in two halves, the statistics must be those of the whole log
+        with open(self.paths['input_log_path'], 'rb') as log:
+            data = log.read()
+        paths = dict(self.paths, input_log_path='growing.log')
+        with open(paths['input_log_path'], 'wb') as log:
+            log.write(data[:len(data) // 2])
+        process_mdout(properties=self.properties, **paths)
+        with open(paths['input_log_path'], 'ab') as log:
+            log.write(data[len(data) // 2:])
+        process_mdout(properties=self.properties, **paths)
+        assert fx.not_empty(self.paths['output_dat_path'])
+        assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+        assert fx.not_empty(self.paths['output_stats_path'])
+        assert fx.equal(self.paths['output_stats_path'], self.paths['ref_output_stats_path'])
@@ -0,0 +1,24 @@
+# type: ignore
+from pathlib import Path
+import pytest
+from biobb_common.tools import test_fixtures as fx
+from biobb_amber.process.process_mdout_batch import process_mdout_batch
+
+
+class TestProcessMDOutBatch():
+    def setup_class(self):
+        fx.test_setup(self, 'process_mdout_batch')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def test_process_mdout_batch(self):
+        process_mdout_batch(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_dat_path'])
+        assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+
+    def test_process_mdout_batch_no_match(self):
+        pattern = str(Path(self.properties['path']).joinpath('missing_*', 'mdout'))
+        with pytest.raises(SystemExit, match='No log file matches input_logs_path'):
+            process_mdout_batch(input_logs_path=pattern, output_dat_path=self.paths['output_dat_path'], properties=self.properties)
@@ -0,0 +1,113 @@
+# type: ignore
+import errno
+import os
+import shutil
+from pathlib import Path
+import pytest
+from biobb_common.tools import test_fixtures as fx
+from biobb_amber import staging
+from biobb_amber.cphstats.cphstats_run import CphstatsRun
+from biobb_amber.staging import stage_file
+
+
+class TestStaging():
+    def setup_class(self):
+        fx.test_setup(self, 'staging')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        pass
+
+    def files(self, name):
+        """ Copy of the sample input to stage and path of the target, both in the test working directory """
+        folder = Path(self.properties['path']).joinpath(name)
+        folder.mkdir()
+        source = folder.joinpath('source.cpin')
+        shutil.copyfile(self.paths['input_cpin_path'], source)
+        return source, folder.joinpath('target.cpin')
+
+    def test_stage_copy(self):
+        source, target = self.files('copy')
+        assert stage_file(str(source), str(target), 'copy') == 'copy'
+        assert target.read_text() == source.read_text()
+        assert not os.path.samefile(source, target)
+
+    def test_stage_hardlink(self):
+        source, target = self.files('hardlink')
+        assert stage_file(str(source), str(target), 'hardlink') == 'hardlink'
+        assert os.path.samefile(source, target)
+
+    def test_stage_reflink(self):
+        source, target = self.files('reflink')
+        # Filesystems without copy-on-write clones fall back to a copy
+        assert stage_file(str(source), str(target), 'reflink') in ('reflink', 'copy')
+        assert target.read_text() == source.read_text()
+        assert not target.is_symlink()
+
+    def test_stage_symlink(self):
+        source, target = self.files('symlink')
+        assert stage_file(str(source), str(target), 'symlink') == 'symlink'
+        assert target.is_symlink()
+        assert os.readlink(target) == str(source.resolve())
+
+    def test_stage_move(self):
+        source, target = self.files('move')
+        content = source.read_text()
+        assert stage_file(str(source), str(target), 'move') == 'move'
+        assert not source.exists()
+        assert target.read_text() == content
+
+    def test_stage_replaces_target(self):
+        source, target = self.files('replace')
+        target.write_text('old content\n')
+        assert stage_file(str(source), str(target), 'hardlink') == 'hardlink'
+        assert target.read_text() == source.read_text()
+        # Staging a file onto itself keeps it
+        assert stage_file(str(source), str(target), 'copy') == 'copy'
+        assert fx.equal(str(source), self.paths['input_cpin_path'])
+
+    @pytest.mark.parametrize('code', [errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP])
+    def test_stage_fallback(self, monkeypatch, code):
+        def fail(*args):
+            raise OSError(code, os.strerror(code))
+        monkeypatch.setattr(staging.os, 'link', fail)
+        monkeypatch.setattr(staging, 'reflink', fail)
+        source, _ = self.files('fallback_%d' % code)
+        for strategy in ('hardlink', 'reflink'):
+            target = source.with_name(strategy + '.cpin')
+            assert stage_file(str(source), str(target), strategy) == 'copy'
+            assert target.read_text() == source.read_text()
+            assert not os.path.samefile(source, target)
+
+    def test_stage_error(self, monkeypatch):
+        def fail(*args):
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        monkeypatch.setattr(staging.os, 'link', fail)
+        source, target = self.files('error')
+        with pytest.raises(OSError):
+            stage_file(str(source), str(target), 'hardlink')
+
+    @pytest.mark.parametrize('strategy, same_input', [('hardlink', True), ('symlink', True), ('move', True), ('reflink', False)])
+    def test_staging_block(self, strategy, same_input):
+        source, _ = self.files('block_' + strategy)
+        output = source.with_name('output.dat')
+        block = CphstatsRun(input_cpin_path=str(source), input_cpout_path=self.paths['input_cpout_path'], output_dat_path=str(output),
+                            properties=dict(self.properties, staging=strategy, sandbox_path=str(source.parent)))
+        block.stage_files()
+        unique_dir = Path(block.stage_io_dict['unique_dir'])
+        staged = Path(block.stage_io_dict['in']['input_cpin_path'])
+        assert staged.parent == unique_dir
+        assert staged.read_text() == source.read_text()
+        assert os.path.samefile(source, staged) == same_input
+        # Inputs are never moved out of the host
+        assert source.exists()
+
+        Path(block.stage_io_dict['out']['output_dat_path']).write_text('output content\n')
+        block.copy_to_host()
+        assert output.read_text() == 'output content\n'
+        assert not output.is_symlink()
+
+    def test_staging_unknown_strategy(self):
+        block = CphstatsRun(properties=dict(self.properties, staging='teleport'), **self.paths)
+        assert block.staging == 'copy'
+        assert block.input_staging() == 'copy'
@@ -25,17 +25,22 @@ setuptools.setup(
         "console_scripts": [
             "amber_to_pdb = biobb_amber.ambpdb.amber_to_pdb:main",
             "cestats_run = biobb_amber.cphstats.cestats_run:main",
+            "cphstats_archive = biobb_amber.cphstats.cphstats_archive:main",
+            "cphstats_remd = biobb_amber.cphstats.cphstats_remd:main",
             "cphstats_run = biobb_amber.cphstats.cphstats_run:main",
             "cpptraj_randomize_ions = biobb_amber.cpptraj.cpptraj_randomize_ions:main",
             "leap_add_ions = biobb_amber.leap.leap_add_ions:main",
             "leap_build_linear_structure = biobb_amber.leap.leap_build_linear_structure:main",
             "leap_gen_top = biobb_amber.leap.leap_gen_top:main",
+            "leap_prepare_system = biobb_amber.leap.leap_prepare_system:main",
             "leap_solvate = biobb_amber.leap.leap_solvate:main",
             "parmed_cpinutil = biobb_amber.parmed.parmed_cpinutil:main",
             "parmed_hmassrepartition = biobb_amber.parmed.parmed_hmassrepartition:main",
             "pdb4amber_run = biobb_amber.pdb4amber.pdb4amber_run:main",
             "pmemd_mdrun = biobb_amber.pmemd.pmemd_mdrun:main",
+            "pmemd_mdrun_ensemble = biobb_amber.pmemd.pmemd_mdrun_ensemble:main",
             "process_mdout = biobb_amber.process.process_mdout:main",
+            "process_mdout_batch = biobb_amber.process.process_mdout_batch:main",
             "process_minout = biobb_amber.process.process_minout:main",
             "sander_mdrun = biobb_amber.sander.sander_mdrun:main",
         ]